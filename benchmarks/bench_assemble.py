@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""Measures how combining the scanned items into the cache scales
+
+Example:
+    python3 benchmarks/bench_assemble.py --sizes 1000 10000 100000 1000000
+
+Every size is the total number of items (binaries, applications, folders,
+files and excluded items together). The time per item should stay flat as
+the size grows. The list based assembly that build_cache used before is run
+for comparison on sizes up to --legacy-max, beyond that it takes too long.
+"""
+
+import argparse
+import random
+import time
+
+from dmenu_extended import main as dmenu_main
+
+
+def make_inputs(size, seed=0):
+    rng = random.Random(seed)
+    count = max(1, size // 10)
+    binaries = ["bin%d" % i for i in range(count)]
+    applications = [
+        {
+            "name": "App %d" % i,
+            "name_generic": "App %d" % i,
+            "command": "bin%d" % rng.randrange(count * 2),
+            "terminal": i % 7 == 0,
+            "descriptor": "app%d" % i,
+        }
+        for i in range(count)
+    ]
+    foldernames = ["/home/user/f%d/" % i for i in range(count * 3)]
+    filenames = [
+        "/home/user/f%d/file%d.txt" % (i % (count * 3), i) for i in range(count * 4)
+    ]
+    exclude_items = [rng.choice(filenames) for _ in range(count)]
+    return applications, binaries, foldernames, filenames, exclude_items
+
+
+def assemble_legacy(menu, applications, binaries_found, foldernames, filenames):
+    """The list based assembly from build_cache before it used sets and dicts"""
+    binaries = list(set(binaries_found))
+    for app in applications:
+        command = app["command"]
+        if app["terminal"]:
+            command += ";"
+        if command not in binaries:
+            if app["terminal"]:
+                menu.try_remove(app["command"], binaries)
+                menu.try_remove(app["command"].lower(), binaries)
+                menu.try_remove(command, binaries)
+                menu.try_remove(command.lower(), binaries)
+            binaries.append(command)
+    binaries = list(set(binaries))
+    other = menu.sort_shortest(binaries + foldernames + filenames)
+    for item in menu.prefs["exclude_items"]:
+        try:
+            other.remove(item)
+        except ValueError:
+            pass
+    return other + ["rebuild cache"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10**3, 10**4, 10**5, 10**6]
+    )
+    parser.add_argument("--legacy-max", type=int, default=10**4)
+    args = parser.parse_args()
+
+    menu = dmenu_main.dmenu()
+    print("%10s %12s %12s %14s" % ("items", "seconds", "us/item", "legacy us/item"))
+    for size in args.sizes:
+        applications, binaries, foldernames, filenames, exclude_items = make_inputs(
+            size
+        )
+        menu.prefs = dict(
+            dmenu_main.default_prefs,
+            include_binaries=True,
+            filter_binaries=False,
+            include_applications=True,
+            alias_applications=False,
+            include_items=[],
+            exclude_items=exclude_items,
+            abbreviate_homedir=False,
+            path_aliasFile="",
+        )
+        start = time.perf_counter()
+        other = menu.assemble_cache(
+            applications, binaries, list(foldernames), list(filenames)
+        )[3]
+        elapsed = time.perf_counter() - start
+
+        legacy = ""
+        if size <= args.legacy_max:
+            start = time.perf_counter()
+            expected = assemble_legacy(
+                menu, applications, binaries, list(foldernames), list(filenames)
+            )
+            legacy = "%.2f" % ((time.perf_counter() - start) * 10**6 / size)
+            # The legacy assembly ordered binaries through a set
+            assert sorted(other) == sorted(expected), "assembled items differ"
+        print(
+            "%10d %12.3f %12.2f %14s" % (size, elapsed, elapsed * 10**6 / size, legacy)
+        )
+
+
+if __name__ == "__main__":
+    main()
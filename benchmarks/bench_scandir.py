@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+"""Compares the folder scan used by build_cache with the original os.walk loop
+
+Example:
+    python3 benchmarks/bench_scandir.py --entries 100000
+
+Wall time is reported per 100k entries of the generated tree. If strace is
+installed every variant is also run once under `strace -f -c` and the number
+of system calls it made is reported, again per 100k entries.
+"""
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from bench_walk import best_of, walk_os
+from dmenu_extended import scanner
+from synthetic import generate_tree
+
+variants = {
+    "startup": lambda path, rules: None,
+    "os.walk": lambda path, rules: walk_os([path], rules),
+    "scanner": lambda path, rules: scanner.scan([path], rules)[:2],
+}
+
+
+def make_rules():
+    return scanner.ScanRules(
+        valid_extensions=[".pdf", ".txt", ".png", ".py", ".mp3", ".md"],
+        global_ignore_folders=["node_modules"],
+    )
+
+
+def count_entries(path):
+    count = 0
+    for _, dirs, files in os.walk(path):
+        count += len(dirs) + len(files)
+    return count
+
+
+def count_syscalls(variant, path):
+    """Runs one scan under strace, returns {syscall: calls} or None"""
+    strace = shutil.which("strace")
+    if strace is None:
+        return None
+    with tempfile.NamedTemporaryFile(mode="r", suffix=".strace") as out:
+        command = [sys.executable, os.path.abspath(__file__), "--path", path]
+        subprocess.run(
+            [strace, "-f", "-c", "-o", out.name] + command + ["--only", variant],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        calls = {}
+        for line in out.read().splitlines():
+            # % time, seconds, usecs/call, calls, [errors,] syscall
+            match = re.match(
+                r"\s*[\d.]+\s+[\d.]+\s+\d+\s+(\d+)\s+(?:\d+\s+)?(\w+)$", line
+            )
+            if match and match.group(2) != "total":
+                calls[match.group(2)] = int(match.group(1))
+        return calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=10**5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--path", help="Use (or create) the tree at this path")
+    parser.add_argument("--only", choices=sorted(variants), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.only is not None:
+        # A single scan, used when counting system calls
+        variants[args.only](args.path, make_rules())
+        return
+
+    tmp = None
+    path = args.path
+    if path is None:
+        tmp = tempfile.mkdtemp(prefix="dmenu-extended-bench-")
+        path = os.path.join(tmp, "home")
+    if not os.path.exists(path):
+        print("Generating " + str(args.entries) + " entries in " + path)
+        generate_tree(path, entries=args.entries)
+
+    rules = make_rules()
+    try:
+        scale = 10**5 / count_entries(path)
+        # Starting the interpreter is not part of the scan
+        startup = count_syscalls("startup", path)
+        print("%-10s %10s %14s %12s" % ("", "ms/100k", "syscalls/100k", "stats/100k"))
+        expected = None
+        for name, func in variants.items():
+            if name == "startup":
+                continue
+            elapsed, result = best_of(args.repeat, lambda: func(path, rules))
+            if expected is None:
+                expected = result
+            assert result == expected, name + " results differ from os.walk"
+            calls = count_syscalls(name, path)
+            syscalls = stats = "n/a"
+            if calls is not None:
+                for call, count in startup.items():
+                    calls[call] = calls.get(call, 0) - count
+                syscalls = "%d" % (sum(calls.values()) * scale)
+                stats = "%d" % (sum(v for k, v in calls.items() if "stat" in k) * scale)
+            print(
+                "%-10s %10.1f %14s %12s"
+                % (name, elapsed * 1000 * scale, syscalls, stats)
+            )
+        if startup is None:
+            print("Install strace to count system calls")
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
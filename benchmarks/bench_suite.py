@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+"""Times the build and launch paths of dmenu-extended on synthetic homes
+
+Example:
+    python3 benchmarks/bench_suite.py --sizes 10000 100000 --output new.json
+    python3 benchmarks/bench_suite.py --sizes 10000 --compare old.json
+
+For every size a home folder with that many files and folders is generated
+(see synthetic.generate_environment) along with applications, PATH folders,
+an alias file and plugins. Each size is measured in a fresh interpreter with
+HOME, XDG_CACHE_HOME, XDG_DATA_DIRS and PATH pointing at the synthetic
+environment, so nothing of the real user's setup is read.
+
+Every benchmark is run --repeat times and the fastest run is kept. The peak
+memory comes from one more run under tracemalloc. The results are written as
+JSON that --compare can read back to show the change against an earlier run.
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import synthetic
+
+# Increase when the meaning of the results changes
+results_format = 1
+
+
+def measure(name, function, repeat, memory=True):
+    """Runs function (which returns the number of items handled) and times it"""
+    runs = []
+    for _ in range(repeat):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        items = function()
+        runs.append((time.perf_counter() - wall, time.process_time() - cpu))
+    wall, cpu = min(runs)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {
+        "benchmark": name,
+        "wall_seconds": wall,
+        "cpu_seconds": cpu,
+        "peak_memory_bytes": peak,
+        "items": items,
+        "items_per_second": items / wall if wall > 0 else None,
+    }
+
+
+def worker(args):
+    """Runs the benchmarks in this interpreter, the environment is already set"""
+    from dmenu_extended import main
+
+    d = main.d
+    results = []
+
+    def run(name, function, repeat=args.repeat):
+        result = measure(name, function, repeat, memory=not args.no_memory)
+        result["cache_format"] = cache_format
+        results.append(result)
+
+    def send_stream():
+        stream = d.cache_stream()
+        try:
+            with open(os.devnull, "wb") as f:
+                stream.send(f.fileno())
+        finally:
+            stream.close()
+        return lines
+
+    def resolve_aliases():
+        for title in titles:
+            d.retrieve_aliased_command(title)
+        return len(titles)
+
+    def dispatch_plugins():
+        for text in inputs:
+            d.find_plugin(text)
+        return len(inputs)
+
+    rng = random.Random(0)
+    for cache_format in args.formats:
+        run(
+            "build_cache_full",
+            lambda: len(d.build_cache(full=True, format=cache_format)),
+        )
+        run(
+            "build_cache_incremental",
+            lambda: len(d.build_cache(format=cache_format)),
+        )
+        lines = d.cache_load().count("\n")
+        run("cache_load", lambda: d.cache_load().count("\n"))
+        run("cache_stream", send_stream)
+        run("cache_filter", lambda: len(d.cache_filter("file1")))
+
+        aliased = d.cache_open(main.file_cache_aliases).split("\n")[:-1]
+        titles = [rng.choice(aliased) for _ in range(200)] if aliased else []
+        titles += ["not an alias %d" % index for index in range(20)]
+        run("alias_resolution", resolve_aliases)
+
+        plugins = [entry["title"] for entry in d.plugin_manifest() if entry["module"]]
+        inputs = [rng.choice(plugins) + "query" for _ in range(1000)]
+        inputs += ["/not/a/plugin/%d" % index for index in range(100)]
+        run("plugin_dispatch", dispatch_plugins)
+    return results
+
+
+def run_size(entries, args):
+    """Generates an environment of the given size and benchmarks it"""
+    root = tempfile.mkdtemp(prefix="dmenu-extended-bench-", dir=args.path)
+    try:
+        environment = synthetic.generate_environment(
+            root,
+            entries=entries,
+            fanout=args.fanout,
+            depth=args.depth,
+            applications=args.applications,
+            binaries=args.binaries,
+            aliases=args.aliases,
+            plugins=args.plugins,
+            seed=args.seed,
+        )
+        command = [sys.executable, os.path.abspath(__file__), "--worker"]
+        command += ["--repeat", str(args.repeat), "--formats"] + args.formats
+        if args.no_memory:
+            command.append("--no-memory")
+        output = subprocess.run(
+            command,
+            env=dict(os.environ, **environment),
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    results = json.loads(output)
+    for result in results:
+        result["entries"] = entries
+    return results
+
+
+def key(result):
+    return result["benchmark"], result["entries"], result["cache_format"]
+
+
+def print_results(results, baseline=None):
+    previous = {}
+    if baseline is not None:
+        previous = {key(result): result for result in baseline["results"]}
+    print(
+        "%-24s %9s %7s %10s %10s %9s %14s %8s"
+        % (
+            "Benchmark",
+            "Entries",
+            "Format",
+            "Wall (ms)",
+            "CPU (ms)",
+            "Peak MB",
+            "Items/s",
+            "Change",
+        )
+    )
+    for result in results:
+        change = ""
+        old = previous.get(key(result))
+        if old is not None and old["wall_seconds"] > 0:
+            change = "%+.0f%%" % (
+                (result["wall_seconds"] / old["wall_seconds"] - 1) * 100
+            )
+        peak = result["peak_memory_bytes"]
+        rate = result["items_per_second"]
+        print(
+            "%-24s %9d %7s %10.1f %10.1f %9s %14s %8s"
+            % (
+                result["benchmark"],
+                result["entries"],
+                result["cache_format"],
+                result["wall_seconds"] * 1000,
+                result["cpu_seconds"] * 1000,
+                "-" if peak is None else "%.1f" % (peak / 2**20),
+                "-" if rate is None else "%.0f" % rate,
+                change,
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10**4])
+    parser.add_argument("--formats", nargs="+", default=["text", "binary"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--applications", type=int, default=200)
+    parser.add_argument("--binaries", type=int, default=2000)
+    parser.add_argument("--aliases", type=int, default=200)
+    parser.add_argument("--plugins", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-memory", action="store_true", help="Skip the runs that measure memory"
+    )
+    parser.add_argument("--path", help="Where to generate the environments")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Show the change against this JSON file")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # Anything printed while benchmarking goes to stderr, stdout is for
+        # the results
+        with contextlib.redirect_stdout(sys.stderr):
+            results = worker(args)
+        json.dump(results, sys.stdout)
+        raise SystemExit()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("format") != results_format:
+            raise SystemExit(args.compare + " was written by another version")
+
+    results = []
+    for entries in args.sizes:
+        results += run_size(entries, args)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "format": results_format,
+                    "created": datetime.datetime.now().isoformat(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "arguments": {
+                        name: value
+                        for name, value in vars(args).items()
+                        if name not in ["output", "compare", "worker", "path"]
+                    },
+                    "results": results,
+                },
+                f,
+                indent=4,
+            )
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+"""Compares the serial and parallel folder scans used by build_cache
+
+Example:
+    python3 benchmarks/bench_walk.py --entries 100000 --workers 1 2 4 8
+
+When the tree is in the page cache the scan is limited by the interpreter and
+threads do not help. Drop the caches between runs (as root:
+echo 3 > /proc/sys/vm/drop_caches) or use --latency-ms, which delays every
+directory read to mimic a cold disk or network file system.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from dmenu_extended import scanner
+from synthetic import generate_tree
+
+
+def walk_os(roots, rules):
+    """The os.walk loop that build_cache originally used"""
+    filenames = []
+    foldernames = []
+    for watchdir in roots:
+        for root, dirs, files in os.walk(
+            watchdir, topdown=True, followlinks=rules.follow_symlinks
+        ):
+            dirs[:] = [
+                d
+                for d in dirs
+                if os.path.join(root, d) not in rules.ignore_folders
+                and d not in rules.global_ignore_folders
+            ]
+            if rules.scan_hidden_folders is False:
+                dirs[:] = [d for d in dirs if d.startswith(".") is False]
+            if rules.scan_hidden_folders or root.find("/.") == -1:
+                for name in files:
+                    if rules.include_hidden_files or name.startswith(".") is False:
+                        if (
+                            rules.valid_extensions is True
+                            or os.path.splitext(name)[1].lower()
+                            in rules.valid_extensions
+                        ):
+                            filenames.append(os.path.join(root, name))
+                for name in dirs:
+                    foldernames.append(os.path.join(root, name) + "/")
+    return filenames, foldernames
+
+
+def best_of(repeat, func):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=10**5)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--path", help="Use (or create) the tree at this path")
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=0,
+        help="Simulated delay added to every directory read",
+    )
+    args = parser.parse_args()
+
+    if args.latency_ms > 0:
+        scandir = os.scandir
+
+        def slow_scandir(path):
+            time.sleep(args.latency_ms / 1000)
+            return scandir(path)
+
+        os.scandir = slow_scandir
+
+    tmp = None
+    path = args.path
+    if path is None:
+        tmp = tempfile.mkdtemp(prefix="dmenu-extended-bench-")
+        path = os.path.join(tmp, "home")
+    if not os.path.exists(path):
+        print("Generating " + str(args.entries) + " entries in " + path)
+        generate_tree(path, entries=args.entries)
+
+    rules = scanner.ScanRules(
+        valid_extensions=[".pdf", ".txt", ".png", ".py", ".mp3", ".md"],
+        global_ignore_folders=["node_modules"],
+    )
+    try:
+        baseline, expected = best_of(args.repeat, lambda: walk_os([path], rules))
+        print("%-16s %8.3f s" % ("os.walk", baseline))
+        for workers in args.workers:
+            elapsed, result = best_of(
+                args.repeat, lambda: scanner.scan([path], rules, workers=workers)[:2]
+            )
+            assert result == expected, "scan results differ from os.walk"
+            print(
+                "%-16s %8.3f s  %5.2fx"
+                % ("%d worker(s)" % workers, elapsed, baseline / elapsed)
+            )
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
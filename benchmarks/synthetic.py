@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+"""Reproducible synthetic home directories for benchmarking dmenu-extended"""
+
+import argparse
+import json
+import os
+import random
+
+extensions = [
+    "pdf",
+    "txt",
+    "png",
+    "jpg",
+    "py",
+    "mp3",
+    "md",
+    "html",
+    "c",
+    "h",
+    "json",
+    "o",
+    "log",
+    "",
+]
+
+
+def generate_tree(
+    base,
+    entries=10**4,
+    fanout=8,
+    depth=6,
+    hidden_ratio=0.05,
+    symlink_ratio=0.01,
+    seed=0,
+):
+    """Creates roughly `entries` files and folders below base
+
+    Folders are created breadth first with up to `fanout` children each and
+    no deeper than `depth`, the remaining entries are spread over them as
+    files with a mix of extensions. Some folders and files are hidden and a
+    few symlinks (to folders and to files) are added. The same arguments
+    always produce the same tree. Returns the number of entries created.
+    """
+    rng = random.Random(seed)
+    os.makedirs(base, exist_ok=True)
+    folders = [base]
+    levels = {base: 0}
+    created = 0
+    folder_budget = max(1, entries // 10)
+
+    index = 0
+    while index < len(folders) and created < folder_budget:
+        parent = folders[index]
+        index += 1
+        if levels[parent] >= depth:
+            continue
+        for child in range(rng.randint(1, fanout)):
+            name = "dir%d" % child
+            if rng.random() < hidden_ratio:
+                name = "." + name
+            path = os.path.join(parent, name)
+            os.mkdir(path)
+            folders.append(path)
+            levels[path] = levels[parent] + 1
+            created += 1
+            if created >= folder_budget:
+                break
+
+    files = []
+    while created < entries:
+        folder = rng.choice(folders)
+        extension = rng.choice(extensions)
+        name = "file%d" % created
+        if rng.random() < hidden_ratio:
+            name = "." + name
+        if extension:
+            name += "." + extension
+        path = os.path.join(folder, name)
+        with open(path, "w"):
+            pass
+        files.append(path)
+        created += 1
+
+    for _ in range(int(entries * symlink_ratio)):
+        folder = rng.choice(folders)
+        target = rng.choice(folders + files)
+        path = os.path.join(folder, "link%d" % created)
+        if not os.path.lexists(path):
+            os.symlink(target, path)
+            created += 1
+
+    return created
+
+
+def generate_applications(folder, count, seed=0):
+    """Writes count .desktop files, some of them for terminal programs"""
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    for index in range(count):
+        with open(os.path.join(folder, "app%d.desktop" % index), "w") as f:
+            f.write("[Desktop Entry]\n")
+            f.write("Type=Application\n")
+            f.write("Name=Application %d\n" % index)
+            f.write("GenericName=Generic application %d\n" % index)
+            f.write("Exec=app%d %%U\n" % index)
+            f.write("Terminal=%s\n" % ("true" if rng.random() < 0.1 else "false"))
+
+
+def generate_path(base, folders, count, applications=0):
+    """Creates count executables spread over folders, returns the folders
+
+    The programs named by the first applications .desktop files (see
+    generate_applications) are among them.
+    """
+    paths = [os.path.join(base, "bin%d" % index) for index in range(folders)]
+    for path in paths:
+        os.makedirs(path, exist_ok=True)
+    names = ["app%d" % index for index in range(min(applications, count))]
+    names += ["cmd%d" % index for index in range(count - len(names))]
+    for index, name in enumerate(names):
+        path = os.path.join(paths[index % folders], name)
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\n")
+        os.chmod(path, 0o755)
+    return paths
+
+
+def generate_aliases(path, count):
+    """Writes a shell alias file with count aliases"""
+    with open(path, "w") as f:
+        for index in range(count):
+            f.write("alias al%d='cmd%d --option=%d'\n" % (index, index, index))
+
+
+def generate_plugins(folder, count):
+    """Writes count plugins that do nothing, titled Bench <n>"""
+    os.makedirs(folder, exist_ok=True)
+    for index in range(count):
+        with open(os.path.join(folder, "plugin_bench%d.py" % index), "w") as f:
+            f.write("import dmenu_extended\n\n\n")
+            f.write("class extension(dmenu_extended.dmenu):\n")
+            f.write('    title = "Bench %d: "\n' % index)
+            f.write("    is_submenu = False\n\n")
+            f.write("    def run(self, inputText):\n")
+            f.write("        pass\n")
+
+
+def generate_environment(
+    root,
+    entries=10**4,
+    fanout=8,
+    depth=6,
+    applications=200,
+    binaries=2000,
+    path_folders=4,
+    aliases=200,
+    plugins=10,
+    seed=0,
+):
+    """Creates a home folder, applications, PATH, aliases and plugins below root
+
+    The home folder holds a tree made by generate_tree and a preferences
+    file that scans it, includes the binaries and reads the alias file.
+    Returns the environment variables that make dmenu-extended use it all,
+    PATH holds only the generated folders.
+    """
+    home = os.path.join(root, "home")
+    generate_tree(home, entries=entries, fanout=fanout, depth=depth, seed=seed)
+    generate_applications(
+        os.path.join(root, "share", "applications"), applications, seed=seed
+    )
+    paths = generate_path(root, path_folders, binaries, applications=applications)
+    alias_file = os.path.join(home, ".bash_aliases")
+    generate_aliases(alias_file, aliases)
+
+    config = os.path.join(home, ".config", "dmenu-extended")
+    generate_plugins(os.path.join(config, "plugins"), plugins)
+    os.makedirs(os.path.join(config, "config"), exist_ok=True)
+    with open(
+        os.path.join(config, "config", "dmenuExtended_preferences.txt"), "w"
+    ) as f:
+        json.dump(
+            {
+                "watch_folders": ["~/"],
+                "include_binaries": True,
+                "include_applications": True,
+                "alias_applications": True,
+                "path_aliasFile": alias_file,
+                "frequently_used": 0,
+            },
+            f,
+            indent=4,
+        )
+
+    return {
+        "HOME": home,
+        "XDG_CACHE_HOME": os.path.join(root, "cache"),
+        "XDG_DATA_HOME": os.path.join(home, ".local", "share"),
+        "XDG_DATA_DIRS": os.path.join(root, "share"),
+        "PATH": ":".join(paths),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", help="Where to create the tree")
+    parser.add_argument("--entries", type=int, default=10**4)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--environment",
+        action="store_true",
+        help="Also create applications, PATH folders, aliases and plugins next to"
+        " a home folder holding the tree, and print the variables that use them",
+    )
+    args = parser.parse_args()
+    if args.environment:
+        variables = generate_environment(
+            args.path,
+            entries=args.entries,
+            fanout=args.fanout,
+            depth=args.depth,
+            seed=args.seed,
+        )
+        # Keep the usual programs available in the shell that uses these
+        variables["PATH"] += ":$PATH"
+        for name, value in variables.items():
+            print("export %s=%s" % (name, value))
+        raise SystemExit()
+    count = generate_tree(
+        args.path,
+        entries=args.entries,
+        fanout=args.fanout,
+        depth=args.depth,
+        seed=args.seed,
+    )
+    print("Created " + str(count) + " entries in " + args.path)
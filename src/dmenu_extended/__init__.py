@@ -1 +1,24 @@
-from .main import *
+import importlib
+import importlib.util
+
+# The contents of main are exposed lazily so that light-weight entry points,
+# such as the daemon client, do not pay for loading the whole launcher.
+
+
+def __getattr__(name):
+    if name.startswith("__") and name != "__all__":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if importlib.util.find_spec("." + name, __name__) is not None:
+        # A submodule that has not been imported yet (from ... import scanner)
+        return importlib.import_module("." + name, __name__)
+    main = importlib.import_module(".main", __name__)
+    if name == "__all__":
+        return [key for key in vars(main) if not key.startswith("_")]
+    try:
+        return getattr(main, name)
+    except AttributeError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__getattr__("__all__")))
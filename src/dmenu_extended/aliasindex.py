@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+"""The alias store, a hash table on disk from menu titles to commands
+
+Resolving an alias reads the header, the two offsets of the title's bucket
+and the bucket itself, however many aliases there are. Buckets hold one
+entry on average. The file is written once by a rebuild and never changed,
+aliases added between rebuilds are appended to a file of their own (see
+append() and find_added()).
+
+Layout (all integers little endian):
+
+    header      magic "DMXA", version (u32), number of buckets (u32, a power
+                of two)
+    buckets     the offset in the entries where each bucket starts (u32),
+                and one more for where the last bucket ends
+    entries     title length (u32), command length (u32), title, command,
+                grouped by bucket, the bucket of a title being the low bits
+                of its CRC-32
+"""
+
+import json
+import os
+import struct
+import zlib
+
+from . import cachefile
+
+magic = b"DMXA"
+version = 1
+
+header = struct.Struct("<4sII")
+offset = struct.Struct("<I")
+entry = struct.Struct("<II")
+
+
+def bucket_of(title, buckets):
+    return zlib.crc32(title) & (buckets - 1)
+
+
+def write(path, aliases):
+    """Writes the store for a list of [title, command] pairs
+
+    Only the first command given for a title is kept. The file is replaced
+    atomically.
+    """
+    first = {}
+    for title, command in aliases:
+        first.setdefault(cachefile.encode(title), cachefile.encode(command))
+    buckets = 1
+    while buckets < len(first):
+        buckets *= 2
+    grouped = [[] for _ in range(buckets)]
+    for title, command in first.items():
+        grouped[bucket_of(title, buckets)].append(
+            entry.pack(len(title), len(command)) + title + command
+        )
+    data = [b"".join(group) for group in grouped]
+    starts = [0]
+    for chunk in data:
+        starts.append(starts[-1] + len(chunk))
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header.pack(magic, version, buckets))
+        f.write(struct.pack("<%dI" % len(starts), *starts))
+        f.write(b"".join(data))
+    os.replace(tmp, path)
+
+
+def read_at(f, position, size):
+    f.seek(position)
+    data = f.read(size)
+    if len(data) != size:
+        raise cachefile.CacheFormatError(f.name)
+    return data
+
+
+def lookup(path, title):
+    """The command of title in the store at path, None if it has none
+
+    Raises OSError if there is no store and CacheFormatError if it cannot be
+    read.
+    """
+    key = cachefile.encode(title)
+    with open(path, "rb") as f:
+        found_magic, found_version, buckets = header.unpack(read_at(f, 0, header.size))
+        if found_magic != magic or found_version != version:
+            raise cachefile.CacheFormatError(path)
+        table = header.size + offset.size * bucket_of(key, buckets)
+        start, end = struct.unpack("<2I", read_at(f, table, 2 * offset.size))
+        base = header.size + offset.size * (buckets + 1)
+        data = read_at(f, base + start, end - start)
+    position = 0
+    while position < len(data):
+        title_length, command_length = entry.unpack_from(data, position)
+        position += entry.size
+        if data[position : position + title_length] == key:
+            position += title_length
+            return cachefile.decode(data[position : position + command_length])
+        position += title_length + command_length
+    return None
+
+
+def append(path, title, command):
+    """Adds an alias to the file of those added since the store was written"""
+    line = json.dumps([title, command]) + "\n"
+    # A single write, so concurrent appends are not interleaved
+    with open(path, "a") as f:
+        f.write(line)
+
+
+def find_added(path, title):
+    """The command of title in the file written by append(), None if none"""
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    found, command = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash
+                    continue
+                if found == title:
+                    return command
+    except OSError:
+        pass
+    return None
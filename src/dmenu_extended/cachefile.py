@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+"""A binary, memory-mappable alternative to the text cache files
+
+Layout (all integers little endian):
+
+    header      magic "DMXC", version (u32), number of sections (u32)
+    sections    name (16 bytes, NUL padded), data offset (u64),
+                data length (u64), record count (u32), table offset (u64)
+    data        each section's items, one per line with a trailing newline,
+                exactly as the matching text cache file holds them
+    tables      for each section, one (offset, length) pair of u32 per record
+                relative to the section data, sorted by length then bytes
+
+A section's data can be handed to the menu as-is, and a single record can be
+found by a binary search over its table without decoding the rest.
+"""
+
+import errno
+import mmap
+import os
+import struct
+
+magic = b"DMXC"
+version = 1
+
+header = struct.Struct("<4sII")
+section_header = struct.Struct("<16sQQIQ")
+record = struct.Struct("<II")
+
+copy_buffer_size = 1 << 20
+
+
+class CacheFormatError(Exception):
+    """The file is not a binary cache this version can read"""
+
+
+def encode(item):
+    # Names that are not valid UTF-8 are written back as the original bytes
+    return item.encode("utf-8", "surrogateescape")
+
+
+def decode(data):
+    return bytes(data).decode("utf-8", "surrogateescape")
+
+
+def write(path, sections):
+    """Writes sections (an ordered mapping of name -> list of items) to path
+
+    The file is replaced atomically so readers never see a partial cache.
+    """
+    names = list(sections)
+    encoded = {name: [encode(item) for item in sections[name]] for name in names}
+    offset = header.size + section_header.size * len(names)
+
+    entries = []
+    blobs = []
+    for name in names:
+        items = encoded[name]
+        data = b"".join(item + b"\n" for item in items)
+        entries.append([name, offset, len(data), len(items)])
+        blobs.append(data)
+        offset += len(data)
+
+    tables = []
+    for entry, name in zip(entries, names):
+        positions = []
+        position = 0
+        for item in encoded[name]:
+            positions.append((len(item), item, position))
+            position += len(item) + 1
+        positions.sort()
+        table = b"".join(record.pack(start, length) for length, _, start in positions)
+        entry.append(offset)
+        tables.append(table)
+        offset += len(table)
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header.pack(magic, version, len(names)))
+        for name, data_offset, data_length, count, table_offset in entries:
+            f.write(
+                section_header.pack(
+                    name.encode("ascii"), data_offset, data_length, count, table_offset
+                )
+            )
+        for blob in blobs:
+            f.write(blob)
+        for table in tables:
+            f.write(table)
+    os.replace(tmp, path)
+
+
+class CacheFile:
+    """Read-only view of a binary cache file, backed by mmap"""
+
+    def __init__(self, path, f=None):
+        """Opens the cache at path, or reads it from f (opened from path)"""
+        self.sections = {}
+        if f is None:
+            with open(path, "rb") as f:
+                self.open(path, f)
+        else:
+            self.open(path, f)
+
+    def open(self, path, f):
+        size = os.fstat(f.fileno()).st_size
+        if size < header.size:
+            raise CacheFormatError(path)
+        self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.parse(path, size)
+        except BaseException:
+            self.map.close()
+            raise
+
+    def parse(self, path, size):
+        found_magic, found_version, count = header.unpack_from(self.map, 0)
+        if found_magic != magic or found_version != version:
+            raise CacheFormatError(path)
+        if header.size + section_header.size * count > size:
+            raise CacheFormatError(path)
+        for index in range(count):
+            name, offset, length, records, table = section_header.unpack_from(
+                self.map, header.size + section_header.size * index
+            )
+            if offset + length > size or table + records * record.size > size:
+                raise CacheFormatError(path)
+            self.sections[name.rstrip(b"\0").decode("ascii")] = (
+                offset,
+                length,
+                records,
+                table,
+            )
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.sections
+
+    def data(self, name):
+        """The raw newline separated bytes of a section, without copying"""
+        offset, length, _, _ = self.sections[name]
+        return memoryview(self.map)[offset : offset + length]
+
+    def text(self, name):
+        """The section as the contents of the matching text cache file"""
+        return decode(self.data(name))
+
+    def count(self, name):
+        return self.sections[name][2]
+
+    def record(self, name, index):
+        """The index-th record in (length, bytes) order"""
+        offset, _, _, table = self.sections[name]
+        start, length = record.unpack_from(self.map, table + index * record.size)
+        return self.map[offset + start : offset + start + length]
+
+    def contains(self, name, item):
+        """Whether item is one of the records of a section"""
+        needle = encode(item)
+        key = (len(needle), needle)
+        low = 0
+        high = self.count(name)
+        while low < high:
+            middle = (low + high) // 2
+            found = self.record(name, middle)
+            if (len(found), found) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low < self.count(name) and self.record(name, low) == needle
+
+
+class CacheSlice:
+    """A byte range of a cache file that is copied out without being read
+
+    The file is opened straight away, so the slice stays valid even if the
+    cache is replaced before it is sent.
+    """
+
+    def __init__(self, f, offset=0, length=None):
+        self.file = f
+        self.offset = offset
+        if length is None:
+            length = os.fstat(f.fileno()).st_size - offset
+        self.length = length
+
+    @classmethod
+    def open(cls, path, section=None):
+        """The whole of a text cache file, or one section of a binary cache"""
+        f = open(path, "rb")
+        try:
+            if section is None:
+                return cls(f)
+            with CacheFile(path, f) as cache:
+                offset, length, _, _ = cache.sections[section]
+            return cls(f, offset, length)
+        except BaseException:
+            f.close()
+            raise
+
+    def close(self):
+        self.file.close()
+
+    def read(self):
+        return decode(os.pread(self.file.fileno(), self.length, self.offset))
+
+    def send(self, fd):
+        """Writes the slice to fd, with sendfile where the kernel allows it"""
+        offset = self.offset
+        end = self.offset + self.length
+        if hasattr(os, "sendfile"):
+            while offset < end:
+                try:
+                    sent = os.sendfile(fd, self.file.fileno(), offset, end - offset)
+                except OSError as e:
+                    if offset == self.offset and e.errno in (
+                        errno.EINVAL,
+                        errno.ENOSYS,
+                        errno.EOPNOTSUPP,
+                    ):
+                        break
+                    raise
+                if sent == 0:
+                    # The file was truncated while being sent
+                    return
+                offset += sent
+            else:
+                return
+        buffer = bytearray(copy_buffer_size)
+        view = memoryview(buffer)
+        while offset < end:
+            count = os.preadv(self.file.fileno(), [view[: end - offset]], offset)
+            if count == 0:
+                return
+            write_all(fd, view[:count])
+            offset += count
+
+
+def write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+class Stream:
+    """Text and cache slices that are written out one after the other"""
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    def close(self):
+        for part in self.parts:
+            if isinstance(part, CacheSlice):
+                part.close()
+
+    def read(self):
+        return "".join(
+            part.read() if isinstance(part, CacheSlice) else part for part in self.parts
+        )
+
+    def send(self, fd):
+        for part in self.parts:
+            if isinstance(part, CacheSlice):
+                part.send(fd)
+            elif part:
+                write_all(fd, encode(part))
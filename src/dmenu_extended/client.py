@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# This module is imported on every key press when the daemon is in use so it
+# must stay free of imports from the rest of the package (and anything slow).
+
+import array
+import json
+import os
+import socket
+import sys
+
+socket_name = "dmenu-extended.sock"
+
+
+def socket_path():
+    """Returns the path of the daemon socket, or None if it cannot be placed
+
+    The socket lives in $XDG_RUNTIME_DIR, which is private to the user. No
+    fallback location is used as a world-writable directory such as /tmp would
+    allow other users to impersonate the daemon.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if not runtime_dir:
+        return None
+    return os.path.join(runtime_dir, socket_name)
+
+
+def connect(path=None):
+    """Returns a socket connected to the daemon, or None if none is running"""
+    if path is None:
+        path = socket_path()
+    if path is None:
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def send_request(sock, argv, fds=(0, 1, 2)):
+    """Sends a launch request to the daemon and returns the exit status
+
+    The standard streams are passed to the daemon so that anything the menu
+    prints (e.g. in debug mode) appears in the terminal of the caller.
+    """
+    payload = json.dumps(
+        {"argv": list(argv), "cwd": os.getcwd(), "env": dict(os.environ)}
+    ).encode()
+    ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))]
+    sent = sock.sendmsg([payload], ancillary)
+    sock.sendall(payload[sent:])
+    sock.shutdown(socket.SHUT_WR)
+
+    response = b""
+    while True:
+        chunk = sock.recv(64)
+        if not chunk:
+            break
+        response += chunk
+    try:
+        return int(response)
+    except ValueError:
+        # The daemon went away before reporting back
+        return 1
+
+
+def run():
+    sock = connect()
+    if sock is None:
+        from dmenu_extended import main
+
+        return main.run(*sys.argv)
+    with sock:
+        sys.exit(send_request(sock, sys.argv))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+import argparse
+import array
+import json
+import os
+import signal
+import socket
+import sys
+import traceback
+
+from . import client
+from . import generations
+from . import main
+
+
+class Daemon:
+    """Keeps a warm copy of the launcher in memory and serves menu requests
+
+    Each request is handled in a forked child so that everything loaded by the
+    daemon (preferences, plugin titles and plugins) is shared copy-on-write,
+    while any state changed by the launch dies with the child.
+    """
+
+    max_fds = 3
+
+    def __init__(self, path, debug=False):
+        self.path = path
+        self.debug = debug
+        self.fingerprint = None
+        self.server = None
+
+    def watched_paths(self):
+        return [
+            main.file_prefs,
+            # A new cache generation, see generations.py
+            os.path.join(main.path_cache, generations.link_name),
+            main.file_cache,
+            main.file_cache_binary,
+            main.file_cache_plugins,
+            main.path_plugins,
+        ]
+
+    def current_fingerprint(self):
+        out = []
+        for path in self.watched_paths():
+            try:
+                stat = os.stat(path)
+                out.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                out.append(None)
+        return out
+
+    def refresh(self):
+        """Reloads anything that changed on disk since the last request"""
+        fingerprint = self.current_fingerprint()
+        if fingerprint == self.fingerprint:
+            return
+        if self.debug:
+            print("Loading preferences, cache and plugins")
+        d = main.d
+        d.prefs = False
+        d.preloaded = {}
+        d.pinned = None
+        d.load_preferences()
+        # The scanned items are streamed from the cache file for each launch
+        content = d.cache_open(main.file_cache_plugins)
+        if content is not False:
+            d.preloaded[main.file_cache_plugins] = content
+        d.get_plugins(force=self.fingerprint is not None)
+        self.fingerprint = fingerprint
+
+    def bind(self):
+        probe = client.connect(self.path)
+        if probe is not None:
+            probe.close()
+            raise Exception("A daemon is already listening on " + self.path)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            self.server.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        self.server.listen(8)
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def receive(self, conn):
+        fds = array.array("i")
+        data, ancdata, _, _ = conn.recvmsg(
+            65536, socket.CMSG_SPACE(self.max_fds * fds.itemsize)
+        )
+        for level, kind, cmsg_data in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                usable = len(cmsg_data) - (len(cmsg_data) % fds.itemsize)
+                fds.frombytes(cmsg_data[:usable])
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        return json.loads(data), list(fds)
+
+    def handle(self, conn):
+        """Runs a single launch inside a forked child, returns the exit status"""
+        request, fds = self.receive(conn)
+        for target, fd in enumerate(fds[: self.max_fds]):
+            os.dup2(fd, target)
+            os.close(fd)
+        os.environ.clear()
+        os.environ.update(request["env"])
+        try:
+            os.chdir(request["cwd"])
+        except OSError:
+            pass
+
+        try:
+            main.run(*request["argv"])
+            status = 0
+        except SystemExit as e:
+            if e.code is None:
+                status = 0
+            elif isinstance(e.code, int):
+                status = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                status = 1
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        return status
+
+    def serve(self):
+        # Children are reaped automatically, the status goes over the socket
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        while True:
+            conn, _ = self.server.accept()
+            try:
+                self.refresh()
+            except Exception:
+                traceback.print_exc()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    self.server.close()
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    status = self.handle(conn)
+                    conn.sendall(str(status).encode())
+                finally:
+                    os._exit(status)
+            conn.close()
+
+
+def run():
+    def parse_args():
+        parser = argparse.ArgumentParser(
+            description="Keep dmenu-extended loaded in memory for faster launches"
+        )
+        parser.add_argument(
+            "--debug", action="store_true", help="Print what the daemon is doing"
+        )
+        return parser.parse_args()
+
+    args = parse_args()
+    path = client.socket_path()
+    if path is None:
+        print("XDG_RUNTIME_DIR is not set, cannot create the daemon socket.")
+        exit(1)
+
+    daemon = Daemon(path, debug=args.debug)
+    daemon.bind()
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        daemon.refresh()
+        if args.debug:
+            print("Listening on " + path)
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+
+
+if __name__ == "__main__":
+    run()
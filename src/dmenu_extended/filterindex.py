@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+"""An index over the scanned items for the colon (program:filter) menus
+
+The scanned items are split into blocks of whole lines, about block_size
+bytes each. For every trigram (three bytes) found within the names that
+make up the items, between the slashes, the index lists the blocks holding
+it, and for every file extension the blocks holding a file with that
+extension. A query only searches the blocks that can match,
+the items themselves are read from the cache the menu is built from.
+
+Layout (all integers little endian):
+
+    header      magic "DMXF", version (u32), data length (u64), checksum of
+                the data (u32), number of blocks (u32), trigrams (u32),
+                extensions (u32)
+    blocks      the offset in the data where each block starts (u64), and one
+                more for where the last block ends
+    trigrams    trigram (3 bytes), padding (1 byte), postings offset (u32),
+                postings count (u32), sorted by trigram. Trigrams found in
+                more than half of the blocks are not worth listing, their
+                count is common instead
+    extensions  extension (16 bytes, NUL padded), postings offset (u32),
+                postings count (u32), sorted by extension
+    postings    block numbers (u32) in increasing order
+"""
+
+import mmap
+import os
+import re
+import struct
+import zlib
+
+from . import cachefile
+
+magic = b"DMXF"
+version = 1
+
+header = struct.Struct("<4sIQIIII")
+block = struct.Struct("<Q")
+gram = struct.Struct("<3sxII")
+extension = struct.Struct("<16sII")
+posting = struct.Struct("<I")
+
+block_size = 1 << 16
+common = 0xFFFFFFFF
+
+# The extension of each line that ends in one, superset of os.path.splitext
+extension_pattern = re.compile(rb"(\.[^./\n]+)\n")
+# Trigrams spanning these are not listed, a query skips them
+separator_pattern = re.compile(rb"[/\n]")
+
+
+def checksum(data, base, length):
+    """A cheap check that the data is still what the index was built from"""
+    edge = min(length, 4096)
+    return zlib.crc32(
+        data[base + length - edge : base + length], zlib.crc32(data[base : base + edge])
+    )
+
+
+def write(path, items):
+    """Writes the index for items, as they appear one per line in the cache"""
+    data = b"".join(cachefile.encode(item) + b"\n" for item in items)
+
+    starts = []
+    grams = {}
+    extensions = {}
+    start = 0
+    while start < len(data):
+        end = data.find(b"\n", start + block_size) + 1 or len(data)
+        chunk = data[start:end]
+        number = len(starts)
+        starts.append(start)
+        # Folder names repeat a lot, each is only split up once per block
+        found_grams = set()
+        for name in set(separator_pattern.split(chunk)):
+            found_grams.update(zip(name, name[1:], name[2:]))
+        for found in found_grams:
+            grams.setdefault(found, []).append(number)
+        for found in set(extension_pattern.findall(chunk)):
+            if len(found) <= 16:
+                extensions.setdefault(found, []).append(number)
+        start = end
+    starts.append(len(data))
+
+    postings = []
+    count = 0
+    gram_table = []
+    for key in sorted(grams):
+        blocks = grams[key]
+        if len(blocks) * 2 > len(starts) - 1:
+            gram_table.append(gram.pack(bytes(key), 0, common))
+        else:
+            gram_table.append(gram.pack(bytes(key), count, len(blocks)))
+            postings.extend(blocks)
+            count += len(blocks)
+    extension_table = []
+    for key in sorted(extensions):
+        blocks = extensions[key]
+        extension_table.append(extension.pack(key, count, len(blocks)))
+        postings.extend(blocks)
+        count += len(blocks)
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(
+            header.pack(
+                magic,
+                version,
+                len(data),
+                checksum(data, 0, len(data)),
+                len(starts) - 1,
+                len(gram_table),
+                len(extension_table),
+            )
+        )
+        f.write(struct.pack("<%dQ" % len(starts), *starts))
+        f.write(b"".join(gram_table))
+        f.write(b"".join(extension_table))
+        f.write(struct.pack("<%dI" % len(postings), *postings))
+    os.replace(tmp, path)
+
+
+class FilterIndex:
+    """Read-only view of an index file, backed by mmap"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < header.size:
+                raise cachefile.CacheFormatError(path)
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (
+                found_magic,
+                found_version,
+                self.length,
+                self.checksum,
+                self.blocks,
+                self.grams,
+                self.extensions,
+            ) = header.unpack_from(self.map, 0)
+            if found_magic != magic or found_version != version:
+                raise cachefile.CacheFormatError(path)
+            self.gram_table = header.size + block.size * (self.blocks + 1)
+            self.extension_table = self.gram_table + gram.size * self.grams
+            self.postings = self.extension_table + extension.size * self.extensions
+            if self.postings > size:
+                raise cachefile.CacheFormatError(path)
+        except BaseException:
+            self.map.close()
+            raise
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def matches_data(self, data, base, length):
+        """Whether the index was built from the length bytes of data at base"""
+        return length == self.length and checksum(data, base, length) == self.checksum
+
+    def block_range(self, number):
+        offset = header.size + block.size * number
+        return struct.unpack_from("<2Q", self.map, offset)
+
+    def lookup(self, table, entry, count, key):
+        """The (offset, count) of a key's postings, None if it is not listed"""
+        low = 0
+        high = count
+        while low < high:
+            middle = (low + high) // 2
+            found = entry.unpack_from(self.map, table + middle * entry.size)
+            if found[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < count:
+            found = entry.unpack_from(self.map, table + low * entry.size)
+            if found[0] == key:
+                return found[1:]
+        return None
+
+    def postings_of(self, offset, count):
+        return struct.unpack_from(
+            "<%dI" % count, self.map, self.postings + offset * posting.size
+        )
+
+    def blocks_containing(self, needle):
+        """The numbers of the blocks that may contain needle (bytes)"""
+        candidates = None
+        for start in range(len(needle) - 2):
+            key = needle[start : start + 3]
+            if separator_pattern.search(key):
+                continue
+            found = self.lookup(self.gram_table, gram, self.grams, key)
+            if found is None:
+                return []
+            offset, count = found
+            if count == common:
+                continue
+            blocks = set(self.postings_of(offset, count))
+            candidates = blocks if candidates is None else candidates & blocks
+            if not candidates:
+                return []
+        if candidates is None:
+            return range(self.blocks)
+        return sorted(candidates)
+
+    def blocks_with_extension(self, name):
+        """The numbers of the blocks that may hold a file with extension name"""
+        if len(name) > 16:
+            # Only shorter extensions are listed
+            return range(self.blocks)
+        found = self.lookup(
+            self.extension_table, extension, self.extensions, name.ljust(16, b"\0")
+        )
+        if found is None:
+            return []
+        return self.postings_of(*found)
+
+
+def lines_containing(data, needle, start, end):
+    """Yields each line of data[start:end] that contains needle (bytes)
+
+    start and end must be at line boundaries.
+    """
+    position = data.find(needle, start, end)
+    # An empty needle is also found at the very end
+    while position != -1 and position < end:
+        line_start = data.rfind(b"\n", start, position) + 1 or start
+        line_end = data.find(b"\n", position, end)
+        if line_end == -1:
+            line_end = end
+        yield data[line_start:line_end]
+        position = data.find(needle, line_end + 1, end)
+
+
+def search(data, base, length, needle, index=None, extension_name=False):
+    """Returns the lines of the length bytes of data at base containing needle
+
+    With extension_name, needle is an extension such as b".pdf" and only the
+    lines of files with that extension are returned. The blocks to search are
+    taken from index when it was built from this data, otherwise all of the
+    data is searched.
+    """
+    if index is not None and index.matches_data(data, base, length):
+        if extension_name:
+            blocks = index.blocks_with_extension(needle)
+        else:
+            blocks = index.blocks_containing(needle)
+        ranges = [index.block_range(number) for number in blocks]
+    else:
+        ranges = [(0, length)]
+    if extension_name:
+        needle += b"\n"
+    lines = []
+    for start, end in ranges:
+        lines.extend(lines_containing(data, needle, base + start, base + end))
+    if extension_name:
+        lines = [line for line in lines if os.path.splitext(line)[1] == needle[:-1]]
+    return lines
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+"""Cache generations, so that a launch never reads a half written cache
+
+Each rebuild writes its files into a new folder, which is published by
+pointing the current symlink at it:
+
+    <cache>/generations/41/
+    <cache>/generations/42/
+    <cache>/current -> generations/42
+    <cache>/dmenuExtended_all.txt -> current/dmenuExtended_all.txt
+
+Replacing the symlink is a single rename, so readers see either the old
+generation or the new one and never a mix. A reader resolves the link once
+and then reads every file from that folder. A published folder is never
+changed again: an update writes a new generation starting from hard links
+to the files of the current one, and the files it changes are replaced
+rather than rewritten in place.
+
+The previous generations are kept for readers that resolved the link just
+before it changed, older ones are removed by collect(). The cache files
+also stay reachable under their usual names through symlinks into current.
+
+Writers hold lock() while they derive a generation from the current one and
+publish it, so that no update is made to a generation already replaced.
+"""
+
+import contextlib
+import os
+import time
+
+folder_name = "generations"
+link_name = "current"
+lock_name = "lock"
+
+# How many generations are kept besides the current one
+kept = 1
+# A generation that is still being written after this many seconds is taken
+# to be left over by a rebuild that died
+abandoned_after = 24 * 60 * 60
+
+
+def current(root):
+    """The folder of the current generation, root itself if there is none yet"""
+    try:
+        target = os.readlink(os.path.join(root, link_name))
+    except OSError:
+        return root
+    return os.path.join(root, target)
+
+
+def number_of(folder):
+    """The number of a generation folder, None for root (no generation)"""
+    name = os.path.basename(folder)
+    return int(name) if name.isdigit() else None
+
+
+@contextlib.contextmanager
+def lock(root):
+    """Held by writers from deriving a generation until publishing it"""
+    import fcntl
+
+    parent = os.path.join(root, folder_name)
+    os.makedirs(parent, exist_ok=True)
+    with open(os.path.join(parent, lock_name), "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def numbered(root):
+    """The numbers of the published generations, in increasing order"""
+    try:
+        names = os.listdir(os.path.join(root, folder_name))
+    except OSError:
+        return []
+    return sorted(int(name) for name in names if name.isdigit())
+
+
+def create(root, source=None, names=()):
+    """Makes the folder a new generation is written into, see publish()
+
+    With source (a generation folder) its files listed in names are carried
+    over as hard links.
+    """
+    import shutil
+    import tempfile
+
+    parent = os.path.join(root, folder_name)
+    os.makedirs(parent, exist_ok=True)
+    folder = tempfile.mkdtemp(prefix=".new-", dir=parent)
+    if source is None:
+        return folder
+    try:
+        for name in os.listdir(source):
+            if name not in names:
+                continue
+            path = os.path.join(source, name)
+            try:
+                os.link(path, os.path.join(folder, name))
+            except OSError:
+                shutil.copy2(path, folder)
+    except BaseException:
+        shutil.rmtree(folder, ignore_errors=True)
+        raise
+    return folder
+
+
+def publish(root, folder, names=()):
+    """Makes folder (from create) the current generation and returns its path
+
+    Each file in the new generation is made reachable as root/<name> through
+    a symlink into current. Any other of names found in root, such as files
+    left there by versions without generations, is removed.
+
+    current is never moved back to an older generation. Should a newer one
+    have been published meanwhile (by a writer not holding lock()), folder
+    is left for collect() and the path of the current generation returned.
+    """
+    parent = os.path.join(root, folder_name)
+    number = (numbered(root) or [0])[-1] + 1
+    while True:
+        target = os.path.join(parent, str(number))
+        try:
+            # Claims the number, rename then replaces the empty folder
+            os.mkdir(target)
+            break
+        except FileExistsError:
+            number += 1
+    os.rename(folder, target)
+
+    published = number_of(current(root))
+    if published is not None and published > number:
+        return current(root)
+    replace_link(os.path.join(folder_name, str(number)), os.path.join(root, link_name))
+    present = set(os.listdir(target))
+    for name in present.union(names):
+        path = os.path.join(root, name)
+        if name in present:
+            if not os.path.islink(path):
+                replace_link(os.path.join(link_name, name), path)
+        elif os.path.lexists(path):
+            os.remove(path)
+    return target
+
+
+def replace_link(target, path):
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.symlink(target, tmp)
+    os.replace(tmp, path)
+
+
+def collect(root):
+    """Removes old generations and the folders of rebuilds that died"""
+    import shutil
+
+    parent = os.path.join(root, folder_name)
+    number = number_of(current(root))
+    if number is None:
+        return
+    # A newer generation than the current one was published at the same time
+    # as it, and is left for the next rebuild to remove
+    older = [found for found in numbered(root) if found < number]
+    for found in older[: max(len(older) - kept, 0)]:
+        shutil.rmtree(os.path.join(parent, str(found)), ignore_errors=True)
+    for name in os.listdir(parent):
+        if not name.startswith(".new-"):
+            continue
+        path = os.path.join(parent, name)
+        try:
+            if os.stat(path).st_mtime < time.time() - abandoned_after:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+"""Downloads kept on disk and revalidated, used for the plugin indexes
+
+Each URL is kept in a file of its own in the given folder, named after the
+SHA-1 of the URL. The first line is a JSON header with the URL and the ETag
+and Last-Modified validators of the response, the rest is the body. When the
+file exists the request is made conditional, and a 304 Not Modified answer
+is served from it. If the server cannot be reached, times out or answers
+with an error, the copy on disk is used as well.
+"""
+
+import hashlib
+import http.client
+import json
+import os
+import urllib.error
+import urllib.request
+
+# Seconds to wait for a server, per request
+timeout = 10
+
+
+def cache_path(folder, url):
+    return os.path.join(folder, hashlib.sha1(url.encode("utf-8")).hexdigest())
+
+
+def load(path):
+    """The (header, body) saved at path, None if there is no usable copy"""
+    try:
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            body = f.read()
+    except (OSError, ValueError):
+        return None
+    if not isinstance(header, dict):
+        return None
+    return header, body
+
+
+def save(path, header, body):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(json.dumps(header).encode("utf-8") + b"\n")
+        f.write(body)
+    os.replace(tmp, path)
+
+
+def fetch(url, folder, timeout=timeout):
+    """Returns (body, error) for url, revalidating the copy kept in folder
+
+    error is the exception raised by the request when the copy on disk had
+    to be used instead, body is None if there is no such copy either.
+    """
+    path = cache_path(folder, url)
+    cached = load(path)
+    request = urllib.request.Request(url)
+    if cached is not None and cached[0].get("url") == url:
+        if cached[0].get("etag"):
+            request.add_header("If-None-Match", cached[0]["etag"])
+        if cached[0].get("last_modified"):
+            request.add_header("If-Modified-Since", cached[0]["last_modified"])
+    else:
+        cached = None
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read()
+            header = {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached is not None:
+            return cached[1], None
+        return (cached[1] if cached is not None else None), e
+    except (OSError, ValueError, http.client.HTTPException) as e:
+        # URLError and timeouts are OSErrors, ValueError is a malformed URL
+        return (cached[1] if cached is not None else None), e
+    try:
+        save(path, header, body)
+    except OSError:
+        pass
+    return body, None
+
+
+def fetch_all(urls, folder, timeout=timeout):
+    """fetch() for each of urls at the same time, results in the same order"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    if len(urls) < 2:
+        return [fetch(url, folder, timeout) for url in urls]
+    with ThreadPoolExecutor(max_workers=len(urls)) as pool:
+        return list(pool.map(lambda url: fetch(url, folder, timeout), urls))
@@ -1,8 +1,20 @@
 #!/usr/bin/env python3
 
 import argparse
+import json
 import os
+import shutil
 import subprocess
+import time
+
+timer_filename = "dmenu-extended-update-db.timer"
+
+# Where packages install user units and where systemctl --global enables them,
+# besides the folders of the user
+system_user_paths = ["/etc/systemd/user", "/usr/lib/systemd/user"]
+# Folders modified this recently may change again within the same timestamp
+# tick, the status is not saved until they are older (see scanner.py)
+mtime_grace_ns = 2 * 10**9
 
 
 def run_systemd_command(user_command, silent=False):
@@ -44,6 +56,77 @@ def detect_systemd_user_paths():
     return systemd_user_paths
 
 
+def state_path():
+    """The file the timer status is kept in, in the dmenu-extended cache folder"""
+    cache = os.getenv("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache, "dmenu-extended", "dmenuExtended_systemd_timer.json")
+
+
+def unit_folders_fingerprint(paths):
+    """The mtimes of the unit folders and their timers.target.wants folders
+
+    Installing, removing, enabling or disabling the timer adds or removes an
+    entry in one of these folders, which changes its mtime.
+    """
+    out = []
+    for path in paths:
+        for folder in [path, os.path.join(path, "timers.target.wants")]:
+            try:
+                out.append(os.stat(folder).st_mtime_ns)
+            except OSError:
+                out.append(None)
+    return out
+
+
+def read_timer_status(paths):
+    """The timer status read from the unit files, see timer_status
+
+    paths are the unit folders, the user's as well as system_user_paths.
+    """
+    if shutil.which("systemctl") is None:
+        return 0
+    if not any(os.path.exists(os.path.join(path, timer_filename)) for path in paths):
+        return 0
+    for path in paths:
+        if os.path.lexists(os.path.join(path, "timers.target.wants", timer_filename)):
+            return 1
+    return 2
+
+
+def timer_status(refresh=False):
+    """Returns 0 if the timer is not installed (or there is no systemd), 1 if it
+    is enabled and 2 if it is disabled
+
+    No systemctl command is run. The status saved by the last check is used
+    for as long as none of the unit folders changed, otherwise it is read from
+    the unit files and the timers.target.wants links and saved again. refresh
+    skips the saved status, for use after changing the timer.
+    """
+    paths = detect_systemd_user_paths() + system_user_paths
+    fingerprint = unit_folders_fingerprint(paths)
+    path = state_path()
+    if not refresh:
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+            if state["fingerprint"] == fingerprint:
+                return state["status"]
+        except (OSError, ValueError, TypeError, KeyError):
+            pass
+    status = read_timer_status(paths)
+    trusted_before = time.time_ns() - mtime_grace_ns
+    if any(mtime is not None and mtime >= trusted_before for mtime in fingerprint):
+        return status
+    try:
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"status": status, "fingerprint": fingerprint}, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+    return status
+
+
 class ServiceInstaller:
     def __init__(self):
         self.filenames = {
@@ -141,7 +224,7 @@ class ServiceInstaller:
 
     def start(self):
         run_systemd_command(["daemon-reload"])
-        target = f"{self.filenames}.timer"
+        target = self.filenames["timer"]
         if run_systemd_command(["start", target]) and run_systemd_command(
             ["enable", target]
         ):
@@ -189,6 +272,7 @@ def run():
         service_installer.install(args.rebuild_interval_mins)
         if args.start or prompt_to_start(service_installer.filenames["timer"]):
             service_installer.start()
+    timer_status(refresh=True)
 
 
 if __name__ == "__main__":
@@ -1,15 +1,22 @@
 #!/usr/bin/env python3
 
+# Only what a launch needs is imported here, anything used by a few code paths
+# (argparse, hashlib, urllib, importlib.metadata) is imported where it is used.
+# tests/test_import_time.py keeps an eye on the cost of importing this module.
+
+import collections
+import contextlib
 import importlib
+import itertools
 import json
-import operator
 import os
-import pkg_resources
 import signal
+import stat
 import subprocess
 import sys
 import time
-import urllib.request
+
+from . import aliasindex, cachefile, filterindex, generations, scanner
 
 Help = """
 Dmenu Extended command line options
@@ -23,6 +30,10 @@ Options:
     --no-settings       hide settings entry (put last)
     --no-plugins        hide plugins entries
     --no-scanned        hide scanned files
+    --only-apps         show only applications and binaries
+    --only-folders      show only folders
+    --only-files        show only files
+                        (the --only options can be combined and show nothing else)
 
 Input: text enclosed in double quotes will be fed to the menu, as if entered manually.
 """
@@ -64,10 +75,39 @@ class Version:
         return not self == other
 
 
-provided_package_versions = {
-    "dmenu-extended": Version(pkg_resources.get_distribution("dmenu-extended").version),
-    "python": Version(".".join(map(str, sys.version_info[:3]))),
-}
+_provided_package_versions = None
+
+
+def get_provided_package_versions():
+    """Returns the versions of the packages plugins may depend on
+
+    The installed version of dmenu-extended is looked up the first time this
+    is called, reading package metadata is too slow to do on every launch.
+    """
+    global _provided_package_versions
+    if _provided_package_versions is None:
+        try:
+            from importlib import metadata
+        except ImportError:  # Python < 3.8
+            import importlib_metadata as metadata
+
+        _provided_package_versions = {
+            "python": Version(".".join(map(str, sys.version_info[:3]))),
+        }
+        try:
+            _provided_package_versions["dmenu-extended"] = Version(
+                metadata.version("dmenu-extended")
+            )
+        except metadata.PackageNotFoundError:
+            pass
+    return _provided_package_versions
+
+
+def __getattr__(name):
+    # provided_package_versions used to be computed when the module was imported
+    if name == "provided_package_versions":
+        return get_provided_package_versions()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_plugin_requirements(plugin):
@@ -91,6 +131,7 @@ def get_plugin_requirements(plugin):
 
 def unsatisfied_plugin_requirements(plugin):
     unsatisfied_requirements = {}
+    provided_package_versions = get_provided_package_versions()
     for package_name, required_version in get_plugin_requirements(plugin).items():
         if (
             package_name not in provided_package_versions
@@ -107,6 +148,7 @@ path_cache = (
 )
 path_prefs = path_base + "/config"
 path_plugins = path_base + "/plugins"
+path_downloads = path_cache + "/downloads"  # See httpcache.py
 
 file_prefs = path_prefs + "/dmenuExtended_preferences.txt"
 file_cache = path_cache + "/dmenuExtended_all.txt"
@@ -115,15 +157,66 @@ file_cache_files = path_cache + "/dmenuExtended_files.txt"
 file_cache_folders = path_cache + "/dmenuExtended_folders.txt"
 file_cache_aliases = path_cache + "/dmenuExtended_aliases.txt"
 file_cache_aliasesLookup = path_cache + "/dmenuExtended_aliases_lookup.json"
+file_cache_aliasesStore = path_cache + "/dmenuExtended_aliases_store.bin"
+# Aliases added since the store was written, see aliasindex.append
+file_cache_aliasesAdded = path_cache + "/dmenuExtended_aliases_added.jsonl"
 file_cache_plugins = path_cache + "/dmenuExtended_plugins.txt"
+file_cache_plugins_manifest = path_cache + "/dmenuExtended_plugins_manifest.json"
+file_cache_snapshot = path_cache + "/dmenuExtended_snapshot.json"
+file_cache_binary = path_cache + "/dmenuExtended_cache.bin"
+file_cache_filter_index = path_cache + "/dmenuExtended_filter_index.bin"
+file_cache_profile = path_cache + "/dmenuExtended_profile.json"
+file_cache_path_index = path_cache + "/dmenuExtended_path_index.json"
+file_cache_applications = path_cache + "/dmenuExtended_applications.json"
 file_cache_frequentlyUsed_frequency = (
     path_cache + "/dmenuExtended_frequentlyUsed_frequency.json"
 )
 file_cache_frequentlyUsed_ordered = (
     path_cache + "/dmenuExtended_frequentlyUsed_ordered.json"
 )
+file_cache_frequentlyUsed_log = path_cache + "/dmenuExtended_frequentlyUsed.log"
+file_cache_frequent = path_cache + "/dmenuExtended_frequent.txt"
+file_cache_frequent_scanned = path_cache + "/dmenuExtended_frequent_scanned.txt"
+file_cache_excluded_scanned = path_cache + "/dmenuExtended_excluded_scanned.json"
+
+# The section of the binary cache that replaces each text cache file
+cache_sections = {
+    file_cache_plugins: "plugins",
+    file_cache_frequent: "frequent",
+    file_cache_frequent_scanned: "frequent_scanned",
+    file_cache_aliases: "aliases",
+    file_cache_binaries: "binaries",
+    file_cache_folders: "folders",
+    file_cache_files: "files",
+    file_cache: "all",
+}
+
+# The files written by a rebuild, read and published together as one
+# generation (see generations.py)
+generation_files = [
+    file_cache,
+    file_cache_binaries,
+    file_cache_files,
+    file_cache_folders,
+    file_cache_aliases,
+    file_cache_aliasesLookup,
+    file_cache_aliasesStore,
+    file_cache_plugins,
+    file_cache_binary,
+    file_cache_filter_index,
+    file_cache_frequent,
+    file_cache_frequent_scanned,
+    file_cache_excluded_scanned,
+]
+
+# The cache files streamed by each --only-... launch mode
+launch_modes = {
+    "--only-apps": [file_cache_aliases, file_cache_binaries],
+    "--only-folders": [file_cache_folders],
+    "--only-files": [file_cache_files],
+}
 
-d = None  # Global dmenu object - initialised near bottom of script
+d = None  # Global dmenu object - created near bottom of script
 
 default_prefs = {
     "valid_extensions": [
@@ -163,6 +256,8 @@ default_prefs = {
     "ignore_folders": [],  # Folders to exclude from the search absolute path
     "global_ignore_folders": [],  # Folders to exclude from the search only folder name
     "scan_hidden_folders": False,  # Enter hidden folders while scanning for items
+    "scan_workers": 4,  # Number of threads used to scan the watch folders
+    "cache_format": "text",  # Store the cache as "text" files or one "binary" file
     "include_hidden_files": False,  # Include hidden files in the cache
     "include_hidden_folders": False,  # Include hidden folders in the cache
     "include_items": [],  # Extra items to display - manually added
@@ -269,17 +364,28 @@ def setup_user_files():
         )
 
 
-if (
-    os.path.exists(path_plugins + "/__init__.py")
-    and os.path.exists(file_cache)
-    and os.path.exists(file_prefs)
-):
-    sys.path.append(path_base)
-else:
-    setup_user_files()
-    sys.path.append(path_base)
+plugins = None  # The user's plugins package, imported by initialise()
 
-import plugins
+
+def initialise():
+    """Prepares the user's files and imports the plugins package, once
+
+    Importing this module does not touch the file system, this is done on
+    first use instead: by the entry points, when the preferences are first
+    loaded and when plugins are needed.
+    """
+    global plugins
+    if plugins is not None:
+        return
+    if not (
+        os.path.exists(path_plugins + "/__init__.py")
+        and (os.path.exists(file_cache) or os.path.exists(file_cache_binary))
+        and os.path.exists(file_prefs)
+    ):
+        setup_user_files()
+    if path_base not in sys.path:
+        sys.path.append(path_base)
+    plugins = importlib.import_module("plugins")
 
 
 def load_plugins(debug=False):
@@ -315,55 +421,187 @@ def load_plugins(debug=False):
     return plugins_loaded
 
 
+# Desktop entries are parsed by a pool of threads when more than this many
+# need to be read (e.g. the first rebuild)
+desktop_entry_parallel_threshold = 64
+desktop_entry_workers = 8
+
+
+def parse_desktop_entry(pathname):
+    """Returns the name, generic name, command and terminal flag of an entry
+
+    None is returned if the entry has no name or command.
+    """
+    try:
+        f = open(pathname, "r", errors="ignore")
+    except OSError:
+        return None
+    with f:
+        name = None
+        name_generic = None
+        command = None
+        terminal = None
+        for line in f.readlines():
+            if line[0:5] == "Exec=" and command is None:
+                command_tmp = line[5:-1].split()
+                command = ""
+                space = ""
+                for piece in command_tmp:
+                    if piece.find("%") == -1:
+                        command += space + piece
+                        space = " "
+                    else:
+                        break
+            elif line[0:5] == "Name=" and name is None:
+                name = line[5:-1]
+            elif line[0:12] == "GenericName=" and name_generic is None:
+                name_generic = line[12:-1]
+            elif line[0:9] == "Terminal=" and terminal is None:
+                if line[9:-1].lower() == "true":
+                    terminal = True
+                else:
+                    terminal = False
+
+    if name is None or command is None:
+        return None
+    if terminal is None:
+        terminal = False
+    if name_generic is None:
+        name_generic = name
+    return {
+        "name": name,
+        "name_generic": name_generic,
+        "command": command,
+        "terminal": terminal,
+    }
+
+
+# The usage log is folded into the frecency scores when the cache is rebuilt,
+# or straight away once it grows past this many bytes
+frequent_commands_log_limit = 16384
+# Only this many commands are remembered, the lowest scores are forgotten first
+frequent_commands_limit = 1000
+# A use adds one to a command's score, which then halves every half life
+frequent_commands_half_life = 14 * 24 * 60 * 60
+
+
 def frequent_commands_store(command):
-    """Records the user's execution of a command. This involves first adding the command
-    to a dictionary, or incrementing the frequency count if it already exists.
-    That dictionary is then used to create the frequently used cache by sorting based
-    on value (frequency), then writing the sorted commands to the frequency file.
+    """Records the user's execution of a command
+
+    A line holding the time and the command is appended to the usage log in a
+    single O_APPEND write, so launches that race each other never lose a use
+    and nothing is rewritten on the way out. The log is folded into the
+    frecency scores by frequent_commands_compact.
     """
-    if os.path.exists(file_cache_frequentlyUsed_frequency) is False:
-        if d.debug:
-            print("Frequently used items does not exist, starting new...")
-        cmds = {}
-    else:
-        if d.debug:
-            print("Frequently used items cache exists, retrieving...")
-        cmds = d.load_json(file_cache_frequentlyUsed_frequency)
+    line = str(int(time.time())) + "\t" + command.replace("\n", " ") + "\n"
+    fd = os.open(
+        file_cache_frequentlyUsed_log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+    )
+    try:
+        os.write(fd, cachefile.encode(line))
+        size = os.fstat(fd).st_size
+    finally:
+        os.close(fd)
+    if size > frequent_commands_log_limit:
+        frequent_commands_compact()
 
-    if d.debug:
-        print("Adding entered command to the cache...")
-    if command in cmds.keys():
-        cmds[command] += 1
-    else:
-        cmds[command] = 1
 
-    if d.debug:
-        print("Sorting and saving the cache...")
+def frequent_commands_compact():
+    """Folds the usage log into the frecency scores and the ordered list
 
-    d.save_json(file_cache_frequentlyUsed_frequency, cmds)
-    cmds = sorted(cmds.items(), key=operator.itemgetter(1), reverse=True)
+    The scores are kept as of the last compaction, they are decayed to the
+    current time before the uses in the log are added, each decayed from
+    when it happened. Counts saved by older versions are taken as scores.
 
-    # Write the full list of commands to storage, only the required number is read
-    with open(file_cache_frequentlyUsed_ordered, "w") as f:
-        for cmd in cmds:
-            f.write(cmd[0] + "\n")
+    The log is moved aside before it is read so that launches in the meantime
+    start a new one. If a previous compaction was interrupted, the log it
+    moved aside is folded in first and the current log is left for next time.
+    """
+    import fcntl
 
+    pending = file_cache_frequentlyUsed_log + ".compacting"
+    with open(file_cache_frequentlyUsed_log + ".lock", "w") as lock:
+        # Two compactions at once would each write back only their own uses
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(pending):
+            try:
+                os.replace(file_cache_frequentlyUsed_log, pending)
+            except FileNotFoundError:
+                return
 
-def frequent_commands_retrieve(number):
-    """Retrieves the list of frequently used commands, sorted by their frequency"""
-    if os.path.exists(file_cache_frequentlyUsed_ordered) is False:
+        now = time.time()
+        try:
+            with open(file_cache_frequentlyUsed_frequency, "r") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            stored = {}
+        if "scores" in stored:
+            decay = 0.5 ** (max(now - stored["time"], 0) / frequent_commands_half_life)
+            scores = {
+                command: score * decay for command, score in stored["scores"].items()
+            }
+        else:
+            scores = stored
+
+        with open(pending, "r", errors="surrogateescape") as f:
+            for line in f:
+                used, tab, command = line.rstrip("\n").partition("\t")
+                if not tab:
+                    continue
+                try:
+                    age = max(now - int(used), 0)
+                except ValueError:
+                    age = 0
+                scores[command] = scores.get(command, 0) + 0.5 ** (
+                    age / frequent_commands_half_life
+                )
+
+        ordered = sorted(scores, key=scores.get, reverse=True)
+        del ordered[frequent_commands_limit:]
+
+        tmp = file_cache_frequentlyUsed_frequency + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(
+                {
+                    "time": now,
+                    "scores": {command: scores[command] for command in ordered},
+                },
+                f,
+                separators=(",", ":"),
+            )
+        os.replace(tmp, file_cache_frequentlyUsed_frequency)
+        tmp = file_cache_frequentlyUsed_ordered + ".tmp"
+        with open(tmp, "w", errors="surrogateescape") as f:
+            f.writelines(command + "\n" for command in ordered)
+        os.replace(tmp, file_cache_frequentlyUsed_ordered)
+        os.remove(pending)
+
+
+def frequent_commands_ranked(number):
+    """Returns up to number commands, highest frecency first
+
+    Only the ordered list written by the last compaction is read, and only as
+    far as the number of commands asked for.
+    """
+    try:
+        f = open(file_cache_frequentlyUsed_ordered, "r", errors="surrogateescape")
+    except FileNotFoundError:
         if d.debug:
             print("Frequently used items cache does not exist, will return nothing")
-        return ""
-    else:
+        return []
+    with f:
         if d.debug:
             print(
                 "Frequently used items cache exists, retrieving and clipping to "
                 + str(number)
                 + " items"
             )
-        with open(file_cache_frequentlyUsed_ordered, "r") as f:
-            return "".join(f.readlines()[:number])
+        return [line[:-1] for line in itertools.islice(f, number)]
+
+
+def frequent_commands_retrieve(number):
+    """Retrieves the frequently used commands as menu lines, best first"""
+    return "".join(command + "\n" for command in frequent_commands_ranked(number))
 
 
 class dmenu(object):
@@ -378,6 +616,15 @@ class dmenu(object):
     show_recent = True  # Show recent entries
     show_settings = True  # If false, settings will be put last (not removed)
     show_plugins = True  # If false, plugins won't be shown (but settings will)
+    show_only = None  # Cache files to show instead of everything (see launch_modes)
+    preloaded = {}  # Contents of cache files held in memory by the daemon
+    snapshot = None  # Folder listing from the last rebuild (see scanner.py)
+    path_index = None  # Executables in $PATH (see binary_index)
+    profile = None  # A profiler.Profile while a rebuild is being profiled
+    pinned = None  # The cache generation read by this process (see generation)
+    building = None  # The folder of the generation being written, if any
+    aliases_saved = False  # Whether the generation being written has a new store
+    executables = {}  # Executables looked up by which, name -> path or None
 
     def get_plugins(self, force=False):
         """Returns a list of loaded plugins
@@ -387,6 +634,7 @@ class dmenu(object):
         reloading of plugins by setting the parameter 'force' to true.
         """
 
+        initialise()
         if self.plugins_loaded is False:
             self.plugins_loaded = load_plugins(self.debug)
         elif force:
@@ -397,6 +645,142 @@ class dmenu(object):
 
         return self.plugins_loaded
 
+    def plugin_manifest(self):
+        """Returns a description of every plugin without importing them all
+
+        Each entry holds the plugin's filename, module, title and is_submenu,
+        along with the mtime, size and sha1 of its source. The entries are
+        saved in the cache directory, and a plugin is only imported again
+        (to read its title) once its source has changed. The first entry is
+        always the built-in Settings plugin, the others are in the order the
+        plugins package lists them.
+        """
+        try:
+            with open(file_cache_plugins_manifest, "r") as f:
+                stored = {entry["filename"]: entry for entry in json.load(f)}
+        except (OSError, ValueError, TypeError, KeyError):
+            stored = {}
+
+        manifest = [
+            {
+                "filename": "plugin_settings.py",
+                "module": None,
+                "title": extension.title,
+                "is_submenu": extension.is_submenu,
+            }
+        ]
+        changed = False
+        try:
+            filenames = os.listdir(path_plugins)
+        except OSError:
+            filenames = []
+        for filename in filenames:
+            if (
+                filename[-3:] != ".py"
+                or filename[0] == "."
+                or filename in ["__init__.py", "plugin_settings.py"]
+            ):
+                continue
+            path = os.path.join(path_plugins, filename)
+            try:
+                info = os.stat(path)
+                entry = stored.get(filename)
+                if (
+                    entry is None
+                    or entry["mtime_ns"] != info.st_mtime_ns
+                    or entry["size"] != info.st_size
+                ):
+                    import hashlib
+
+                    with open(path, "rb") as f:
+                        sha1 = hashlib.sha1(f.read()).hexdigest()
+                    if entry is None or entry["sha1"] != sha1:
+                        entry = self.describe_plugin(filename[:-3])
+                    entry = dict(
+                        entry,
+                        filename=filename,
+                        module=filename[:-3],
+                        mtime_ns=info.st_mtime_ns,
+                        size=info.st_size,
+                        sha1=sha1,
+                    )
+                    changed = True
+            except (OSError, KeyError):
+                continue
+            manifest.append(entry)
+
+        if changed or len(manifest) - 1 != len(stored):
+            try:
+                self.save_json(file_cache_plugins_manifest, manifest[1:])
+            except OSError as e:
+                if self.debug:
+                    print("Could not save the plugin manifest: " + str(e))
+        return manifest
+
+    def describe_plugin(self, module):
+        """Imports a plugin and returns its title and is_submenu
+
+        The title is None if the plugin could not be loaded.
+        """
+        if self.debug:
+            print("Reading the title of plugin " + module)
+        initialise()
+        name = "plugins." + module
+        importlib.invalidate_caches()
+        try:
+            if name in sys.modules:
+                importlib.reload(sys.modules[name])
+            plugin = importlib.import_module(name).extension()
+            return {
+                "title": plugin.title,
+                "is_submenu": getattr(plugin, "is_submenu", False) is True,
+            }
+        except Exception as e:
+            print("Error loading plugin " + module + ": " + str(e))
+            return {"title": None, "is_submenu": False}
+
+    def load_plugin(self, entry):
+        """Returns an instance of the plugin described by a manifest entry"""
+        if self.plugins_loaded is not False:
+            # Plugins loaded ahead of time (e.g. by the daemon)
+            for plugin in self.plugins_loaded:
+                if plugin["filename"] == entry["filename"]:
+                    return plugin["plugin"]
+        if entry["module"] is None:
+            return extension()
+        initialise()
+        return importlib.import_module("plugins." + entry["module"]).extension()
+
+    def find_plugin(self, out):
+        """Returns (plugin, title) for the plugin that out refers to, or None
+
+        When more than one plugin title starts out the last plugin wins.
+        """
+        self.load_preferences()
+        titles = {}
+        for index, entry in enumerate(self.plugin_manifest()):
+            if entry["title"] is None:
+                continue
+            title = entry["title"].strip()
+            if entry["is_submenu"]:
+                title = self.prefs["indicator_submenu"] + " " + title
+            titles[title] = index, entry, title
+
+        found = None
+        for length in set(map(len, titles)):
+            match = titles.get(out[:length])
+            if match is not None and (found is None or match[0] > found[0]):
+                found = match
+        if found is None:
+            return None
+
+        plugin = self.load_plugin(found[1])
+        # Pass the plug-in's version of dmenu the list of launch arguments
+        plugin.launch_args = self.launch_args
+        if self.debug:
+            plugin.debug = True
+        return plugin, found[2]
+
     def system_path(self):
         """
         Array containing system paths
@@ -416,6 +800,28 @@ class dmenu(object):
 
         return path
 
+    def which(self, name):
+        """The path of the executable name, None if it cannot be found
+
+        Like the which command, but looked up in-process and remembered for
+        the rest of the process.
+        """
+        if name not in self.executables:
+            if os.path.dirname(name):
+                candidates = [name]
+            else:
+                candidates = [
+                    os.path.join(path, name)
+                    for path in os.environ.get("PATH", os.defpath).split(os.pathsep)
+                    if path
+                ]
+            self.executables[name] = None
+            for candidate in candidates:
+                if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+                    self.executables[name] = candidate
+                    break
+        return self.executables[name]
+
     def application_paths(self):
         """Array containing the paths to application flies
 
@@ -447,6 +853,8 @@ class dmenu(object):
         or the specified file could not be parsed as valid json.
         """
 
+        if path in self.preloaded:
+            return self.preloaded[path]
         if os.path.exists(path):
             with open(path, "r") as f:
                 try:
@@ -470,11 +878,13 @@ class dmenu(object):
     def save_json(self, path, items):
         """Saves a dictionary to a specified path using the json format"""
 
+        self.preloaded.pop(path, None)
         with open(path, "w") as f:
             json.dump(items, f, sort_keys=True, indent=4)
 
     def load_preferences(self):
         if self.prefs is False:
+            initialise()
             self.prefs = self.load_json(file_prefs)
 
             if self.prefs is False:
@@ -504,7 +914,10 @@ class dmenu(object):
         self.save_json(file_prefs, self.prefs)
 
     def download_text(self, url):
-        return urllib.request.urlopen(url).read()
+        import urllib.request
+
+        with urllib.request.urlopen(url, timeout=plugin_download_timeout) as f:
+            return f.read()
 
     def download_json(self, url):
         return json.loads(self.download_text(url))
@@ -546,6 +959,8 @@ class dmenu(object):
         self.load_preferences()
         # Check the passed commands from launch for a shortcut
         if len(self.launch_args) > 0:
+            if isinstance(items, cachefile.Stream):
+                items.close()
             out = self.launch_args[0]
             self.launch_args = self.launch_args[1:]
             if self.debug:
@@ -563,14 +978,29 @@ class dmenu(object):
                 text=True,
             )
 
-            if isinstance(items, list):
-                items = "\n".join(items)
+            if isinstance(items, cachefile.Stream):
+                # Copied straight into the menu, never read into memory
+                try:
+                    items.send(p.stdin.fileno())
+                except BrokenPipeError:
+                    pass  # The menu closed before reading everything
+                finally:
+                    items.close()
+                    try:
+                        p.stdin.close()
+                    except BrokenPipeError:
+                        pass
+                out = p.stdout.read()
+                p.wait()
+            else:
+                if isinstance(items, list):
+                    items = "\n".join(items)
 
-            # Prevent rofi from closing with no prompt
-            if self.prefs["menu"] == "rofi" and items == "":
-                items = " "
+                # Prevent rofi from closing with no prompt
+                if self.prefs["menu"] == "rofi" and items == "":
+                    items = " "
 
-            out = p.communicate(items)[0]
+                out = p.communicate(items)[0]
             out = out.strip("\n")
             out = out.strip()
 
@@ -625,10 +1055,13 @@ class dmenu(object):
                 f.write("read var;")
 
         os.chmod(os.path.expanduser(sh_command_file), 0o744)
+        # Started directly rather than through a shell
         if direct:
-            os.system("sh -e " + sh_command_file)
+            subprocess.call(["sh", "-e", sh_command_file])
         else:
-            os.system(self.prefs["terminal"] + " -e " + sh_command_file)
+            subprocess.call(
+                self.command_to_list(self.prefs["terminal"]) + ["-e", sh_command_file]
+            )
 
     def open_in_terminal_editor(self, path):
         if not os.path.exists(path):
@@ -672,9 +1105,9 @@ class dmenu(object):
             elif exit_code == 4 and self.prefs["fileopener"] == "xdg-open":
                 open_failure = True
             if open_failure:
-                mimetype = str(
-                    self.command_output("xdg-mime query filetype " + path)[0]
-                )
+                import mimetypes
+
+                mimetype = str(mimetypes.guess_type(path)[0])
                 message = [
                     "Error: "
                     + self.prefs["fileopener"]
@@ -776,14 +1209,109 @@ class dmenu(object):
             self.message_close()
         return cache
 
+    def generation(self):
+        """The folder of the cache generation this process reads
+
+        The current generation is looked up once, so every cache file is read
+        from the same one even when a rebuild publishes another meanwhile.
+        """
+        if self.pinned is None:
+            self.pinned = generations.current(path_cache)
+        return self.pinned
+
+    def generation_removed(self):
+        """Whether the generation read was removed since it was looked up
+
+        This happens when two rebuilds finish while a launch starts up. The
+        current generation is read from then on.
+        """
+        if self.pinned is None or os.path.isdir(self.pinned):
+            return False
+        removed = self.pinned
+        self.pinned = None
+        return self.generation() != removed
+
+    def cache_path(self, path):
+        """Where a cache file is read from and written to
+
+        The files in generation_files are taken from the generation being
+        written, if any, and otherwise from the one this process reads.
+        """
+        if path not in generation_files:
+            return path
+        if self.building is not None:
+            return os.path.join(self.building, os.path.basename(path))
+        return os.path.join(self.generation(), os.path.basename(path))
+
+    @contextlib.contextmanager
+    def new_generation(self, derive=True):
+        """Cache files saved within the with block go to a new generation
+
+        The generation is published when the block ends, so readers see all
+        of the changes at once. With derive it starts as a copy of the
+        current generation, so only the files saved are changed, and the
+        generation lock is held throughout so that no other update is
+        published in between. Files read within the block come from the new
+        generation. Nested blocks write to the outer generation.
+        """
+        if self.building is not None:
+            yield self.building
+            return
+        import shutil
+
+        names = [os.path.basename(path) for path in generation_files]
+        with contextlib.ExitStack() as stack:
+            if derive:
+                stack.enter_context(generations.lock(path_cache))
+            self.building = generations.create(
+                path_cache, generations.current(path_cache) if derive else None, names
+            )
+            try:
+                yield self.building
+            except BaseException:
+                shutil.rmtree(self.building, ignore_errors=True)
+                raise
+            finally:
+                folder = self.building
+                aliases_saved = self.aliases_saved
+                self.building = None
+                self.aliases_saved = False
+            if not derive:
+                # Written from scratch, only publishing needs the lock
+                stack.enter_context(generations.lock(path_cache))
+            self.pinned = generations.publish(path_cache, folder, names)
+        if aliases_saved and os.path.exists(file_cache_aliasesAdded):
+            # The aliases added with + are in the preferences, and so in the
+            # store that was just published
+            os.remove(file_cache_aliasesAdded)
+        generations.collect(path_cache)
+        if self.debug:
+            print("Published cache generation " + self.pinned)
+
     def cache_save(self, items, path):
+        """Writes items (a list, or a block of text) to a cache file
+
+        The file is replaced atomically. The files that make up a generation
+        are saved to a new one unless one is being written already.
+        """
+        self.preloaded.pop(path, None)
+        if path in generation_files and self.building is None:
+            with self.new_generation():
+                return self.cache_save(items, path)
+        if path in cache_sections and os.path.exists(
+            self.cache_path(file_cache_binary)
+        ):
+            return self.cache_save_binary({cache_sections[path]: items})
+        path = self.cache_path(path)
+        tmp = path + ".tmp"
         try:
-            with open(path, "w") as f:
+            with open(tmp, "w") as f:
                 if isinstance(items, list):
                     for item in items:
                         f.write(item + "\n")
                 else:
                     f.write(items)
+            os.replace(tmp, path)
             return 1
         except UnicodeEncodeError:
             import string
@@ -812,16 +1340,59 @@ class dmenu(object):
                         "Caching performance will be affected while these items remain"
                     )
                     print("Offending items have been excluded from cache")
-                with open(path, "wb") as f:
+                with open(path + ".tmp", "wb") as f:
                     for item in tmp:
                         f.write(item.encode("unicode_escape") + b"\n")
+                os.replace(path + ".tmp", path)
                 return 2
             else:
                 if self.debug:
                     print("Unknown error saving data cache")
+                os.remove(path + ".tmp")
                 return 0
 
+    def cache_save_binary(self, sections, replace=False):
+        """Writes sections (name -> list of items) to the binary cache
+
+        Sections that are not given are kept from the existing file unless
+        replace is True. Returns 1 like cache_save.
+        """
+        if self.building is None:
+            with self.new_generation():
+                return self.cache_save_binary(sections, replace)
+        if not replace:
+            existing = {}
+            try:
+                with cachefile.CacheFile(self.cache_path(file_cache_binary)) as cache:
+                    for name in cache.sections:
+                        existing[name] = cache.text(name).split("\n")[:-1]
+            except (OSError, cachefile.CacheFormatError):
+                pass
+            sections = dict(existing, **sections)
+        for name in sections:
+            if not isinstance(sections[name], list):
+                # A block of text, as accepted by cache_save
+                sections[name] = sections[name].split("\n")
+                if sections[name][-1] == "":
+                    sections[name].pop()
+        for path in cache_sections:
+            self.preloaded.pop(path, None)
+        cachefile.write(self.cache_path(file_cache_binary), sections)
+        return 1
+
     def cache_open(self, path):
+        if path in self.preloaded:
+            return self.preloaded[path]
+        binary = self.cache_path(file_cache_binary)
+        if path in cache_sections and os.path.exists(binary):
+            try:
+                if self.debug:
+                    print("Opening cache at " + binary)
+                with cachefile.CacheFile(binary) as cache:
+                    return cache.text(cache_sections[path])
+            except (OSError, KeyError, cachefile.CacheFormatError):
+                return False
+        path = self.cache_path(path)
         try:
             if self.debug:
                 print("Opening cache at " + path)
@@ -830,12 +1401,66 @@ class dmenu(object):
         except:
             return False
 
-    def cache_load(self, exitOnFail=False):
-        cache_frequent = frequent_commands_retrieve(self.prefs["frequently_used"])
+    def cache_slice(self, path):
+        """A cache file as a cachefile.CacheSlice (or str), False if missing"""
+        if path in self.preloaded:
+            return self.preloaded[path]
+        binary = self.cache_path(file_cache_binary)
+        try:
+            if os.path.exists(binary):
+                return cachefile.CacheSlice.open(binary, cache_sections[path])
+            return cachefile.CacheSlice.open(self.cache_path(path))
+        except (OSError, KeyError, cachefile.CacheFormatError):
+            return False
+
+    def cache_scanned_slice(self):
+        """The scanned items as a cachefile.CacheSlice (or str), False if missing"""
+        return self.cache_slice(file_cache)
+
+    def cache_stream(self, exitOnFail=False):
+        """Returns the menu contents as a cachefile.Stream
+
+        Only the small head (plugins, settings and frequently used items) is
+        held in memory, the scanned items are copied from the cache file into
+        the menu as they are sent.
+
+        The frequently used items are ranked when the cache is built and are
+        left out of the scanned items then. If they are hidden, the ones that
+        were taken out are put back after the scanned items.
+
+        When show_only is set, only those cache files are streamed.
+        """
+        if self.show_only is not None:
+            parts = [self.cache_slice(path) for path in self.show_only]
+            if any(part is False for part in parts):
+                cachefile.Stream(parts).close()
+                if self.generation_removed():
+                    return self.cache_stream(exitOnFail)
+                if exitOnFail:
+                    sys.exit()
+                if self.cache_regenerate() is False:
+                    self.menu(["Error caching data"])
+                    sys.exit()
+                return self.cache_stream(exitOnFail=True)
+            return cachefile.Stream(parts)
+
+        cache_frequent = self.cache_open(file_cache_frequent)
+        if cache_frequent is False:
+            # Built by a version that left the scanned items as they were
+            cache_frequent = frequent_commands_retrieve(self.prefs["frequently_used"])
+            cache_frequent_scanned = ""
+        elif self.show_scanned and not self.show_recent:
+            cache_frequent_scanned = self.cache_open(file_cache_frequent_scanned) or ""
+        else:
+            cache_frequent_scanned = ""
         cache_plugins = self.cache_open(file_cache_plugins)
-        cache_scanned = self.cache_open(file_cache)
+        cache_scanned = self.cache_scanned_slice()
 
         if cache_plugins is False or cache_scanned is False:
+            if isinstance(cache_scanned, cachefile.CacheSlice):
+                cache_scanned.close()
+            if self.generation_removed():
+                return self.cache_stream(exitOnFail)
             if exitOnFail:
                 sys.exit()
             else:
@@ -843,7 +1468,7 @@ class dmenu(object):
                     self.menu(["Error caching data"])
                     sys.exit()
                 else:
-                    return self.cache_load(exitOnFail=True)
+                    return self.cache_stream(exitOnFail=True)
 
         settings = self.prefs["indicator_submenu"] + " Settings\n"
 
@@ -854,15 +1479,89 @@ class dmenu(object):
             cache_plugins = ""
 
         if not self.show_scanned:
+            if isinstance(cache_scanned, cachefile.CacheSlice):
+                cache_scanned.close()
             cache_scanned = ""
 
         if not self.show_recent:
             cache_frequent = ""
 
         if self.show_settings:
-            return cache_plugins + settings + cache_frequent + cache_scanned
+            parts = [
+                cache_plugins,
+                settings,
+                cache_frequent,
+                cache_scanned,
+                cache_frequent_scanned,
+            ]
+        else:
+            parts = [
+                cache_plugins,
+                cache_frequent,
+                cache_scanned,
+                cache_frequent_scanned,
+                settings,
+            ]
+        return cachefile.Stream(parts)
+
+    def cache_load(self, exitOnFail=False):
+        stream = self.cache_stream(exitOnFail)
+        try:
+            return stream.read()
+        finally:
+            stream.close()
+
+    def cache_filter(self, query, paths_only=False, extension=False):
+        """Returns the menu items that contain query, in menu order
+
+        With paths_only only items holding a "/" are returned, and with
+        extension query is a file extension such as ".pdf" and only files
+        with that extension are returned. The scanned items are searched in
+        the cache file itself, using the filter index to skip the parts that
+        cannot match, so they are neither read whole nor decoded.
+        """
+        import mmap
+
+        if extension:
+            accept = lambda item: os.path.splitext(item)[1] == query  # noqa: E731
         else:
-            return cache_plugins + cache_frequent + cache_scanned + settings
+            accept = lambda item: item.find(query) != -1  # noqa: E731
+        stream = self.cache_stream()
+        items = []
+        try:
+            for part in stream.parts:
+                if isinstance(part, cachefile.CacheSlice):
+                    if part.length == 0:
+                        continue
+                    data = mmap.mmap(part.file.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        index = filterindex.FilterIndex(
+                            self.cache_path(file_cache_filter_index)
+                        )
+                    except (OSError, cachefile.CacheFormatError):
+                        index = None
+                    try:
+                        lines = filterindex.search(
+                            data,
+                            part.offset,
+                            part.length,
+                            cachefile.encode(query),
+                            index,
+                            extension,
+                        )
+                    finally:
+                        if index is not None:
+                            index.close()
+                        data.close()
+                    found = [cachefile.decode(line) for line in lines]
+                else:
+                    found = [item for item in part.split("\n") if item and accept(item)]
+                if paths_only:
+                    found = [item for item in found if item.find("/") != -1]
+                items += found
+        finally:
+            stream.close()
+        return items
 
     def command_output(self, command, split=True):
         if isinstance(command, list):
@@ -874,15 +1573,81 @@ class dmenu(object):
             return out
 
     def scan_binaries(self):
-        out = []
-        for path in self.system_path():
-            if os.path.isdir(path):
-                for binary in os.listdir(path):
-                    if binary[:3] != "gpk":
-                        out.append(binary)
-            elif os.path.isfile(path):
-                out.append(path)
-        return out
+        """Returns the sorted names of the executables found in $PATH"""
+        return self.binary_index()[1]
+
+    def has_binary(self, name):
+        """Whether name is one of the executables found in $PATH"""
+        return name in self.binary_index()[0]
+
+    def binary_index(self):
+        """Returns (names, ordered): the executables in $PATH as a set and a list
+
+        The listing of each PATH folder is kept in the cache directory along
+        with the folder's mtime, a folder is only listed again once its mtime
+        changes. Within one process the result is reused for as long as no
+        PATH folder changes.
+        """
+        paths = self.system_path()
+        infos = []
+        for path in paths:
+            try:
+                infos.append(os.stat(path))
+            except OSError:
+                infos.append(None)
+        fingerprint = [
+            (path, info.st_mtime_ns if info is not None else None)
+            for path, info in zip(paths, infos)
+        ]
+        if self.path_index is not None and self.path_index[0] == fingerprint:
+            return self.path_index[1]
+
+        try:
+            with open(file_cache_path_index, "r") as f:
+                stored = json.load(f)
+            if not isinstance(stored, dict):
+                stored = {}
+        except (OSError, ValueError):
+            stored = {}
+
+        changed = False
+        entries = {}
+        trusted_before = time.time_ns() - scanner.mtime_grace_ns
+        for path, info in zip(paths, infos):
+            if info is None:
+                continue
+            if stat.S_ISDIR(info.st_mode):
+                previous = stored.get(path)
+                if previous is not None and previous[0] == info.st_mtime_ns:
+                    entries[path] = previous
+                    continue
+                try:
+                    names = [x for x in os.listdir(path) if x[:3] != "gpk"]
+                except OSError:
+                    names = []
+                # Changes within the same timestamp tick would go unnoticed
+                mtime = info.st_mtime_ns if info.st_mtime_ns < trusted_before else None
+                entries[path] = [mtime, names]
+                changed = True
+            elif stat.S_ISREG(info.st_mode):
+                entries[path] = [None, [path]]
+
+        if changed or entries.keys() != stored.keys():
+            tmp = file_cache_path_index + ".tmp"
+            try:
+                with open(tmp, "w") as f:
+                    json.dump(entries, f, separators=(",", ":"))
+                os.replace(tmp, file_cache_path_index)
+            except OSError as e:
+                if self.debug:
+                    print("Could not save the binary index: " + str(e))
+
+        names = set()
+        for _, found in entries.values():
+            names.update(found)
+        index = (names, sorted(names))
+        self.path_index = (fingerprint, index)
+        return index
 
     def format_alias(self, name, command):
         if name is not None:
@@ -905,59 +1670,94 @@ class dmenu(object):
                 return command
 
     def scan_applications(self):
+        """Returns the applications described by the desktop entries
+
+        Parsed entries are kept in the cache directory keyed by each file's
+        inode, mtime and size, so only new or changed files are read. Folders
+        are handled in application_paths order and user entries come first.
+        """
         paths = self.system_path()
-        applications = []
+
+        try:
+            with open(file_cache_applications, "r") as f:
+                stored = json.load(f)
+            if not isinstance(stored, dict):
+                stored = {}
+        except (OSError, ValueError):
+            stored = {}
+
+        found = []  # (pathname, filename) in the order they are listed
+        index = {}
+        to_parse = []
+        trusted_before = time.time_ns() - scanner.mtime_grace_ns
         for app_path in self.application_paths():
             for filename in os.listdir(app_path):
                 pathname = os.path.join(app_path, filename)
-                if os.path.isfile(pathname):
-                    with open(pathname, "r", errors="ignore") as f:
-                        name = None
-                        name_generic = None
-                        command = None
-                        terminal = None
-                        for line in f.readlines():
-                            if line[0:5] == "Exec=" and command is None:
-                                command_tmp = line[5:-1].split()
-                                command = ""
-                                space = ""
-                                for piece in command_tmp:
-                                    if piece.find("%") == -1:
-                                        command += space + piece
-                                        space = " "
-                                    else:
-                                        break
-                            elif line[0:5] == "Name=" and name is None:
-                                name = line[5:-1]
-                            elif line[0:12] == "GenericName=" and name_generic is None:
-                                name_generic = line[12:-1]
-                            elif line[0:9] == "Terminal=" and terminal is None:
-                                if line[9:-1].lower() == "true":
-                                    terminal = True
-                                else:
-                                    terminal = False
-
-                        if name is not None and command is not None:
-                            if terminal is None:
-                                terminal = False
-                            if name_generic is None:
-                                name_generic = name
-                            for path in paths:
-                                if command[0 : len(path)] == path:
-                                    if command[len(path) + 1 :].find("/") == -1:
-                                        command = command[len(path) + 1 :]
-
-                            applications.append(
-                                {
-                                    "name": name.strip(),
-                                    "name_generic": name_generic.strip(),
-                                    "command": command.strip(),
-                                    "terminal": terminal,
-                                    "descriptor": filename.replace(
-                                        ".desktop", ""
-                                    ).strip(),
-                                }
-                            )
+                try:
+                    info = os.stat(pathname)
+                except OSError:
+                    continue
+                if not stat.S_ISREG(info.st_mode):
+                    continue
+                identity = [info.st_ino, info.st_mtime_ns, info.st_size]
+                previous = stored.get(pathname)
+                if previous is not None and previous[:3] == identity:
+                    index[pathname] = previous
+                else:
+                    if info.st_mtime_ns >= trusted_before:
+                        # May change again within the same timestamp tick
+                        identity[1] = None
+                    index[pathname] = identity + [None]
+                    to_parse.append(pathname)
+                found.append((pathname, filename))
+
+        if len(to_parse) > desktop_entry_parallel_threshold:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=desktop_entry_workers) as pool:
+                parsed = list(pool.map(parse_desktop_entry, to_parse))
+        else:
+            parsed = [parse_desktop_entry(pathname) for pathname in to_parse]
+        for pathname, entry in zip(to_parse, parsed):
+            index[pathname][3] = entry
+
+        if to_parse or index.keys() != stored.keys():
+            if self.debug:
+                print(
+                    "Parsed "
+                    + str(len(to_parse))
+                    + " desktop entries, reused "
+                    + str(len(index) - len(to_parse))
+                )
+            tmp = file_cache_applications + ".tmp"
+            try:
+                with open(tmp, "w") as f:
+                    json.dump(index, f, separators=(",", ":"))
+                os.replace(tmp, file_cache_applications)
+            except OSError as e:
+                if self.debug:
+                    print("Could not save the desktop entry index: " + str(e))
+
+        applications = []
+        for pathname, filename in found:
+            entry = index[pathname][3]
+            if entry is None:
+                continue
+            command = entry["command"]
+            for path in paths:
+                if command[0 : len(path)] == path:
+                    if command[len(path) + 1 :].find("/") == -1:
+                        command = command[len(path) + 1 :]
+
+            applications.append(
+                {
+                    "name": entry["name"].strip(),
+                    "name_generic": entry["name_generic"].strip(),
+                    "command": command.strip(),
+                    "terminal": entry["terminal"],
+                    "descriptor": filename.replace(".desktop", "").strip(),
+                }
+            )
 
         return applications
 
@@ -965,32 +1765,75 @@ class dmenu(object):
         """
         Return the command intended to be executed by the given alias.
         """
-        aliases = self.load_json(file_cache_aliasesLookup)
         if self.debug:
             print("Converting '" + alias + "' into its aliased command")
         print(alias)
-        for item in aliases:
-            if item[0] == alias:
-                if self.debug:
-                    print("Converted " + alias + " to: " + item[1])
-                return item[1]
+        try:
+            command = aliasindex.lookup(self.cache_path(file_cache_aliasesStore), alias)
+        except (OSError, cachefile.CacheFormatError):
+            # A cache built before the store existed
+            command = None
+            lookup = self.cache_path(file_cache_aliasesLookup)
+            for item in self.load_json(lookup) or []:
+                if item[0] == alias:
+                    command = item[1]
+                    break
+        if command is None:
+            command = aliasindex.find_added(file_cache_aliasesAdded, alias)
+        if command is not None:
+            if self.debug:
+                print("Converted " + alias + " to: " + command)
+            return command
         if self.debug:
             print("No suitable candidate was found")
 
+    def save_aliases(self, aliases):
+        """Replaces the alias store with a list of [title, command] pairs
+
+        Only the first command given for a title is kept. See aliasindex.py,
+        resolving an alias reads a single bucket of the store. The aliases
+        added since the last store was written are dropped once it is
+        published.
+        """
+        if self.building is None:
+            with self.new_generation():
+                return self.save_aliases(aliases)
+        aliasindex.write(self.cache_path(file_cache_aliasesStore), aliases)
+        self.aliases_saved = True
+        lookup = self.cache_path(file_cache_aliasesLookup)
+        if os.path.exists(lookup):
+            os.remove(lookup)
+
+    def add_alias(self, alias, command):
+        """Adds one alias to the store, unless the alias is already there
+
+        Only the new alias is written, to the file of those added since the
+        last rebuild, which merges them into the store.
+        """
+        if self.retrieve_aliased_command(alias) is None:
+            aliasindex.append(file_cache_aliasesAdded, alias, command)
+
     def plugins_available(self):
+        out = self.plugin_titles()
+        self.cache_save(out, file_cache_plugins)
+        return out
+
+    def plugin_titles(self):
+        """Returns the menu entries of every plugin, shortest first"""
         self.load_preferences()
         if self.debug:
             print("Loading available plugins...")
 
-        plugins = self.get_plugins(True)
         plugin_titles = []
-        for plugin in plugins:
-            if hasattr(plugin["plugin"], "is_submenu") and plugin["plugin"].is_submenu:
+        for entry in self.plugin_manifest():
+            if entry["title"] is None:
+                continue
+            if entry["is_submenu"]:
                 plugin_titles.append(
-                    self.prefs["indicator_submenu"] + " " + plugin["plugin"].title
+                    self.prefs["indicator_submenu"] + " " + entry["title"]
                 )
             else:
-                plugin_titles.append(plugin["plugin"].title)
+                plugin_titles.append(entry["title"])
 
         if self.debug:
             print("Done!")
@@ -1000,9 +1843,7 @@ class dmenu(object):
             print(str(len(plugin_titles)) + " loaded in total")
             print("")
 
-        out = self.sort_shortest(plugin_titles)
-        self.cache_save(out, file_cache_plugins)
-        return out
+        return self.sort_shortest(plugin_titles)
 
     def try_remove(self, needle, haystack):
         """
@@ -1036,7 +1877,28 @@ class dmenu(object):
                     out.append([parts[0], "=".join(parts[1:])])
         return out
 
-    def build_cache(self):
+    def load_snapshot(self, rules):
+        """Loads the folder listing saved by the previous rebuild"""
+        try:
+            with open(file_cache_snapshot, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+        return scanner.Snapshot.from_json(data, rules)
+
+    def save_snapshot(self, snapshot):
+        """Saves the folder listing used by the next incremental rebuild"""
+        tmp = file_cache_snapshot + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(snapshot.to_json(), f, separators=(",", ":"))
+            os.replace(tmp, file_cache_snapshot)
+        except OSError as e:
+            if self.debug:
+                print("Could not save the folder snapshot: " + str(e))
+
+    def scan_rules(self):
+        """Returns the rules used to scan the watch folders (see scanner.py)"""
         self.load_preferences()
 
         valid_extensions = []
@@ -1051,87 +1913,7 @@ class dmenu(object):
                     extension = "." + extension
                 valid_extensions.append(extension.lower())
 
-        applications = []
-
-        # Holds what binaries have been found
-        binaries = []
-
-        # Holds the directly searchable "# Htop (htop;)" lines
-        aliased_items = []
-
-        # Holds the [command, name] pairs for future lookup
-        aliases = []
-
-        # If we're going to include the applications or we want them for
-        # filtering purposes, scan the .desktop files and get the applications
-        if self.prefs["include_applications"] or self.prefs["filter_binaries"]:
-            applications = self.scan_applications()
-
-        # Do we want to add binaries into the cache?
-        if self.prefs["include_binaries"] is True:
-            if self.prefs["filter_binaries"] is True:
-                binaries_raw = self.scan_binaries()
-                filterlist = [x["command"] for x in applications] + [
-                    x["descriptor"] for x in applications
-                ]
-                for item in filterlist:
-                    if item in binaries_raw:
-                        binaries.append(item)
-            else:
-                binaries = self.scan_binaries()
-
-        binaries = list(set(binaries))
-
-        # Do we want to add applications from .desktop files into the cache?
-        if self.prefs["include_applications"]:
-            if self.prefs["alias_applications"]:
-                if os.path.exists(file_cache_aliases):
-                    os.remove(file_cache_aliases)
-                for app in applications:
-                    command = app["command"]
-                    if app["terminal"]:
-                        command += ";"
-                    title = self.format_alias(app["name"], command)
-                    # Only add this item if an item with the same name has not already
-                    # been added
-                    if title not in aliased_items:
-                        aliased_items.append(title)
-                        aliases.append([title, command])
-                        if app["terminal"]:
-                            # Remove any non-terminal invoking versions from cache
-                            self.try_remove(app["command"], binaries)
-                            self.try_remove(app["command"].lower(), binaries)
-                            self.try_remove(command, binaries)
-                            self.try_remove(command.lower(), binaries)
-            else:
-                for app in applications:
-                    command = app["command"]
-                    # Add the "run in terminal" indicator to the command
-                    if app["terminal"]:
-                        command += ";"
-                    # Only add this item if an item with the same name has not already
-                    # been added
-                    if command not in binaries:
-                        # Remove any non-terminal invoking versions from cache
-                        if app["terminal"]:
-                            self.try_remove(app["command"], binaries)
-                            self.try_remove(app["command"].lower(), binaries)
-                            self.try_remove(command, binaries)
-                            self.try_remove(command.lower(), binaries)
-                        binaries.append(command)
-
-        binaries = list(set(binaries))
-
-        watch_folders = []
-        if "watch_folders" in self.prefs:
-            watch_folders = self.prefs["watch_folders"]
-        watch_folders = map(
-            lambda x: x.replace("~", os.path.expanduser("~")), watch_folders
-        )
-
         if self.debug:
-            print("Done!")
-            print("Watch folders:")
             print("Loading the list of folders to be excluded from the index...")
 
         ignore_folders = []
@@ -1152,9 +1934,6 @@ class dmenu(object):
             print(str(len(ignore_folders)) + " ignore_folders loaded in total")
             print("")
 
-        filenames = []
-        foldernames = []
-
         follow_symlinks = False
         try:
             if "follow_symlinks" in self.prefs:
@@ -1170,44 +1949,84 @@ class dmenu(object):
 
             print("Scanning files and folders, this may take a while...")
 
-        for watchdir in watch_folders:
-            for root, dirs, files in os.walk(
-                watchdir, topdown=True, followlinks=follow_symlinks
-            ):
-                dirs[:] = [
-                    d
-                    for d in dirs
-                    if os.path.join(root, d) not in ignore_folders
-                    and d not in self.prefs["global_ignore_folders"]
-                ]
-                if self.prefs["scan_hidden_folders"] is False:
-                    dirs[:] = [d for d in dirs if d.startswith(".") is False]
+        return scanner.ScanRules(
+            valid_extensions=valid_extensions,
+            ignore_folders=ignore_folders,
+            global_ignore_folders=self.prefs["global_ignore_folders"],
+            scan_hidden_folders=self.prefs["scan_hidden_folders"],
+            include_hidden_files=self.prefs["include_hidden_files"],
+            follow_symlinks=follow_symlinks,
+        )
 
-                if self.prefs["scan_hidden_folders"] or root.find("/.") == -1:
-                    for name in files:
-                        if (
-                            self.prefs["include_hidden_files"]
-                            or name.startswith(".") is False
-                        ):
-                            if (
-                                valid_extensions is True
-                                or os.path.splitext(name)[1].lower() in valid_extensions
-                            ):
-                                filenames.append(os.path.join(root, name))
-                    for name in dirs:
-                        foldernames.append(os.path.join(root, name) + "/")
+    def assemble_cache(self, applications, binaries_found, foldernames, filenames):
+        """Combines everything that was found into the lists that are cached
+
+        Returns (aliases, aliased_items, binaries, other, excluded_scanned)
+        where other is the complete, sorted list of scanned items and
+        excluded_scanned the part of exclude_items that fell on foldernames
+        and filenames, as {item: count}. The abbreviate_homedir preference is
+        applied to foldernames and filenames in place.
+
+        Ordered dicts and sets are used for every membership test and removal
+        so that the work grows linearly with the number of items.
+        """
+        # Holds what binaries have been found, dict keys act as an ordered set
+        binaries = {}
+
+        # Holds the directly searchable "# Htop (htop;)" lines
+        aliased_items = []
+        aliased_titles = set()
+
+        # Holds the [command, name] pairs for future lookup
+        aliases = []
+
+        if self.prefs["include_binaries"] is True:
+            if self.prefs["filter_binaries"] is True:
+                found = set(binaries_found)
+                filterlist = [x["command"] for x in applications] + [
+                    x["descriptor"] for x in applications
+                ]
+                for item in filterlist:
+                    if item in found:
+                        binaries[item] = None
+            else:
+                binaries = dict.fromkeys(binaries_found)
 
-        foldernames = list(filter(lambda x: x not in ignore_folders, foldernames))
+        # Do we want to add applications from .desktop files into the cache?
+        if self.prefs["include_applications"]:
+            for app in applications:
+                command = app["command"]
+                # Add the "run in terminal" indicator to the command
+                if app["terminal"]:
+                    command += ";"
+                if self.prefs["alias_applications"]:
+                    title = self.format_alias(app["name"], command)
+                    # Only add this item if an item with the same name has not
+                    # already been added
+                    if title in aliased_titles:
+                        continue
+                    aliased_titles.add(title)
+                    aliased_items.append(title)
+                    aliases.append([title, command])
+                elif command in binaries:
+                    continue
+                if app["terminal"]:
+                    # Remove any non-terminal invoking versions from cache
+                    binaries.pop(app["command"], None)
+                    binaries.pop(app["command"].lower(), None)
+                    binaries.pop(command, None)
+                    binaries.pop(command.lower(), None)
+                if not self.prefs["alias_applications"]:
+                    binaries[command] = None
 
         if "abbreviate_homedir" in self.prefs and self.prefs["abbreviate_homedir"]:
             homedir = os.path.expanduser("~")
-            filenames = list(map(lambda x: x.replace(homedir, "~"), filenames))
-            foldernames = list(map(lambda x: x.replace(homedir, "~"), foldernames))
+            foldernames[:] = [x.replace(homedir, "~") for x in foldernames]
+            filenames[:] = [x.replace(homedir, "~") for x in filenames]
 
         include_items = []
 
         if "include_items" in self.prefs:
-            include_items = []
             for item in self.prefs["include_items"]:
                 if isinstance(item, list):
                     if len(item) > 1:
@@ -1221,49 +2040,215 @@ class dmenu(object):
                             )
                 else:
                     include_items.append(item)
-        else:
-            include_items = []
 
         # Remove any manually added include items differing by a colon
         # e.g. ["htop", "htop;"] becomes just ["htop;"]
         for item in include_items:
-            if item[-1] == ";" and item[0:-1] in binaries:
-                binaries.remove(item[0:-1])
+            if item[-1] == ";":
+                binaries.pop(item[0:-1], None)
 
         # Look for alias file and include
         if "path_aliasFile" in self.prefs:
             if self.prefs["path_aliasFile"] != "":
-                items = self.parse_alias_file(self.prefs["path_aliasFile"])
+                with self.phase("parse_alias_file") as phase:
+                    items = self.parse_alias_file(self.prefs["path_aliasFile"])
+                    phase["items"] = len(items)
                 for item in items:
                     title = self.format_alias(item[0], item[1])
                     aliased_items.append(title)
                     aliases.append([title, item[1]])
 
-        plugins = self.plugins_available()
+        binaries = list(binaries)
 
-        # Save the alias lookup file and aliased_items
-        self.save_json(file_cache_aliasesLookup, aliases)
-        self.cache_save(aliased_items, file_cache_aliases)
-        self.cache_save(binaries, file_cache_binaries)
-        self.cache_save(foldernames, file_cache_folders)
-        self.cache_save(filenames, file_cache_files)
+        with self.phase("sort") as phase:
+            other = self.sort_shortest(
+                include_items + aliased_items + binaries + foldernames + filenames
+            )
+            phase["items"] = len(other)
+
+        # Each excluded entry removes the first remaining occurrence of an item
+        excluded_scanned = {}
+        if "exclude_items" in self.prefs and self.prefs["exclude_items"]:
+            excluded = collections.Counter(self.prefs["exclude_items"])
+            # A folder or file comes after any other item equal to it, so the
+            # exclusions left for them are those the other items did not use
+            found = collections.Counter(item for item in other if item in excluded)
+            scanned = collections.Counter(
+                item
+                for item in itertools.chain(foldernames, filenames)
+                if item in excluded
+            )
+            for item, count in excluded.items():
+                left = count - min(count, found[item] - scanned[item])
+                if left > 0:
+                    excluded_scanned[item] = left
+            kept = []
+            for item in other:
+                if excluded[item] > 0:
+                    excluded[item] -= 1
+                else:
+                    kept.append(item)
+            other = kept
 
-        other = self.sort_shortest(
-            include_items + aliased_items + binaries + foldernames + filenames
-        )
+        other += ["rebuild cache"]
+        return aliases, aliased_items, binaries, other, excluded_scanned
 
-        if "exclude_items" in self.prefs:
-            for item in self.prefs["exclude_items"]:
-                try:
-                    other.remove(item)
-                except ValueError:
-                    pass
+    def phase(self, name):
+        """Times a step of a rebuild when profiling, see profiler.Profile.phase
 
-        other += ["rebuild cache"]
-        self.cache_save(other, file_cache)
+        The with statement gives a dict for details such as an item count.
+        """
+        if self.profile is None:
+            return contextlib.nullcontext({})
+        return self.profile.phase(name)
+
+    def build_cache(self, full=False, dirty=None, workers=None, format=None):
+        """Rebuilds the cache
+
+        Only folders that changed since the last build are listed again unless
+        full is True, in which case every watch folder is walked from scratch.
+        When dirty (a set of folder paths) is given only those folders are
+        listed again and all others are taken from the previous snapshot as-is.
+        The number of scanning threads defaults to the scan_workers preference
+        and the format ("text" or "binary") to the cache_format preference.
+        """
+        with self.phase("load_preferences"):
+            self.load_preferences()
+
+        applications = []
+        binaries_found = []
+
+        # If we're going to include the applications or we want them for
+        # filtering purposes, scan the .desktop files and get the applications
+        if self.prefs["include_applications"] or self.prefs["filter_binaries"]:
+            with self.phase("scan_applications") as phase:
+                applications = self.scan_applications()
+                phase["items"] = len(applications)
+
+        # Do we want to add binaries into the cache?
+        if self.prefs["include_binaries"] is True:
+            with self.phase("scan_binaries") as phase:
+                binaries_found = self.scan_binaries()
+                phase["items"] = len(binaries_found)
+
+        watch_folders = []
+        if "watch_folders" in self.prefs:
+            watch_folders = self.prefs["watch_folders"]
+        watch_folders = [x.replace("~", os.path.expanduser("~")) for x in watch_folders]
+
+        if self.debug:
+            print("Done!")
+            print("Watch folders:")
+
+        rules = self.scan_rules()
+
+        previous = None
+        if full is False:
+            if (
+                self.snapshot is not None
+                and self.snapshot.rules.fingerprint() == rules.fingerprint()
+            ):
+                previous = self.snapshot
+            else:
+                previous = self.load_snapshot(rules)
+            if self.debug:
+                print(
+                    "Reusing the listing of up to "
+                    + str(len(previous.directories))
+                    + " unchanged folders"
+                )
+        elif self.debug:
+            print("Full rebuild requested, every folder will be listed")
+
+        if workers is None:
+            workers = self.prefs["scan_workers"]
+        timings = None
+        if self.profile is not None:
+            timings = self.profile.directories
+            self.profile.roots = watch_folders
+        with self.phase("scan") as phase:
+            filenames, foldernames, self.snapshot = scanner.scan(
+                watch_folders, rules, previous, dirty, workers=workers, timings=timings
+            )
+            phase["items"] = len(filenames) + len(foldernames)
+        with self.phase("save_snapshot"):
+            self.save_snapshot(self.snapshot)
+
+        foldernames = [x for x in foldernames if x not in rules.ignore_folders]
+
+        with self.phase("assemble_cache") as phase:
+            aliases, aliased_items, binaries, other, excluded = self.assemble_cache(
+                applications, binaries_found, foldernames, filenames
+            )
+            phase["items"] = len(other)
+
+        # The items of each type, in the same order as in the merged list
+        found_types = dict.fromkeys(filenames, file_cache_files)
+        found_types.update(dict.fromkeys(foldernames, file_cache_folders))
+        found_types.update(dict.fromkeys(aliased_items, file_cache_aliases))
+        shards = {
+            file_cache_aliases: [],
+            file_cache_binaries: [],
+            file_cache_folders: [],
+            file_cache_files: [],
+        }
+        for item in other[:-1]:  # Leaving out "rebuild cache"
+            shards[found_types.get(item, file_cache_binaries)].append(item)
+
+        frequent = []
+        if self.prefs["frequently_used"] > 0:
+            with self.phase("frequent_commands_compact"):
+                frequent_commands_compact()
+            frequent = frequent_commands_ranked(self.prefs["frequently_used"])
+        # The frequently used items are listed first and not repeated below
+        ranked = set(frequent)
+        frequent_scanned = [item for item in other if item in ranked]
+        if frequent_scanned:
+            other = [item for item in other if item not in ranked]
+
+        with self.phase("plugins_available") as phase:
+            plugins = self.plugin_titles()
+            phase["items"] = len(plugins)
+
+        sections = {
+            file_cache_plugins: plugins,
+            file_cache_frequent: frequent,
+            file_cache_frequent_scanned: frequent_scanned,
+            **shards,
+            file_cache: other,
+        }
+        if format is None:
+            format = self.prefs["cache_format"]
+        # Everything is written to a fresh generation, published in one step
+        # once complete. Only one format is written so readers never pick up
+        # a stale cache.
+        with self.phase("save_generation"), self.new_generation(derive=False):
+            # Save the alias lookup file and aliased_items
+            with self.phase("save_aliases") as phase:
+                self.save_aliases(aliases)
+                phase["items"] = len(aliases)
+            if format == "binary":
+                with self.phase("cache_save_binary") as phase:
+                    self.cache_save_binary(
+                        {
+                            cache_sections[path]: items
+                            for path, items in sections.items()
+                        },
+                        replace=True,
+                    )
+                    phase["items"] = sum(len(items) for items in sections.values())
+            else:
+                for path, items in sections.items():
+                    with self.phase("cache_save " + os.path.basename(path)) as phase:
+                        self.cache_save(items, path)
+                        phase["items"] = len(items)
+            with self.phase("filterindex.write") as phase:
+                filterindex.write(self.cache_path(file_cache_filter_index), other)
+                phase["items"] = len(other)
+            self.save_json(self.cache_path(file_cache_excluded_scanned), excluded)
 
         out = plugins
-        out += other
+        out += other + frequent_scanned
 
         if self.debug:
             print("Done!")
@@ -1272,6 +2257,125 @@ class dmenu(object):
 
         return out
 
+    def update_scanned(self, dirty, workers=None):
+        """Lists the dirty folders again and updates only what they are in
+
+        The files and folders sections, the list of everything and the filter
+        index are written to a new generation, anything else (applications,
+        binaries, aliases, plugins) is carried over from the current one.
+        Falls back to build_cache when there is no complete cache to update.
+        Returns the scanned items, as build_cache.
+        """
+        self.load_preferences()
+        # Whatever was published since this process last looked is updated
+        self.pinned = None
+        sections = [
+            file_cache,
+            file_cache_files,
+            file_cache_folders,
+            file_cache_aliases,
+            file_cache_frequent,
+            file_cache_frequent_scanned,
+        ]
+        if any(self.cache_open(path) is False for path in sections) or not (
+            os.path.exists(self.cache_path(file_cache_excluded_scanned))
+        ):
+            return self.build_cache(dirty=dirty, workers=workers)
+
+        rules = self.scan_rules()
+        if self.snapshot is None or (
+            self.snapshot.rules.fingerprint() != rules.fingerprint()
+        ):
+            self.snapshot = self.load_snapshot(rules)
+        if not self.snapshot.directories:
+            return self.build_cache(dirty=dirty, workers=workers)
+        watch_folders = [
+            x.replace("~", os.path.expanduser("~"))
+            for x in self.prefs.get("watch_folders", [])
+        ]
+        if workers is None:
+            workers = self.prefs["scan_workers"]
+        filenames, foldernames, self.snapshot = scanner.scan(
+            watch_folders, rules, self.snapshot, dirty, workers=workers
+        )
+        self.save_snapshot(self.snapshot)
+
+        foldernames = [x for x in foldernames if x not in rules.ignore_folders]
+        if "abbreviate_homedir" in self.prefs and self.prefs["abbreviate_homedir"]:
+            homedir = os.path.expanduser("~")
+            foldernames = [x.replace(homedir, "~") for x in foldernames]
+            filenames = [x.replace(homedir, "~") for x in filenames]
+        found_types = dict.fromkeys(filenames, file_cache_files)
+        found_types.update(dict.fromkeys(foldernames, file_cache_folders))
+
+        # Read and written in the latest generation, under its lock
+        with self.new_generation():
+            old = {}
+            for path in sections:
+                old[path] = (self.cache_open(path) or "").split("\n")[:-1]
+            try:
+                with open(self.cache_path(file_cache_excluded_scanned), "r") as f:
+                    excluded = collections.Counter(json.load(f))
+            except (OSError, ValueError):
+                excluded = collections.Counter()
+
+            # The items that were not scanned keep their order, the scanned
+            # ones follow them among items of the same length as in build_cache
+            scanned = set(old[file_cache_files])
+            scanned.update(old[file_cache_folders])
+            other = [
+                item
+                for item in old[file_cache] + old[file_cache_frequent_scanned]
+                if item not in scanned and item != "rebuild cache"
+            ]
+            other = self.sort_shortest(other + foldernames + filenames)
+            # The exclusions the other items did not use, see assemble_cache
+            if excluded:
+                kept = []
+                for item in other:
+                    if excluded[item] > 0:
+                        excluded[item] -= 1
+                    else:
+                        kept.append(item)
+                other = kept
+
+            for item in old[file_cache_aliases]:
+                found_types.pop(item, None)
+            shards = {file_cache_folders: [], file_cache_files: []}
+            for item in other:
+                if item in found_types:
+                    shards[found_types[item]].append(item)
+
+            ranked = set(old[file_cache_frequent])
+            frequent_scanned = [item for item in other if item in ranked]
+            if frequent_scanned:
+                other = [item for item in other if item not in ranked]
+            other += ["rebuild cache"]
+
+            changed = {
+                **shards,
+                file_cache_frequent_scanned: frequent_scanned,
+                file_cache: other,
+            }
+            if os.path.exists(self.cache_path(file_cache_binary)):
+                self.cache_save_binary(
+                    {cache_sections[path]: items for path, items in changed.items()}
+                )
+            else:
+                for path, items in changed.items():
+                    self.cache_save(items, path)
+            filterindex.write(self.cache_path(file_cache_filter_index), other)
+
+        if self.debug:
+            print("Updated " + str(len(foldernames) + len(filenames)) + " items")
+        return other + frequent_scanned
+
+
+# Out of date plugins are downloaded this many at a time
+plugin_update_workers = 4
+# Seconds to wait for a server when downloading a plugin
+plugin_download_timeout = 30
+
 
 class extension(dmenu):
 
@@ -1287,6 +2391,7 @@ class extension(dmenu):
         f"{base_url}/v1nc/dmenu-extended-plugins/master/plugins_index.json",
         f"{base_url}/mg979/dmenu-extended-plugins/master/plugins_index.json",
     ]
+    plugins_index_timeout = 10  # Seconds to wait for each index
 
     def rebuild_cache(self):
         time_start = time.time()
@@ -1341,24 +2446,44 @@ class extension(dmenu):
         self.menu(response)
 
     def rebuild_cache_plugin(self):
-        self.plugins_loaded = self.get_plugins(True)
         self.cache_regenerate()
 
     def download_plugins_json(self):
+        """Returns the plugin indexes merged, later ones take precedence
+
+        The indexes are fetched at the same time and kept in path_downloads,
+        so an index is only downloaded again once it changed and one that
+        cannot be fetched is taken from there (see httpcache.py). This only
+        fails if none of them can be had at all.
+        """
+        from . import httpcache
+
         plugins = {}
-        for plugins_index_url in self.plugins_index_urls:
+        found = False
+        results = httpcache.fetch_all(
+            self.plugins_index_urls, path_downloads, self.plugins_index_timeout
+        )
+        for url, (body, error) in zip(self.plugins_index_urls, results):
+            if error is not None:
+                print("Error downloading plugins index " + url + ": " + str(error))
+                if body is not None:
+                    print("Using the copy downloaded before")
+            if body is None:
+                continue
             try:
-                plugins.update(self.download_json(plugins_index_url))
-            except Exception as e:
-                print("Error downloading plugins index: " + str(e))
-                self.message_close()
-                self.menu(
-                    [
-                        "Error: Could not connect to plugin repository.",
-                        "Please check your internet connection and try again.",
-                    ]
-                )
-                sys.exit()
+                plugins.update(json.loads(body))
+                found = True
+            except ValueError as e:
+                print("Error reading plugins index " + url + ": " + str(e))
+        if not found:
+            self.message_close()
+            self.menu(
+                [
+                    "Error: Could not connect to plugin repository.",
+                    "Please check your internet connection and try again.",
+                ]
+            )
+            sys.exit()
         return plugins
 
     def download_plugins(self):
@@ -1366,7 +2491,7 @@ class extension(dmenu):
         items = []
         accept = []
         substitute = ("plugin_", "")
-        installed_plugins = self.get_plugins()
+        installed_plugins = self.plugin_manifest()
         installed_pluginFilenames = [x["filename"] for x in installed_plugins]
 
         for plugin_name, plugin in plugins.items():
@@ -1405,7 +2530,7 @@ class extension(dmenu):
                                 "external"
                             ]:
                                 line = ""
-                                if depend["name"] in d.scan_binaries():
+                                if d.has_binary(depend["name"]):
                                     pass
                                 else:
                                     line = (
@@ -1460,7 +2585,6 @@ class extension(dmenu):
                         with open(path_plugins + "/" + plugin_name + ".py", "wb") as f:
                             f.write(plugin_source)
 
-                        self.get_plugins(True)
                         self.message_close()
                         self.message_open("Rebuilding plugin cache")
                         self.plugins_available()
@@ -1482,13 +2606,10 @@ class extension(dmenu):
 
     def installed_plugins(self):
         plugins = []
-        for plugin in self.get_plugins():
-            if plugin["filename"] != "plugin_settings.py":
+        for plugin in self.plugin_manifest():
+            if plugin["module"] is not None and plugin["title"] is not None:
                 plugins.append(
-                    plugin["plugin"].title.replace(":", "")
-                    + " ("
-                    + plugin["filename"]
-                    + ")"
+                    plugin["title"].replace(":", "") + " (" + plugin["filename"] + ")"
                 )
         return plugins
 
@@ -1515,116 +2636,137 @@ class extension(dmenu):
                 print("Selection was not understood")
 
     def update_plugins(self):
+        """Updates the installed plugins whose sha1 differs from the index
+
+        The installed plugins are hashed by plugin_manifest. The plugins that
+        are out of date are downloaded at the same time, up to
+        plugin_update_workers at once, into a private folder next to the
+        plugins. Each download replaces its plugin with a rename, and only
+        once its sha1 matches the one given by the index.
+        """
+        import shutil
+        import tempfile
+        from concurrent.futures import ThreadPoolExecutor
+
         self.message_open("Checking for plugin updates...")
-        plugins_here = list(
-            map(lambda x: x["filename"].split(".")[0], self.get_plugins())
-        )
-        plugins_here.remove("plugin_settings")
+        installed = {
+            entry["module"]: entry
+            for entry in self.plugin_manifest()
+            if entry["module"] is not None
+        }
         plugins_there = self.download_plugins_json()
-        self.message_close()
+        outdated = []
+        for name, entry in installed.items():
+            if name not in plugins_there:
+                continue
+            if self.debug:
+                print("Checking " + name)
+                print("Local copy has sha of " + entry["sha1"])
+                print("Remote copy has sha of " + plugins_there[name]["sha1sum"])
+            if entry["sha1"] != plugins_there[name]["sha1sum"]:
+                outdated.append((name, plugins_there[name]))
+            elif self.debug:
+                print(name + " is up-to-date")
+
         updated = []
-        for here in plugins_here:
-            for there in plugins_there:
-                if there == here:
-                    there_sha = plugins_there[there]["sha1sum"]
-                    here_sha = self.command_output(
-                        "sha1sum " + path_plugins + "/" + here + ".py"
-                    )[0].split()[0]
+        failed = []
+        downloaded = 0
+        started = time.perf_counter()
+        if outdated:
+            self.message_close()
+            self.message_open("Updating " + str(len(outdated)) + " plugin(s)...")
+            # On the same file system as the plugins so that the rename is atomic
+            folder = tempfile.mkdtemp(prefix=".update-", dir=path_plugins)
+            try:
+                with ThreadPoolExecutor(
+                    max_workers=min(plugin_update_workers, len(outdated))
+                ) as pool:
+                    results = list(
+                        pool.map(
+                            lambda item: self.update_plugin(folder, *item), outdated
+                        )
+                    )
+            finally:
+                shutil.rmtree(folder, ignore_errors=True)
+            for (name, _), (size, error) in zip(outdated, results):
+                downloaded += size
+                if error is None:
+                    updated.append(name)
+                else:
+                    failed.append(name + " was not updated: " + error)
                     if self.debug:
-                        print("Checking " + here)
-                        print("Local copy has sha of " + here_sha)
-                        print("Remote copy has sha of " + there_sha)
-                    if there_sha != here_sha:
-                        sys.stdout.write("Hashes do not match, updating...\n")
-                        if os.path.exists("/tmp/" + there + ".py"):
-                            os.remove("/tmp/" + there + ".py")
-                        os.system("wget " + plugins_there[there]["url"] + " -P /tmp")
-                        download_sha = self.command_output(
-                            "sha1sum /tmp/" + here + ".py"
-                        )[0].split()[0]
-                        if download_sha != there_sha:
-                            if self.debug:
-                                print(
-                                    "Downloaded version of "
-                                    + there
-                                    + " does not verify against package manager"
-                                    " sha1sum key"
-                                )
-                                print("SHA1SUM of downloaded version = " + download_sha)
-                                print(
-                                    "SHA1SUM specified by package manager = "
-                                    + there_sha
-                                )
-                                print("Plugin not updated")
-                        else:
-                            os.remove(path_plugins + "/" + here + ".py")
-                            os.system(
-                                "mv /tmp/"
-                                + here
-                                + ".py "
-                                + path_plugins
-                                + "/"
-                                + here
-                                + ".py"
-                            )
-                            if self.debug:
-                                print("Done!")
-                            updated += [here]
-                    else:
-                        if self.debug:
-                            print(here + "is up-to-date")
+                        print(failed[-1])
+            if updated:
+                self.plugins_available()
+        elapsed = time.perf_counter() - started
         self.message_close()
+
         if len(updated) == 0:
-            self.menu(["There are no new updates for installed plugins"])
+            summary = ["There are no new updates for installed plugins"]
         elif len(updated) == 1:
-            self.menu([updated[0] + " was updated to the latest version"])
+            summary = [updated[0] + " was updated to the latest version"]
         else:
-            self.menu(["The following plugins were updated:"] + updated)
+            summary = ["The following plugins were updated:"] + updated
+        if outdated:
+            summary.append(
+                "Downloaded %.1f KiB in %.1f seconds" % (downloaded / 1024, elapsed)
+            )
+        self.menu(summary + failed)
+
+    def update_plugin(self, folder, name, plugin):
+        """Downloads a plugin into folder and installs it if its sha1 matches
+
+        Returns (bytes downloaded, None) or (bytes downloaded, error message).
+        """
+        import hashlib
+
+        try:
+            source = self.download_text(plugin["url"])
+        except Exception as e:
+            return 0, "download failed (" + str(e) + ")"
+        sha1 = hashlib.sha1(source).hexdigest()
+        if sha1 != plugin["sha1sum"]:
+            if self.debug:
+                print("SHA1SUM of downloaded version of " + name + " = " + sha1)
+                print("SHA1SUM specified by package manager = " + plugin["sha1sum"])
+            return len(source), "the download does not match its sha1sum"
+        tmp = os.path.join(folder, name + ".py")
+        with open(tmp, "wb") as f:
+            f.write(source)
+        os.replace(tmp, os.path.join(path_plugins, name + ".py"))
+        return len(source), None
 
     # Returns 0 if no systemd or script not installed, 1 if running, 2 if not running
     def get_automatic_rebuild_cache_status(self):
-        has_systemd = subprocess.call(["which", "systemctl"])
-        if has_systemd != 0:
-            return 0
-        subprocess.call(["systemctl", "--user", "daemon-reload"])
-        try:
-            has_service = subprocess.check_output(
-                [
-                    "systemctl",
-                    "--user",
-                    "list-unit-files",
-                    "dmenu-extended-update-db.timer",
-                ]
-            )
-        except subprocess.CalledProcessError:
-            return 0
-        if "dmenu-extended-update-db.timer" not in str(has_service):
-            return 0
-        is_enabled = subprocess.call(
-            ["systemctl", "--user", "is-enabled", "dmenu-extended-update-db.timer"]
-        )
-        if is_enabled == 0:
-            return 1
-        else:
-            return 2
+        from . import install_systemd_service
+
+        return install_systemd_service.timer_status()
 
     # These two methods presume that we have systemd and the scripts are installed.
     def enable_automatic_rebuild_cache(self):
+        from . import install_systemd_service
+
+        # The timer may have been installed since systemd last looked
+        subprocess.call(["systemctl", "--user", "daemon-reload"])
         subprocess.call(
             ["systemctl", "--user", "enable", "dmenu-extended-update-db.timer"]
         )
         subprocess.call(
             ["systemctl", "--user", "start", "dmenu-extended-update-db.timer"]
         )
+        install_systemd_service.timer_status(refresh=True)
         self.menu(["Successfully enabled systemd service."])
 
     def disable_automatic_rebuild_cache(self):
+        from . import install_systemd_service
+
         subprocess.call(
             ["systemctl", "--user", "stop", "dmenu-extended-update-db.timer"]
         )
         subprocess.call(
             ["systemctl", "--user", "disable", "dmenu-extended-update-db.timer"]
         )
+        install_systemd_service.timer_status(refresh=True)
         self.menu(["Successfully disabled systemd service."])
 
     def edit_preferences(self):
@@ -1636,6 +2778,14 @@ class extension(dmenu):
             os.remove(file_cache_frequentlyUsed_frequency)
         if os.path.isfile(file_cache_frequentlyUsed_ordered):
             os.remove(file_cache_frequentlyUsed_ordered)
+        for path in [
+            file_cache_frequentlyUsed_log,
+            file_cache_frequentlyUsed_log + ".compacting",
+        ]:
+            if os.path.isfile(path):
+                os.remove(path)
+        # The ranked items are kept apart from the scanned ones until a rebuild
+        self.cache_regenerate()
         run()
 
     def run(self, inputText):
@@ -1747,7 +2897,7 @@ def handle_command(d, out):
             if d.debug:
                 print("Item contained spaces so is likely a binary acting on x")
             parts = out.split(" ")
-            if parts[0] in d.scan_binaries():
+            if d.has_binary(parts[0]):
                 if d.debug:
                     print("Found the binary, executing the command")
                 d.execute(out)
@@ -1806,46 +2956,44 @@ def init_menu(launch_args):
         d.show_recent = False
         launch_args.remove("--no-recent")
 
+    show_only = []
+    for option, paths in launch_modes.items():
+        if option in launch_args:
+            show_only += paths
+            launch_args.remove(option)
+    d.show_only = show_only or None
+
     d.launch_args = launch_args
     d.load_preferences()
 
     # check executable
-    if os.system("which " + d.prefs["menu"]) != 0:
+    if d.which(d.prefs["menu"]) is None:
         print(d.prefs["menu"] + " executable not found, aborting...")
         return 1
 
 
+def launch():
+    """The dmenu_extended_run entry point, run with the command line arguments"""
+    run(*sys.argv)
+
+
 def run(*args):
+    initialise()
     if init_menu(list(args[1:])):
         return
 
-    cache = d.cache_load()
     prompt = d.prefs["prompt"]
-    out = d.menu(cache, prompt).strip()
+    out = d.menu(d.cache_stream(), prompt).strip()
     aliased = False
 
     if len(out) > 0:
         if d.debug:
             print("First menu closed with user input: '" + out + "'")
         # Check if the action relates to a plugin
-        plugins = load_plugins(d.debug)
-        plugin_hook = False
-        for plugin in plugins:
-            if (
-                hasattr(plugin["plugin"], "is_submenu")
-                and plugin["plugin"].is_submenu is True
-            ):
-                pluginTitle = (
-                    d.prefs["indicator_submenu"] + " " + plugin["plugin"].title.strip()
-                )
-            else:
-                pluginTitle = plugin["plugin"].title.strip()
-
-            if out[: len(pluginTitle)] == pluginTitle:
-                plugin_hook = (plugin["plugin"], pluginTitle)
+        plugin_hook = d.find_plugin(out)
 
         # Check for plugin call
-        if plugin_hook is not False:
+        if plugin_hook is not None:
             plugin_hook[0].load_preferences()
             plugin_hook[0].run(out[len(plugin_hook[1]) :].strip())
             if d.debug:
@@ -1854,12 +3002,13 @@ def run(*args):
             if d.debug:
                 print("This command is not related to a plugin")
             # Check to see if the command is an alias for something
-            if d.retrieve_aliased_command(out) is not None:
+            aliased_command = d.retrieve_aliased_command(out)
+            if aliased_command is not None:
                 # If the user wants frequently used items, store this execution
                 # (before de-aliasing)
                 if d.prefs["frequently_used"] > 0:
                     frequent_commands_store(out)
-                out = d.retrieve_aliased_command(out)
+                out = aliased_command
                 aliased = True
             else:
                 # Check for store modifications
@@ -2027,102 +3176,102 @@ def run(*args):
                             sys.exit()
                         action = "+"
 
-                    cache_scanned = d.cache_open(file_cache)[:-1]
-
-                    if cache_scanned is False:
+                    if d.cache_open(file_cache) is False:
                         d.cache_regenerate()
                         d.message_close()
                         sys.exit()
-                    else:
-                        cache_scanned = cache_scanned.split("\n")
-
-                    if action == "+":
-
-                        if alias is None:
-                            if d.debug:
-                                print("Adding '" + str(command) + "' to store")
-                            d.prefs["include_items"].append(command)
-                            d.message_open("Adding item to store: " + str(command))
-                            cache_scanned = [command] + cache_scanned
-                        else:
-                            if d.debug:
-                                print(
-                                    "Adding aliased command '"
-                                    + str([alias, command])
-                                    + "' to store"
-                                )
-                            d.prefs["include_items"].append([alias, command])
 
-                            # And add the item to the alias lookup file
-                            aliases = d.load_json(file_cache_aliasesLookup)
-                            if [alias, command] not in aliases:
-                                aliases.append([alias, command])
-                                d.save_json(file_cache_aliasesLookup, aliases)
+                    # Changed in the latest generation, under its lock, so that
+                    # a rebuild published since this launch started is kept
+                    with d.new_generation():
+                        cache_scanned = d.cache_open(file_cache)[:-1].split("\n")
 
-                            d.message_open(
-                                "Adding aliased item item to store: "
-                                + str(d.format_alias(alias, command))
-                            )
-                            cache_scanned = [
-                                d.format_alias(alias, command)
-                            ] + cache_scanned
+                        if action == "+":
 
-                        cache_scanned.sort(key=len)
-                    elif action == "-":
-                        if alias is None:
-                            if d.debug:
-                                print(
-                                    "Will try to remove command: '"
-                                    + str(command)
-                                    + "' from the included items"
-                                )
-                            d.prefs["include_items"].remove(command)
-                            d.message_open("Removing item from store: " + str(command))
-                            try:
-                                cache_scanned.remove(command)
-                            except ValueError:
-                                if d.debug:
-                                    print("Could not remove item from the cache")
-                                else:
-                                    pass
-                        else:
-                            to_remove = None
-                            for item in d.prefs["include_items"]:
-                                if item[0] == alias:
-                                    to_remove = item
-                            if to_remove is not None:
+                            if alias is None:
                                 if d.debug:
-                                    print("Item found and is")
-                                    print(to_remove)
-                                d.prefs["include_items"].remove(to_remove)
+                                    print("Adding '" + str(command) + "' to store")
+                                d.prefs["include_items"].append(command)
+                                d.message_open("Adding item to store: " + str(command))
+                                cache_scanned = [command] + cache_scanned
                             else:
                                 if d.debug:
                                     print(
-                                        "Couldn't remove the item (item could not be"
-                                        " located)"
+                                        "Adding aliased command '"
+                                        + str([alias, command])
+                                        + "' to store"
                                     )
+                                d.prefs["include_items"].append([alias, command])
 
-                            d.message_open(
-                                "Removing aliased item from store: "
-                                + str(d.format_alias(alias, command))
-                            )
-                            try:
-                                cache_scanned.remove(d.format_alias(alias, command))
-                            except ValueError:
+                                d.message_open(
+                                    "Adding aliased item item to store: "
+                                    + str(d.format_alias(alias, command))
+                                )
+                                cache_scanned = [
+                                    d.format_alias(alias, command)
+                                ] + cache_scanned
+
+                            cache_scanned.sort(key=len)
+                        elif action == "-":
+                            if alias is None:
                                 if d.debug:
-                                    print("Could not remove item from the cache")
+                                    print(
+                                        "Will try to remove command: '"
+                                        + str(command)
+                                        + "' from the included items"
+                                    )
+                                d.prefs["include_items"].remove(command)
+                                d.message_open(
+                                    "Removing item from store: " + str(command)
+                                )
+                                try:
+                                    cache_scanned.remove(command)
+                                except ValueError:
+                                    if d.debug:
+                                        print("Could not remove item from the cache")
+                                    else:
+                                        pass
+                            else:
+                                to_remove = None
+                                for item in d.prefs["include_items"]:
+                                    if item[0] == alias:
+                                        to_remove = item
+                                if to_remove is not None:
+                                    if d.debug:
+                                        print("Item found and is")
+                                        print(to_remove)
+                                    d.prefs["include_items"].remove(to_remove)
                                 else:
-                                    pass
-                    else:
-                        d.message_close()
-                        d.menu(
-                            "An error occurred while servicing your request.\nYou may"
-                            " need to delete your configuration file."
-                        )
-                        sys.exit()
+                                    if d.debug:
+                                        print(
+                                            "Couldn't remove the item (item could"
+                                            " not be located)"
+                                        )
+
+                                d.message_open(
+                                    "Removing aliased item from store: "
+                                    + str(d.format_alias(alias, command))
+                                )
+                                try:
+                                    cache_scanned.remove(d.format_alias(alias, command))
+                                except ValueError:
+                                    if d.debug:
+                                        print("Could not remove item from the cache")
+                                    else:
+                                        pass
+                        else:
+                            d.message_close()
+                            d.menu(
+                                "An error occurred while servicing your request.\nYou"
+                                " may need to delete your configuration file."
+                            )
+                            sys.exit()
 
-                    d.save_preferences()
-                    d.cache_save(cache_scanned, file_cache)
+                        d.save_preferences()
+                        # The alias is stored before it is listed in the menu
+                        if action == "+" and alias is not None:
+                            d.add_alias(alias, command)
+                        d.cache_save(cache_scanned, file_cache)
                     d.message_close()
 
                     # Give the user some feedback
@@ -2184,24 +3333,26 @@ def run(*args):
                 if cmds[0] == "":
                     if d.debug:
                         print("No program specified, issuing program options to user")
-                    items = list(
-                        filter(lambda x: x.find(cmds[1]) != -1, cache.split("\n"))
-                    )
-                    item = d.menu(items)
+                    item = d.menu(d.cache_filter(cmds[1]))
                     handle_command(d, item)
-                elif cmds[0] in d.scan_binaries():
+                elif d.has_binary(cmds[0]):
                     if d.debug:
                         print(
                             "Item[0] ("
                             + cmds[0]
                             + ") found in binaries so will use this"
                         )
-                    # Get paths from cache
-                    items = list(filter(lambda x: x.find("/") != -1, cache.split("\n")))
-                    # If extension passed, filter by this
-                    if cmds[1] != "":
-                        items = list(filter(lambda x: x.find(cmds[1]) != -1, items))
-                    filename = d.menu(items)
+                    # Get paths from cache, only files with the extension if
+                    # one is passed (e.g. gedit:.txt)
+                    extension = (
+                        cmds[1][:1] == "."
+                        and len(cmds[1]) > 1
+                        and cmds[1].find(".", 1) == -1
+                        and cmds[1].find("/") == -1
+                    )
+                    filename = d.menu(
+                        d.cache_filter(cmds[1], paths_only=True, extension=extension)
+                    )
                     filename = os.path.expanduser(filename)
                     if filename.find(" ") != -1:
                         filename = '"' + filename + '"'
@@ -2279,8 +3430,54 @@ d = dmenu()
 
 
 def build_cache():
-    d.build_cache()
+    import argparse
+
+    def parse_args():
+        parser = argparse.ArgumentParser(description="Rebuild the dmenu-extended cache")
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="List every folder again instead of only those that changed",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of threads used to scan folders (overrides scan_workers)",
+        )
+        parser.add_argument(
+            "--format",
+            choices=["text", "binary"],
+            default=None,
+            help="Write plain text cache files or a single binary cache file"
+            " (overrides cache_format)",
+        )
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="Measure the time and memory taken by each phase, print a summary"
+            " and save a report to " + file_cache_profile,
+        )
+        return parser.parse_args()
+
+    args = parse_args()
+    if args.profile:
+        from . import profiler
+
+        d.profile = profiler.Profile()
+    try:
+        with d.phase("initialise"):
+            initialise()
+        with d.phase("build_cache"):
+            d.build_cache(full=args.full, workers=args.workers, format=args.format)
+    finally:
+        if d.profile is not None:
+            report = d.profile.save(file_cache_profile)
+            d.profile.stop()
+            d.profile = None
+            print(profiler.summary(report))
+            print("Report saved to " + file_cache_profile)
 
 
 if __name__ == "__main__":
-    run(*sys.argv)
+    launch()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+"""Time and memory taken by each phase of a cache rebuild
+
+Used by dmenu_extended_cache_build --profile. Memory is measured with
+tracemalloc, which slows allocations down, so the times are somewhat higher
+than those of a rebuild that is not profiled.
+
+record_spawns lists the processes started by a piece of code, such as a
+launch, which should only start the menu and the program chosen.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+# How many of the slowest directories are reported
+slowest_count = 20
+
+# The audit events raised when a process is started, with the position of
+# the command among their arguments
+spawn_events = {
+    "subprocess.Popen": 1,
+    "os.system": 0,
+    "os.posix_spawn": 1,
+    "os.spawn": 2,
+    "os.exec": 1,
+    "os.fork": None,
+    "os.forkpty": None,
+}
+spawn_recorders = []
+spawn_hook_installed = False
+
+
+def record_spawn(event, args):
+    if spawn_recorders and event in spawn_events:
+        position = spawn_events[event]
+        command = None if position is None else args[position]
+        # os.system and the exec functions give the command as bytes
+        if isinstance(command, bytes):
+            command = os.fsdecode(command)
+        elif isinstance(command, (list, tuple)):
+            command = [
+                os.fsdecode(arg) if isinstance(arg, bytes) else arg for arg in command
+            ]
+        for spawns in spawn_recorders:
+            spawns.append((event, command))
+
+
+@contextlib.contextmanager
+def record_spawns():
+    """Lists the processes started within the with block as (event, command)
+
+    The event is the audit event raised, e.g. "subprocess.Popen", and the
+    command is what was run. Audit hooks cannot be removed, the one added by
+    the first call stays in place but does nothing outside of these blocks.
+    Nothing is recorded before Python 3.8, which has no audit hooks.
+    """
+    global spawn_hook_installed
+    if not spawn_hook_installed and hasattr(sys, "addaudithook"):
+        sys.addaudithook(record_spawn)
+        spawn_hook_installed = True
+    spawns = []
+    spawn_recorders.append(spawns)
+    try:
+        yield spawns
+    finally:
+        spawn_recorders.remove(spawns)
+
+
+class Profile:
+    """Collects the phases of a rebuild as they are run"""
+
+    def __init__(self):
+        self.phases = []
+        self.stack = []
+        # (seconds, path, entries) for each directory read, see scanner.scan
+        self.directories = []
+        self.roots = []
+        self.peak = 0
+        tracemalloc.start()
+        self.started = time.time()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    def peak_so_far(self):
+        """The peak traced memory since the innermost phase started"""
+        return tracemalloc.get_traced_memory()[1]
+
+    def reset_peak(self):
+        # Only available from Python 3.9, peaks are then since the start
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Records the time and memory taken by the body of the with block
+
+        The dict given by the with statement can be filled with details such
+        as the number of items handled.
+        """
+        record = {"name": name, "depth": len(self.stack)}
+        if self.stack:
+            # The enclosing phase keeps the peak it saw before this one started
+            self.stack[-1]["peak"] = max(self.stack[-1]["peak"], self.peak_so_far())
+        self.reset_peak()
+        record["peak"] = 0
+        memory = tracemalloc.get_traced_memory()[0]
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        self.stack.append(record)
+        try:
+            yield record
+        finally:
+            self.stack.pop()
+            record["wall_seconds"] = time.perf_counter() - wall
+            record["cpu_seconds"] = time.process_time() - cpu
+            peak = max(record.pop("peak"), self.peak_so_far())
+            record["peak_memory_bytes"] = max(peak - memory, 0)
+            if self.stack:
+                self.stack[-1]["peak"] = max(self.stack[-1]["peak"], peak)
+            self.peak = max(self.peak, peak)
+            self.phases.append(record)
+
+    def report(self):
+        """The collected figures, as written to the JSON report"""
+        folders = [
+            {"path": root, "directories": 0, "entries": 0, "read_seconds": 0.0}
+            for root in self.roots
+        ]
+        prefixes = [root.rstrip("/") + "/" for root in self.roots]
+        for seconds, path, entries in self.directories:
+            for folder, prefix in zip(folders, prefixes):
+                if path == folder["path"] or path.startswith(prefix):
+                    folder["directories"] += 1
+                    folder["entries"] += entries
+                    folder["read_seconds"] += seconds
+                    break
+        slowest = sorted(self.directories, reverse=True)[:slowest_count]
+        return {
+            "started": self.started,
+            "wall_seconds": time.perf_counter() - self.wall,
+            "cpu_seconds": time.process_time() - self.cpu,
+            "peak_memory_bytes": max(self.peak, self.peak_so_far()),
+            # In the order they finished, nested phases before their parent
+            "phases": self.phases,
+            "watch_folders": folders,
+            "slowest_directories": [
+                {"path": path, "seconds": seconds, "entries": entries}
+                for seconds, path, entries in slowest
+            ],
+        }
+
+    def save(self, path):
+        """Writes the JSON report to path and returns the report"""
+        report = self.report()
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(report, f, indent=4)
+        os.replace(tmp, path)
+        return report
+
+    def stop(self):
+        tracemalloc.stop()
+
+
+def summary(report):
+    """A human readable table of a report"""
+
+    def megabytes(count):
+        return "%.1f" % (count / 2**20)
+
+    lines = [
+        "%-44s %9s %9s %9s %9s" % ("Phase", "Wall (s)", "CPU (s)", "Peak MB", "Items")
+    ]
+    # Show phases in the order they started, nested ones indented
+    ordered = []
+    pending = []
+    for phase in report["phases"]:
+        children = []
+        while pending and pending[-1]["depth"] > phase["depth"]:
+            children.append(pending.pop())
+        pending.append(dict(phase, children=children[::-1]))
+
+    def flatten(phases):
+        for phase in phases:
+            ordered.append(phase)
+            flatten(phase["children"])
+
+    flatten(pending)
+    for phase in ordered:
+        lines.append(
+            "%-44s %9.3f %9.3f %9s %9s"
+            % (
+                ("  " * phase["depth"] + phase["name"])[:44],
+                phase["wall_seconds"],
+                phase["cpu_seconds"],
+                megabytes(phase["peak_memory_bytes"]),
+                phase.get("items", ""),
+            )
+        )
+    lines.append(
+        "%-44s %9.3f %9.3f %9s"
+        % (
+            "Total",
+            report["wall_seconds"],
+            report["cpu_seconds"],
+            megabytes(report["peak_memory_bytes"]),
+        )
+    )
+    if report["watch_folders"]:
+        lines.append("")
+        lines.append(
+            "%-48s %11s %9s %9s" % ("Watch folder", "Folders", "Entries", "Read (s)")
+        )
+        for folder in report["watch_folders"]:
+            lines.append(
+                "%-48s %11d %9d %9.3f"
+                % (
+                    folder["path"][-48:],
+                    folder["directories"],
+                    folder["entries"],
+                    folder["read_seconds"],
+                )
+            )
+    if report["slowest_directories"]:
+        lines.append("")
+        lines.append("%-58s %9s %9s" % ("Slowest directories", "Entries", "Read (s)"))
+        for directory in report["slowest_directories"]:
+            lines.append(
+                "%-58s %9d %9.4f"
+                % (directory["path"][-58:], directory["entries"], directory["seconds"])
+            )
+    return "\n".join(lines)
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+import collections
+import os
+import threading
+import time
+
+# Directories modified this close to the time they were listed may change again
+# within the same timestamp tick, so their listing is never trusted next time.
+mtime_grace_ns = 2 * 10**9
+
+snapshot_version = 1
+
+
+def extension_of(name):
+    """os.path.splitext(name)[1] for a plain file name, without the overhead"""
+    index = name.rfind(".")
+    if index <= 0:
+        return ""
+    if name[0] == ".":
+        # Leading dots do not start an extension (".bashrc", "..x")
+        return os.path.splitext(name)[1]
+    return name[index:]
+
+
+def prefix_of(path):
+    """path with a trailing slash, ready to have a name appended"""
+    return path if path.endswith("/") else path + "/"
+
+
+class ScanRules:
+    """The pruning and filtering rules applied while scanning watch folders"""
+
+    def __init__(
+        self,
+        valid_extensions=True,
+        ignore_folders=(),
+        global_ignore_folders=(),
+        scan_hidden_folders=False,
+        include_hidden_files=False,
+        follow_symlinks=False,
+    ):
+        # Either True (accept everything) or a list of lower case extensions
+        # including the leading dot, "" matches files without an extension
+        self.valid_extensions = valid_extensions
+        self.ignore_folders = set(ignore_folders)
+        self.global_ignore_folders = set(global_ignore_folders)
+        self.scan_hidden_folders = scan_hidden_folders
+        self.include_hidden_files = include_hidden_files
+        self.follow_symlinks = follow_symlinks
+        if valid_extensions is True:
+            self.extension_table = None
+        else:
+            self.extension_table = frozenset(valid_extensions)
+
+    def fingerprint(self):
+        """Returns a json serialisable summary, used to validate snapshots"""
+        if self.valid_extensions is True:
+            valid_extensions = True
+        else:
+            valid_extensions = sorted(set(self.valid_extensions))
+        return [
+            valid_extensions,
+            sorted(self.ignore_folders),
+            sorted(self.global_ignore_folders),
+            self.scan_hidden_folders,
+            self.include_hidden_files,
+            self.follow_symlinks,
+        ]
+
+    def include_contents(self, root):
+        """Whether items found in root are added to the cache"""
+        return self.scan_hidden_folders or root.find("/.") == -1
+
+
+class Snapshot:
+    """The listing of every scanned directory, keyed by the directory's mtime
+
+    A directory's mtime changes whenever an entry is added, removed or renamed
+    inside of it, so a directory whose mtime matches the snapshot can reuse
+    its previous listing without being read again.
+    """
+
+    def __init__(self, rules, directories=None):
+        self.rules = rules
+        # path -> [mtime_ns or None, [[folder, is_link], ...], [file, ...]]
+        self.directories = directories if directories is not None else {}
+
+    @classmethod
+    def from_json(cls, data, rules):
+        """Returns the stored snapshot, or an empty one if it cannot be reused"""
+        if (
+            not isinstance(data, dict)
+            or data.get("version") != snapshot_version
+            or data.get("rules") != rules.fingerprint()
+        ):
+            return cls(rules)
+        return cls(rules, data.get("directories", {}))
+
+    def to_json(self):
+        return {
+            "version": snapshot_version,
+            "rules": self.rules.fingerprint(),
+            "directories": self.directories,
+        }
+
+
+def list_directory(path, rules):
+    """Returns the folders and files in path that pass the rules
+
+    Folders are returned as [name, is_link] pairs. None is returned if the
+    directory could not be read, in which case it is skipped (as os.walk does).
+
+    Entries are classified from the type reported by the directory listing
+    itself, only symbolic links are stat-ed to find out what they point at.
+    """
+    folders = []
+    files = []
+    prefix = prefix_of(path)
+    global_ignore_folders = rules.global_ignore_folders
+    ignore_folders = rules.ignore_folders
+    skip_hidden_folders = rules.scan_hidden_folders is False
+    skip_hidden_files = not rules.include_hidden_files
+    extension_table = rules.extension_table
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                name = entry.name
+                try:
+                    is_link = entry.is_symlink()
+                    if is_link:
+                        is_dir = entry.is_dir()
+                    else:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_link = is_dir = False
+                if is_dir:
+                    if (
+                        name in global_ignore_folders
+                        or (ignore_folders and prefix + name in ignore_folders)
+                        or (skip_hidden_folders and name[0] == ".")
+                    ):
+                        continue
+                    folders.append([name, is_link])
+                elif skip_hidden_files and name[0] == ".":
+                    continue
+                elif (
+                    extension_table is None
+                    or extension_of(name).lower() in extension_table
+                ):
+                    files.append(name)
+    except OSError:
+        return None
+    return folders, files
+
+
+def read_directory(path, rules, previous, dirty):
+    """Returns the snapshot entry for path, or None if it can not be read"""
+    stored = previous.directories.get(path)
+    if dirty is not None and stored is not None and path not in dirty:
+        return stored
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    if dirty is None and stored is not None and stored[0] is not None:
+        if stored[0] == mtime:
+            return stored
+    listed_at = time.time_ns()
+    listing = list_directory(path, rules)
+    if listing is None:
+        return None
+    if mtime >= listed_at - mtime_grace_ns:
+        mtime = None
+    return [mtime, listing[0], listing[1]]
+
+
+def subfolders(path, entry, rules):
+    """The folders below path that are entered while scanning"""
+    prefix = prefix_of(path)
+    return [
+        prefix + name
+        for name, is_link in entry[1]
+        if rules.follow_symlinks or not is_link
+    ]
+
+
+class WorkStealingWalk:
+    """Reads a tree of directories with a pool of threads
+
+    Each thread works depth first from its own queue and, once that is empty,
+    steals the oldest (and therefore likely largest) pending directory from
+    another thread. os.scandir releases the GIL so slow directories or disks
+    do not hold up the rest of the tree.
+    """
+
+    def __init__(self, workers, visit):
+        self.visit = visit
+        self.queues = [collections.deque() for _ in range(workers)]
+        self.outstanding = 0
+        self.condition = threading.Condition()
+        self.error = None
+
+    def take(self, index):
+        try:
+            return self.queues[index].pop()
+        except IndexError:
+            pass
+        count = len(self.queues)
+        for offset in range(1, count):
+            try:
+                return self.queues[(index + offset) % count].popleft()
+            except IndexError:
+                continue
+        return None
+
+    def finish(self, index, children):
+        with self.condition:
+            self.queues[index].extend(reversed(children))
+            self.outstanding += len(children) - 1
+            if children or self.outstanding == 0:
+                self.condition.notify_all()
+
+    def work(self, index):
+        while True:
+            path = self.take(index)
+            if path is None:
+                with self.condition:
+                    if self.outstanding == 0 or self.error is not None:
+                        return
+                    self.condition.wait(0.1)
+                continue
+            try:
+                children = self.visit(path)
+            except BaseException as e:
+                with self.condition:
+                    self.error = e
+                    self.condition.notify_all()
+                return
+            self.finish(index, children)
+
+    def run(self, roots):
+        self.queues[0].extend(reversed(roots))
+        self.outstanding = len(roots)
+        threads = [
+            threading.Thread(target=self.work, args=(index,), daemon=True)
+            for index in range(len(self.queues))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def scan(roots, rules, previous=None, dirty=None, workers=1, timings=None):
+    """Walks the roots and returns (filenames, foldernames, snapshot)
+
+    The output is identical to a top-down os.walk of each root with the rules
+    applied. Directories whose mtime matches the previous snapshot are not
+    listed again, their stored listing is used instead.
+
+    If dirty is given (a set of directory paths known to have changed, e.g.
+    from file system notifications) every other directory in the previous
+    snapshot is trusted without being checked at all.
+
+    With more than one worker, directories are read by a pool of threads. The
+    results are always assembled in the order of a serial walk.
+
+    If timings (a list) is given, (seconds, path, entries) is appended to it
+    for each directory read.
+    """
+    if previous is None:
+        previous = Snapshot(rules)
+    snapshot = Snapshot(rules)
+    roots = list(roots)
+
+    def visit(path):
+        if path in snapshot.directories:
+            return []
+        if timings is None:
+            entry = read_directory(path, rules, previous, dirty)
+        else:
+            started = time.perf_counter()
+            entry = read_directory(path, rules, previous, dirty)
+            if entry is not None:
+                timings.append(
+                    (
+                        time.perf_counter() - started,
+                        path,
+                        len(entry[1]) + len(entry[2]),
+                    )
+                )
+        if entry is None:
+            return []
+        snapshot.directories[path] = entry
+        return subfolders(path, entry, rules)
+
+    if workers > 1:
+        WorkStealingWalk(workers, visit).run(roots)
+    else:
+        pending = list(reversed(roots))
+        while pending:
+            pending.extend(reversed(visit(pending.pop())))
+
+    # Depth first, in listing order, without recursion so deep trees are safe
+    filenames = []
+    foldernames = []
+    pending = list(reversed(roots))
+    while pending:
+        path = pending.pop()
+        entry = snapshot.directories.get(path)
+        if entry is None:
+            continue
+        if rules.include_contents(path):
+            prefix = prefix_of(path)
+            filenames.extend([prefix + name for name in entry[2]])
+            foldernames.extend([prefix + name + "/" for name, _ in entry[1]])
+        pending.extend(reversed(subfolders(path, entry, rules)))
+
+    return filenames, foldernames, snapshot
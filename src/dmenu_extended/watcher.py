@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+from . import main
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+watch_mask = (
+    IN_CREATE
+    | IN_DELETE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+
+event_header = struct.Struct("iIII")
+
+
+class WatchLimitReached(Exception):
+    """No more watches can be added (see /proc/sys/fs/inotify/max_user_watches)"""
+
+
+class Inotify:
+    """Minimal inotify binding using ctypes
+
+    read() returns a list of (path, mask) for every event on a watched folder,
+    where path is the folder the event happened in.
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.add_watch_func = libc.inotify_add_watch
+        self.add_watch_func.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.rm_watch_func = libc.inotify_rm_watch
+        self.rm_watch_func.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths = {}  # wd -> set of paths (one inode may be reached twice)
+        self.wds = {}  # path -> wd
+
+    @staticmethod
+    def available():
+        try:
+            Inotify().close()
+            return True
+        except (OSError, AttributeError):
+            return False
+
+    def close(self):
+        os.close(self.fd)
+
+    def fileno(self):
+        return self.fd
+
+    def watched(self):
+        return set(self.wds)
+
+    def add(self, path):
+        """Watches path, returns False if it can not be watched"""
+        wd = self.add_watch_func(self.fd, os.fsencode(path), watch_mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise WatchLimitReached(path)
+            return False
+        self.wds[path] = wd
+        self.paths.setdefault(wd, set()).add(path)
+        return True
+
+    def remove(self, path):
+        wd = self.wds.pop(path, None)
+        if wd is None:
+            return
+        paths = self.paths.get(wd, set())
+        paths.discard(path)
+        if not paths:
+            self.paths.pop(wd, None)
+            self.rm_watch_func(self.fd, wd)
+
+    def read(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + event_header.size <= len(data):
+            wd, mask, _, length = event_header.unpack_from(data, offset)
+            offset += event_header.size + length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+                continue
+            paths = self.paths.get(wd, set())
+            if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                # The folder went away (or moved), it is no longer tracked by
+                # this path. Its parent reports the change so it is rescanned.
+                for path in paths:
+                    self.wds.pop(path, None)
+                self.paths.pop(wd, None)
+                if not mask & IN_IGNORED:
+                    self.rm_watch_func(self.fd, wd)
+                continue
+            for path in paths:
+                events.append((path, mask))
+        return events
+
+
+class Poller:
+    """Fallback that needs no kernel support: reports nothing by itself
+
+    Every folder handled by a Poller is checked by stat-ing it periodically.
+    """
+
+    def close(self):
+        pass
+
+    def watched(self):
+        return set()
+
+    def add(self, path):
+        raise WatchLimitReached(path)
+
+    def remove(self, path):
+        pass
+
+    def read(self, timeout):
+        time.sleep(timeout)
+        return []
+
+
+class Watcher:
+    """Keeps the file and folder cache up to date as the watch folders change
+
+    Folder changes are collected until nothing has happened for `debounce`
+    seconds (or `max_delay` seconds have passed) and then applied together by
+    listing only the affected folders again. Subtrees that could not be
+    watched are checked for changes every `poll_interval` seconds instead.
+    """
+
+    def __init__(self, backend, debounce=2.0, max_delay=30.0, poll_interval=60.0):
+        self.backend = backend
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.polled = set()  # Roots of subtrees that are polled, not watched
+        self.prefs_mtime = None
+
+    def log(self, message):
+        if main.d.debug:
+            print(message)
+
+    def prefs_changed(self):
+        try:
+            mtime = os.stat(main.file_prefs).st_mtime_ns
+        except OSError:
+            mtime = None
+        changed = self.prefs_mtime is not None and mtime != self.prefs_mtime
+        self.prefs_mtime = mtime
+        return changed
+
+    def is_polled(self, path):
+        while True:
+            if path in self.polled:
+                return True
+            parent = os.path.dirname(path)
+            if parent == path:
+                return False
+            path = parent
+
+    def folders(self):
+        if main.d.snapshot is None:
+            return {}
+        return main.d.snapshot.directories
+
+    def sync_watches(self):
+        """Watches every scanned folder, returns folders that need listing"""
+        folders = self.folders()
+        watched = self.backend.watched()
+        stale = watched - set(folders)
+        for path in stale:
+            self.backend.remove(path)
+        if stale and self.polled:
+            # Watches were freed, try to watch the polled subtrees again
+            self.polled = set()
+
+        added = []
+        for path in folders:
+            if path in watched or self.is_polled(path):
+                continue
+            try:
+                if self.backend.add(path):
+                    added.append(path)
+            except WatchLimitReached:
+                self.log("Unable to watch " + path + ", it will be polled instead")
+                self.polled.add(path)
+
+        # Anything that changed before its watch was in place would be missed
+        return self.changed(added)
+
+    def changed(self, paths):
+        folders = self.folders()
+        out = set()
+        for path in paths:
+            stored = folders.get(path)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if stored is None or stored[0] is None or stored[0] != mtime:
+                out.add(path)
+        return out
+
+    def poll(self):
+        if not self.polled:
+            return set()
+        return self.changed([p for p in self.folders() if self.is_polled(p)])
+
+    def rebuild(self, dirty=None):
+        # Carry on from whatever was published since the last batch
+        main.d.pinned = None
+        if dirty is None:
+            self.log("Checking every folder for changes")
+            main.d.build_cache()
+        else:
+            self.log("Listing " + str(len(dirty)) + " changed folder(s)")
+            main.d.update_scanned(dirty)
+        return self.sync_watches()
+
+    def start(self):
+        main.d.load_preferences()
+        self.prefs_changed()
+        # Watch what is already known before looking for changes so that
+        # nothing can slip in between the check and the watch being added
+        main.d.snapshot = main.d.load_snapshot(main.d.scan_rules())
+        self.sync_watches()
+        return self.rebuild()
+
+    def run(self):
+        pending = self.start()
+        first_change = time.monotonic() if pending else None
+        last_change = first_change
+        next_poll = time.monotonic() + self.poll_interval
+        while True:
+            now = time.monotonic()
+            deadlines = [next_poll]
+            if pending:
+                deadlines.append(last_change + self.debounce)
+                deadlines.append(first_change + self.max_delay)
+            timeout = max(0.0, min(deadlines) - now)
+
+            full = False
+            for path, mask in self.backend.read(timeout):
+                if path is None:
+                    # The kernel dropped events, anything could have changed
+                    full = True
+                else:
+                    pending.add(path)
+                now = time.monotonic()
+                first_change = first_change or now
+                last_change = now
+
+            now = time.monotonic()
+            if now >= next_poll:
+                next_poll = now + self.poll_interval
+                if self.prefs_changed():
+                    self.log("Preferences changed")
+                    main.d.prefs = False
+                    full = True
+                polled = self.poll()
+                if polled:
+                    pending |= polled
+                    first_change = first_change or now
+                    last_change = now
+
+            if full:
+                pending = self.rebuild()
+            elif pending and (
+                now - last_change >= self.debounce
+                or now - first_change >= self.max_delay
+            ):
+                pending = self.rebuild(pending)
+            else:
+                continue
+            first_change = time.monotonic() if pending else None
+            last_change = first_change
+
+
+def run():
+    def parse_args():
+        parser = argparse.ArgumentParser(
+            description="Keep the dmenu-extended cache up to date as files change"
+        )
+        parser.add_argument(
+            "--backend",
+            choices=["auto", "inotify", "poll"],
+            default="auto",
+            help="How to detect changes (poll works everywhere but is slower)",
+        )
+        parser.add_argument(
+            "--debounce",
+            type=float,
+            default=2.0,
+            help="Seconds without changes before the cache is updated",
+        )
+        parser.add_argument(
+            "--max-delay",
+            type=float,
+            default=30.0,
+            help="Longest time in seconds a change may wait to be applied",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=60.0,
+            help="Seconds between checks of folders that can not be watched",
+        )
+        parser.add_argument(
+            "--debug", action="store_true", help="Print what the watcher is doing"
+        )
+        return parser.parse_args()
+
+    args = parse_args()
+    main.d.debug = args.debug
+    if args.backend == "poll" or (args.backend == "auto" and not Inotify.available()):
+        backend = Poller()
+    else:
+        backend = Inotify()
+
+    watcher = Watcher(
+        backend,
+        debounce=args.debounce,
+        max_delay=args.max_delay,
+        poll_interval=args.poll_interval,
+    )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        backend.close()
+
+
+if __name__ == "__main__":
+    run()
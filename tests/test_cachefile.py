@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import cachefile
+import os
+import pytest
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "cache.bin")
+    files = ["/home/user/b.pdf", "/home/user/a.pdf", "/home/user/caf\udce9.txt"]
+    cachefile.write(path, {"binaries": ["vim", "ls", "htop"], "files": files})
+    with cachefile.CacheFile(path) as cache:
+        assert cache.text("binaries") == "vim\nls\nhtop\n"
+        assert cache.text("files").split("\n")[:-1] == files
+        assert cache.count("files") == 3
+        assert [bytes(cache.record("binaries", i)) for i in range(3)] == [
+            b"ls",
+            b"vim",
+            b"htop",
+        ]
+        for item in files:
+            assert cache.contains("files", item)
+        assert not cache.contains("files", "/home/user/c.pdf")
+        assert not cache.contains("binaries", "")
+        assert "folders" not in cache
+
+
+def test_rejects_other_files(tmp_path):
+    path = str(tmp_path / "cache.bin")
+    with open(path, "w") as f:
+        f.write("htop\nvim\n")
+    with pytest.raises(cachefile.CacheFormatError):
+        cachefile.CacheFile(path)
+    os.truncate(path, 2)
+    with pytest.raises(cachefile.CacheFormatError):
+        cachefile.CacheFile(path)
+
+
+def test_stream_sends_text_and_slices(tmp_path):
+    text_path = str(tmp_path / "all.txt")
+    with open(text_path, "w") as f:
+        f.write("a\nbb\n")
+    binary_path = str(tmp_path / "cache.bin")
+    cachefile.write(binary_path, {"plugins": ["p"], "all": ["c", "dd"]})
+
+    stream = cachefile.Stream(
+        [
+            "head\n",
+            cachefile.CacheSlice.open(text_path),
+            "",
+            cachefile.CacheSlice.open(binary_path, "all"),
+        ]
+    )
+    expected = "head\na\nbb\nc\ndd\n"
+    assert stream.read() == expected
+    read_fd, write_fd = os.pipe()
+    try:
+        stream.send(write_fd)
+        os.close(write_fd)
+        write_fd = None
+        assert os.read(read_fd, 1024).decode() == expected
+    finally:
+        stream.close()
+        os.close(read_fd)
+        if write_fd is not None:
+            os.close(write_fd)
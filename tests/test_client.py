@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import array
+import client
+import json
+import mock
+import os
+import socket
+import threading
+
+
+def test_socket_path_uses_runtime_dir():
+    with mock.patch.dict(os.environ, {"XDG_RUNTIME_DIR": "/run/user/1000"}):
+        assert client.socket_path() == "/run/user/1000/" + client.socket_name
+    with mock.patch.dict(os.environ, {"XDG_RUNTIME_DIR": ""}):
+        assert client.socket_path() is None
+
+
+def test_connect_without_daemon(tmp_path):
+    assert client.connect(str(tmp_path / "missing.sock")) is None
+
+
+def test_request_round_trip(tmp_path):
+    path = str(tmp_path / "daemon.sock")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+    received = {}
+
+    def serve():
+        conn, _ = server.accept()
+        fds = array.array("i")
+        data, ancdata, _, _ = conn.recvmsg(65536, socket.CMSG_SPACE(3 * 4))
+        for _, _, cmsg_data in ancdata:
+            fds.frombytes(cmsg_data)
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        received["request"] = json.loads(data)
+        received["fds"] = list(fds)
+        for fd in fds:
+            os.close(fd)
+        conn.sendall(b"3")
+        conn.close()
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    sock = client.connect(path)
+    assert sock is not None
+    with sock:
+        status = client.send_request(sock, ["dmenu_extended_run", "--debug"])
+    thread.join()
+    server.close()
+
+    assert status == 3
+    assert received["request"]["argv"] == ["dmenu_extended_run", "--debug"]
+    assert received["request"]["cwd"] == os.getcwd()
+    assert len(received["fds"]) == 3
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import mock
+import os
+import random
+from dmenu_extended import cachefile, filterindex
+
+
+def make_items(count, seed=0):
+    rng = random.Random(seed)
+    words = ["docs", "music", "report", "café", "notes", "photo", "src", "a.b"]
+    extensions = [".pdf", ".PDF", ".txt", ".py", ".tar.gz", "", "/"]
+    items = ["htop", "Firefox Web Browser", "vim;"]
+    for _ in range(count):
+        parts = [rng.choice(words) + str(rng.randrange(20)) for _ in range(3)]
+        items.append("/home/user/" + "/".join(parts) + rng.choice(extensions))
+    items.append("/home/user/.bashrc")
+    items.append("/home/user/x.pdf.d/")
+    return items
+
+
+def brute_force(items, query, extension_name=False):
+    if extension_name:
+        return [x for x in items if os.path.splitext(x)[1] == query]
+    return [x for x in items if x.find(query) != -1]
+
+
+def test_search_matches_brute_force(tmp_path):
+    items = make_items(2000)
+    path = str(tmp_path / "index.bin")
+    with mock.patch.object(filterindex, "block_size", new=256):
+        filterindex.write(path, items)
+    data = b"prefix\n" + b"".join(cachefile.encode(x) + b"\n" for x in items)
+    base = len(b"prefix\n")
+    length = len(data) - base
+
+    queries = ["", "d", "pdf", ".pdf", "report1", "café", "/music3/", "zzz"]
+    queries += ["docs1/", "Web", "1/photo", "a.b1"]
+    with filterindex.FilterIndex(path) as index:
+        assert index.blocks > 1
+        assert index.matches_data(data, base, length)
+        for query in queries:
+            needle = cachefile.encode(query)
+            for found_index in [index, None]:
+                lines = filterindex.search(data, base, length, needle, found_index)
+                assert [cachefile.decode(x) for x in lines] == brute_force(items, query)
+        for query in [".pdf", ".PDF", ".gz", ".txt", ".py", ".bashrc", ".d"]:
+            needle = cachefile.encode(query)
+            for found_index in [index, None]:
+                lines = filterindex.search(
+                    data, base, length, needle, found_index, extension_name=True
+                )
+                assert [cachefile.decode(x) for x in lines] == brute_force(
+                    items, query, extension_name=True
+                )
+        # The index is not used for data it was not built from
+        assert not index.matches_data(data + b"new\n", base, length + 4)
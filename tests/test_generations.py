@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import mock
+import os
+import dmenu_extended as d
+from dmenu_extended import generations
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_publish_and_collect(tmp_path):
+    root = str(tmp_path)
+    # A cache written by a version without generations
+    with open(os.path.join(root, "all.txt"), "w") as f:
+        f.write("old\n")
+    with open(os.path.join(root, "snapshot.json"), "w") as f:
+        f.write("{}")
+    assert generations.current(root) == root
+
+    folder = generations.create(root)
+    with open(os.path.join(folder, "all.txt"), "w") as f:
+        f.write("first\n")
+    first = generations.publish(root, folder, ["all.txt", "cache.bin"])
+    assert generations.current(root) == first
+    assert os.path.islink(os.path.join(root, "all.txt"))
+    assert read(os.path.join(root, "all.txt")) == "first\n"
+    assert read(os.path.join(root, "snapshot.json")) == "{}"
+
+    # Files are carried over as links
+    with open(os.path.join(first, "store.bin"), "w") as f:
+        f.write("aliases")
+    folder = generations.create(root, first, ["all.txt", "store.bin"])
+    assert os.path.samefile(
+        os.path.join(folder, "all.txt"), os.path.join(first, "all.txt")
+    )
+    assert os.path.samefile(
+        os.path.join(folder, "store.bin"), os.path.join(first, "store.bin")
+    )
+    second = generations.publish(root, folder)
+    assert read(os.path.join(root, "store.bin")) == "aliases"
+
+    building = generations.create(root)
+    third = generations.publish(root, generations.create(root), ["all.txt"])
+    generations.collect(root)
+    assert not os.path.exists(first)
+    assert os.path.exists(second)
+    assert generations.current(root) == third
+    # Not in the current generation any more
+    assert not os.path.lexists(os.path.join(root, "all.txt"))
+
+    # Generations still being written are left alone unless abandoned
+    parent = os.path.join(root, generations.folder_name)
+    assert os.path.exists(building)
+    with mock.patch.object(generations, "abandoned_after", new=-60):
+        generations.collect(root)
+    assert sorted(os.listdir(parent)) == ["2", "3"]
+
+
+def test_publish_never_goes_back(tmp_path):
+    import shutil
+
+    root = str(tmp_path)
+    first = generations.publish(root, generations.create(root))
+    second = generations.publish(root, generations.create(root))
+    shutil.rmtree(first)
+    # A writer that claimed its number before the second one was published
+    with mock.patch.object(generations, "numbered", return_value=[]):
+        late = generations.create(root)
+        assert generations.publish(root, late) == second
+    assert generations.current(root) == second
+    assert os.path.isdir(first)
+
+
+def test_reader_keeps_its_generation(tmp_path):
+    cache = str(tmp_path)
+    files = {
+        name: os.path.join(cache, os.path.basename(getattr(d.main, name)))
+        for name in ["file_cache", "file_cache_plugins", "file_cache_binary"]
+    }
+    with mock.patch.object(d.main, "path_cache", new=cache), mock.patch.multiple(
+        d.main, generation_files=list(files.values()), **files
+    ), mock.patch.dict(
+        d.main.cache_sections,
+        {files["file_cache"]: "all", files["file_cache_plugins"]: "plugins"},
+    ):
+        writer = d.dmenu()
+        with writer.new_generation(derive=False):
+            writer.cache_save(["a", "b"], files["file_cache"])
+            writer.cache_save(["plugin"], files["file_cache_plugins"])
+            # Nothing is published before the generation is complete
+            assert generations.current(cache) == cache
+        reader = d.dmenu()
+        assert reader.cache_open(files["file_cache"]) == "a\nb\n"
+
+        writer.cache_save(["c"], files["file_cache"])
+        assert reader.cache_open(files["file_cache"]) == "a\nb\n"
+        assert d.dmenu().cache_open(files["file_cache"]) == "c\n"
+        assert d.dmenu().cache_open(files["file_cache_plugins"]) == "plugin\n"
+
+        # Once its generation is removed the reader moves to the current one
+        writer.cache_save(["d"], files["file_cache"])
+        assert not os.path.exists(reader.generation())
+        assert reader.generation_removed()
+        assert reader.cache_open(files["file_cache"]) == "d\n"
+
+        # An update derives from the latest generation, not the one read
+        d.dmenu().cache_save(["new plugin"], files["file_cache_plugins"])
+        reader.cache_save(["e"], files["file_cache"])
+        assert d.dmenu().cache_open(files["file_cache_plugins"]) == "new plugin\n"
+        assert d.dmenu().cache_open(files["file_cache"]) == "e\n"
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+import hashlib
+import http.server
+import json
+import mock
+import os
+import threading
+import time
+import dmenu_extended as d
+from dmenu_extended import httpcache
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Serves /<name> from the server's pages, honouring If-None-Match"""
+
+    def do_GET(self):
+        server = self.server
+        name = self.path.strip("/")
+        server.requests.append((name, self.headers.get("If-None-Match")))
+        time.sleep(server.delays.get(name, 0))
+        if name not in server.pages:
+            self.send_error(500)
+            return
+        body = server.pages[name].encode("utf-8")
+        etag = '"%d"' % hash(body)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.pages = {}
+    server.delays = {}
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d/" % server.server_address[1]
+
+
+def test_fetch_revalidates_and_falls_back(tmp_path):
+    server, base = start_server()
+    folder = str(tmp_path)
+    try:
+        server.pages["a"] = "first"
+        assert httpcache.fetch(base + "a", folder) == (b"first", None)
+        assert httpcache.fetch(base + "a", folder) == (b"first", None)
+        # The second request was conditional and answered with 304
+        assert server.requests[0] == ("a", None)
+        assert server.requests[1][1] is not None
+
+        server.pages["a"] = "second"
+        assert httpcache.fetch(base + "a", folder) == (b"second", None)
+
+        # A failing or slow server falls back to the copy on disk
+        del server.pages["a"]
+        body, error = httpcache.fetch(base + "a", folder)
+        assert body == b"second" and error.code == 500
+        server.pages["a"] = "third"
+        server.delays["a"] = 1
+        body, error = httpcache.fetch(base + "a", folder, timeout=0.2)
+        assert body == b"second" and error is not None
+        body, error = httpcache.fetch(base + "missing", folder)
+        assert body is None and error is not None
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_download_plugins_json_concurrent(tmp_path):
+    server, base = start_server()
+    try:
+        for name in ["one", "two", "three"]:
+            server.pages[name] = json.dumps({"plugin_" + name: {"desc": name}})
+            server.delays[name] = 0.5
+        server.pages["two"] = json.dumps({"plugin_one": {"desc": "override"}})
+        urls = [base + "one", base + "two", base + "three"]
+        with mock.patch.object(
+            d.main, "path_downloads", new=str(tmp_path)
+        ), mock.patch.object(
+            d.main.extension, "plugins_index_urls", new=urls
+        ), mock.patch.object(
+            d.main.extension, "load_preferences"
+        ):
+            settings = d.main.extension()
+            started = time.perf_counter()
+            plugins = settings.download_plugins_json()
+            assert time.perf_counter() - started < 1.4
+            assert plugins == {
+                "plugin_one": {"desc": "override"},
+                "plugin_three": {"desc": "three"},
+            }
+
+            # A mirror that stops answering is read from the copy on disk
+            del server.pages["three"]
+            assert settings.download_plugins_json() == plugins
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_update_plugins(tmp_path):
+    server, base = start_server()
+    plugins = tmp_path / "plugins"
+    plugins.mkdir()
+    sources = {
+        "plugin_old": "title = 'new'\n",
+        "plugin_current": "title = 'current'\n",
+        "plugin_corrupt": "title = 'corrupt'\n",
+    }
+    index = {}
+    manifest = [{"filename": "plugin_settings.py", "module": None}]
+    for name, source in sources.items():
+        server.pages[name] = source
+        sha1 = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        index[name] = {"url": base + name, "sha1sum": sha1}
+        installed = source if name == "plugin_current" else "title = 'old'\n"
+        (plugins / (name + ".py")).write_text(installed)
+        manifest.append(
+            {
+                "module": name,
+                "sha1": hashlib.sha1(installed.encode("utf-8")).hexdigest(),
+            }
+        )
+    index["plugin_corrupt"]["sha1sum"] = "0" * 40
+    settings = d.main.extension.__new__(d.main.extension)
+    try:
+        with mock.patch.object(
+            d.main, "path_plugins", new=str(plugins)
+        ), mock.patch.object(
+            settings, "plugin_manifest", return_value=manifest
+        ), mock.patch.object(
+            settings, "download_plugins_json", return_value=index
+        ), mock.patch.object(
+            settings, "plugins_available"
+        ) as plugins_available, mock.patch.object(
+            settings, "message_open"
+        ), mock.patch.object(
+            settings, "message_close"
+        ), mock.patch.object(
+            settings, "menu"
+        ) as menu, mock.patch(
+            "os.system"
+        ) as system:
+            settings.update_plugins()
+        assert system.call_count == 0
+        assert plugins_available.call_count == 1
+        assert (plugins / "plugin_old.py").read_text() == sources["plugin_old"]
+        assert (plugins / "plugin_corrupt.py").read_text() == "title = 'old'\n"
+        assert sorted(os.listdir(str(plugins))) == [
+            "plugin_corrupt.py",
+            "plugin_current.py",
+            "plugin_old.py",
+        ]
+        summary = menu.call_args[0][0]
+        assert summary[0] == "plugin_old was updated to the latest version"
+        assert summary[1].startswith("Downloaded ")
+        assert summary[2].startswith("plugin_corrupt was not updated")
+        # Only the out of date plugins were downloaded
+        assert sorted(name for name, _ in server.requests) == [
+            "plugin_corrupt",
+            "plugin_old",
+        ]
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import os
+import subprocess
+import sys
+
+# Importing dmenu_extended.main is on the path of every launch. The budget can
+# be raised on slow machines, e.g. DMENU_EXTENDED_IMPORT_BUDGET_MS=500
+budget_ms = float(os.environ.get("DMENU_EXTENDED_IMPORT_BUDGET_MS", 150))
+
+
+def scratch_env(tmp_path):
+    env = dict(
+        os.environ,
+        HOME=str(tmp_path / "home"),
+        XDG_CACHE_HOME=str(tmp_path / "home" / ".cache"),
+        PYTHONPYCACHEPREFIX=str(tmp_path / "pycache"),
+    )
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    os.makedirs(env["HOME"])
+    return env
+
+
+def import_times(tmp_path):
+    """Returns {module: cumulative import time in microseconds}"""
+    env = scratch_env(tmp_path)
+    command = [sys.executable, "-X", "importtime", "-c", "import dmenu_extended.main"]
+    # The first import compiles the bytecode
+    subprocess.run(command, env=env, check=True, capture_output=True)
+
+    result = subprocess.run(command, env=env, check=True, capture_output=True)
+    times = {}
+    for line in result.stderr.decode().splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_import_avoids_heavy_modules(tmp_path):
+    times = import_times(tmp_path)
+    assert "dmenu_extended.main" in times
+    for module in ["pkg_resources", "urllib.request", "argparse", "hashlib"]:
+        assert module not in times
+
+
+def test_import_time_budget(tmp_path):
+    # Best of a few runs so a busy machine does not fail the test
+    best = min(
+        import_times(tmp_path / str(run))["dmenu_extended.main"] for run in range(3)
+    )
+    assert best / 1000 <= budget_ms
+
+
+def test_import_has_no_side_effects(tmp_path):
+    env = scratch_env(tmp_path)
+    code = (
+        "import sys\n"
+        "from dmenu_extended import main\n"
+        "assert main.plugins is None and 'plugins' not in sys.modules\n"
+        "assert main.path_base not in sys.path\n"
+        "assert main.d.command_to_list('a b') == ['a', 'b']\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True)
+    assert result.returncode == 0, result.stderr.decode()
+    assert result.stdout == b""
+    assert os.listdir(env["HOME"]) == []
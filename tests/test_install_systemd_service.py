@@ -68,3 +68,55 @@ def test_generate_valid_service_files():
                         ]
                     checker_func(files[filetype], expected_mins)
                 shutil.rmtree(path_test_install)
+
+
+def test_timer_status(tmp_path):
+    env = {"HOME": str(tmp_path), "XDG_CACHE_HOME": str(tmp_path / "cache")}
+    units = tmp_path / ".config" / "systemd" / "user"
+    wants = units / "timers.target.wants"
+    os.makedirs(str(tmp_path / "cache" / "dmenu-extended"))
+    with mock.patch.dict(os.environ, env, clear=True), mock.patch.object(
+        install_systemd_service, "system_user_paths", new=[]
+    ), mock.patch.object(install_systemd_service, "mtime_grace_ns", new=0), mock.patch(
+        "shutil.which", return_value="/usr/bin/systemctl"
+    ), mock.patch(
+        "subprocess.call"
+    ) as call, mock.patch(
+        "subprocess.check_output"
+    ) as check_output:
+        assert install_systemd_service.timer_status() == 0
+
+        os.makedirs(str(wants))
+        (units / "dmenu-extended-update-db.timer").write_text("[Timer]\n")
+        assert install_systemd_service.timer_status() == 2
+        os.symlink("../dmenu-extended-update-db.timer", str(wants / "x.timer"))
+        os.rename(str(wants / "x.timer"), str(wants / "dmenu-extended-update-db.timer"))
+        assert install_systemd_service.timer_status() == 1
+
+        # The saved status is used while the unit folders are unchanged
+        with mock.patch.object(
+            install_systemd_service, "read_timer_status"
+        ) as read_timer_status:
+            assert install_systemd_service.timer_status() == 1
+            assert read_timer_status.call_count == 0
+        (wants / "dmenu-extended-update-db.timer").unlink()
+        assert install_systemd_service.timer_status() == 2
+
+        # Installed by a package, and enabled for every user by an admin
+        system = tmp_path / "etc" / "systemd" / "user"
+        os.makedirs(str(system / "timers.target.wants"))
+        (units / "dmenu-extended-update-db.timer").unlink()
+        assert install_systemd_service.timer_status() == 0
+        with mock.patch.object(
+            install_systemd_service, "system_user_paths", new=[str(system)]
+        ):
+            (system / "dmenu-extended-update-db.timer").write_text("[Timer]\n")
+            assert install_systemd_service.timer_status() == 2
+            os.symlink(
+                "../dmenu-extended-update-db.timer",
+                str(system / "timers.target.wants" / "dmenu-extended-update-db.timer"),
+            )
+            assert install_systemd_service.timer_status() == 1
+
+        assert call.call_count == 0
+        assert check_output.call_count == 0
@@ -1,6 +1,8 @@
 #! /usr/bin/env python3
 
+import json
 import mock
+import os
 import sys
 from os import path
 
@@ -76,3 +78,343 @@ def test_command_to_list():
 def test_scan_binaries_file_in_system_path():
     with mock.patch.object(menu, "system_path", new=lambda: ["/bin", "/bin/cp"]):
         assert type(menu.scan_binaries()) == list
+
+
+def test_assemble_cache():
+    def app(name, command, terminal=False):
+        return {
+            "name": name,
+            "name_generic": name,
+            "command": command,
+            "terminal": terminal,
+            "descriptor": command,
+        }
+
+    prefs = dict(
+        d.default_prefs,
+        include_binaries=True,
+        filter_binaries=False,
+        include_applications=True,
+        alias_applications=False,
+        include_items=["vim;", ["Editor", "gedit"]],
+        exclude_items=["ls", "/b/", "/b/"],
+        abbreviate_homedir=False,
+        path_aliasFile="",
+    )
+    applications = [app("Htop", "htop", terminal=True), app("Top", "top")]
+    binaries = ["ls", "htop", "vim", "ls", "top"]
+    with mock.patch.object(menu, "prefs", new=prefs):
+        aliases, aliased_items, binaries, other, excluded = menu.assemble_cache(
+            applications, binaries, ["/b/", "/a/", "/b/", "/b/"], ["/a/x"]
+        )
+    assert aliases == [["Editor", "gedit"]]
+    assert aliased_items == ["Editor"]
+    assert binaries == ["ls", "top", "htop;"]
+    # One "ls" and the first two "/b/" are excluded
+    assert other == ["top", "/a/", "/b/", "vim;", "/a/x", "htop;", "Editor"] + [
+        "rebuild cache"
+    ]
+    # The binary used up the "ls" exclusion, both "/b/" ones fell on folders
+    assert excluded == {"/b/": 2}
+
+
+def test_plugin_manifest(tmp_path):
+    d.main.initialise()
+    plugins = d.main.plugins
+
+    def write_plugin(name, title, submenu=False):
+        with open(str(tmp_path / (name + ".py")), "w") as f:
+            f.write(
+                "import dmenu_extended\n"
+                "class extension(dmenu_extended.dmenu):\n"
+                "    title = %r\n"
+                "    is_submenu = %r\n"
+                "    def run(self, text):\n"
+                "        pass\n" % (title, submenu)
+            )
+
+    write_plugin("plugin_test_one", "Search: ")
+    write_plugin("plugin_test_two", "Search web: ", submenu=True)
+    with mock.patch.object(
+        d.main, "path_plugins", new=str(tmp_path)
+    ), mock.patch.object(
+        d.main, "file_cache_plugins_manifest", new=str(tmp_path / "manifest.json")
+    ), mock.patch.object(
+        plugins, "__path__", new=[str(tmp_path)]
+    ):
+        manifest = menu.plugin_manifest()
+        assert manifest[0]["title"] == "Settings"
+        assert sorted(entry["title"] for entry in manifest[1:]) == [
+            "Search web: ",
+            "Search: ",
+        ]
+
+        # Nothing is imported while the sources are unchanged
+        with mock.patch.object(menu, "describe_plugin") as describe:
+            assert menu.plugin_manifest() == manifest
+            hook = menu.find_plugin("Search: cats")
+            assert describe.call_count == 0
+        assert hook[1] == "Search:"
+        assert hook[0].title == "Search: "
+        assert menu.find_plugin("something else") is None
+
+        write_plugin("plugin_test_one", "Find: ")
+        titles = [entry["title"] for entry in menu.plugin_manifest()]
+        assert "Find: " in titles and "Search: " not in titles
+
+
+def test_binary_index(tmp_path):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name in ["vim", "htop", "gpk-thing"]:
+        (bin_dir / name).write_text("")
+    old = 10**9
+    os.utime(str(bin_dir), ns=(old, old))
+    index_path = str(tmp_path / "index.json")
+
+    with mock.patch.object(
+        menu, "system_path", new=lambda: [str(bin_dir), "/missing"]
+    ), mock.patch.object(d.main, "file_cache_path_index", new=index_path):
+        menu.path_index = None
+        assert menu.scan_binaries() == ["htop", "vim"]
+        assert menu.has_binary("vim") and not menu.has_binary("gpk-thing")
+
+        # A new process reuses the stored listing while the folder is unchanged
+        menu.path_index = None
+        with mock.patch.object(d.main.os, "listdir") as listdir:
+            assert menu.has_binary("htop")
+            assert listdir.call_count == 0
+
+        (bin_dir / "nano").write_text("")
+        assert menu.has_binary("nano")
+    menu.path_index = None
+
+
+def test_scan_applications_reuses_parsed_entries(tmp_path):
+    def write_entry(folder, filename, name, command, terminal="false"):
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / filename).write_text(
+            "[Desktop Entry]\nName=%s\nExec=%s %%F\nTerminal=%s\n"
+            % (name, command, terminal)
+        )
+        # Old enough for the parsed entry to be trusted
+        os.utime(str(folder / filename), ns=(10**9, 10**9))
+
+    user = tmp_path / "home" / "applications"
+    system = tmp_path / "usr" / "applications"
+    write_entry(user, "editor.desktop", "My Editor", "/usr/bin/gedit --new")
+    write_entry(system, "editor.desktop", "Editor", "gedit")
+    write_entry(system, "htop.desktop", "Htop", "htop", terminal="true")
+    (system / "broken.desktop").write_text("[Desktop Entry]\n")
+    os.utime(str(system / "broken.desktop"), ns=(10**9, 10**9))
+
+    env = {
+        "XDG_DATA_HOME": str(tmp_path / "home"),
+        "XDG_DATA_DIRS": str(tmp_path / "usr"),
+    }
+    with mock.patch.dict(os.environ, env), mock.patch.object(
+        menu, "system_path", new=lambda: ["/usr/bin"]
+    ), mock.patch.object(
+        d.main, "file_cache_applications", new=str(tmp_path / "apps.json")
+    ), mock.patch.object(
+        d.main, "desktop_entry_parallel_threshold", new=0
+    ):
+        applications = menu.scan_applications()
+        found = [(app["name"], app["command"], app["terminal"]) for app in applications]
+        # User entries come first, the broken entry is skipped
+        assert found[0] == ("My Editor", "gedit --new", False)
+        assert sorted(found[1:]) == [("Editor", "gedit", False), ("Htop", "htop", True)]
+
+        with mock.patch.object(d.main, "parse_desktop_entry") as parse:
+            assert menu.scan_applications() == applications
+            assert parse.call_count == 0
+
+        (user / "editor.desktop").unlink()
+        write_entry(system, "htop.desktop", "Process viewer", "htop")
+        names = sorted(app["name"] for app in menu.scan_applications())
+        assert names == ["Editor", "Process viewer"]
+
+
+def test_alias_store(tmp_path):
+    store = str(tmp_path / "aliases.bin")
+    added = str(tmp_path / "added.jsonl")
+    with mock.patch.object(
+        d.main, "file_cache_aliasesStore", new=store
+    ), mock.patch.object(d.main, "path_cache", new=str(tmp_path)), mock.patch.object(
+        d.main, "file_cache_aliasesLookup", new=str(tmp_path / "aliases.json")
+    ), mock.patch.object(
+        d.main, "file_cache_aliasesAdded", new=added
+    ):
+        assert menu.retrieve_aliased_command("Htop") is None
+        menu.save_aliases([["Htop", "htop;"], ["Editor", "gedit"], ["Htop", "top"]])
+        assert menu.retrieve_aliased_command("Htop") == "htop;"
+        assert menu.retrieve_aliased_command("Editor") == "gedit"
+        assert menu.retrieve_aliased_command("Missing") is None
+
+        # Adding an alias only writes the new one
+        with open(store, "rb") as f:
+            written = f.read()
+        menu.add_alias("Files", "nautilus")
+        menu.add_alias("Htop", "other")
+        assert menu.retrieve_aliased_command("Files") == "nautilus"
+        assert menu.retrieve_aliased_command("Htop") == "htop;"
+        with open(store, "rb") as f:
+            assert f.read() == written
+        with open(added) as f:
+            assert f.read() == '["Files", "nautilus"]\n'
+
+        # A rebuild merges them into the store
+        menu.save_aliases([["Htop", "htop;"], ["Files", "nautilus"]])
+        assert not os.path.exists(added)
+        assert menu.retrieve_aliased_command("Files") == "nautilus"
+
+
+def test_alias_lookup_reads_one_bucket(tmp_path):
+    store = str(tmp_path / "aliases.bin")
+    aliases = [["Alias %d" % n, "command --number %d" % n] for n in range(5000)]
+    d.aliasindex.write(store, aliases)
+    with mock.patch.object(
+        d.aliasindex, "read_at", wraps=d.aliasindex.read_at
+    ) as read_at:
+        for title, command in aliases[::500]:
+            read_at.reset_mock()
+            assert d.aliasindex.lookup(store, title) == command
+            read = sum(call[0][2] for call in read_at.call_args_list)
+            assert read < 1024
+        assert d.aliasindex.lookup(store, "Alias -1") is None
+    assert os.path.getsize(store) > 100 * 1024
+
+
+def test_frequent_commands_log(tmp_path):
+    day = 24 * 60 * 60
+    with mock.patch.object(
+        d.main,
+        "file_cache_frequentlyUsed_frequency",
+        new=str(tmp_path / "frequency.json"),
+    ), mock.patch.object(
+        d.main, "file_cache_frequentlyUsed_ordered", new=str(tmp_path / "ordered")
+    ), mock.patch.object(
+        d.main, "file_cache_frequentlyUsed_log", new=str(tmp_path / "usage.log")
+    ), mock.patch.object(
+        d.main, "frequent_commands_limit", new=3
+    ), mock.patch.object(
+        d.main, "frequent_commands_half_life", new=14 * day
+    ), mock.patch(
+        "time.time", return_value=1000 * day
+    ) as now:
+        # Counts kept by older versions are carried over
+        with open(str(tmp_path / "frequency.json"), "w") as f:
+            json.dump({"gimp": 2}, f, indent=4)
+        for command in ["firefox", "htop", "firefox", "vim", "firefox", "xterm"]:
+            d.main.frequent_commands_store(command)
+        assert d.main.frequent_commands_retrieve(2) == ""
+
+        d.main.frequent_commands_compact()
+        assert not os.path.exists(str(tmp_path / "usage.log"))
+        assert d.main.frequent_commands_retrieve(2) == "firefox\ngimp\n"
+        assert d.main.frequent_commands_ranked(10) == ["firefox", "gimp", "htop"]
+
+        # Two half lives later the old uses count for a quarter, and a full log
+        # is compacted straight away
+        now.return_value += 28 * day
+        with mock.patch.object(d.main, "frequent_commands_log_limit", new=0):
+            d.main.frequent_commands_store("vim")
+            d.main.frequent_commands_store("vim")
+        assert d.main.frequent_commands_ranked(10) == ["vim", "firefox", "gimp"]
+        with open(str(tmp_path / "frequency.json")) as f:
+            assert json.load(f)["scores"]["firefox"] == 0.75
+
+
+def test_cache_stream_frequent_head():
+    preloaded = {
+        d.main.file_cache_plugins: "-> Settings\nplugin\n",
+        d.main.file_cache_frequent: "vim\n/a/x\n",
+        d.main.file_cache_frequent_scanned: "/a/x\n",
+        d.main.file_cache: "top\n/a/\n",
+    }
+    prefs = dict(d.default_prefs, indicator_submenu="->")
+    with mock.patch.object(menu, "prefs", new=prefs), mock.patch.object(
+        menu, "preloaded", new=preloaded, create=True
+    ):
+        assert menu.cache_load() == "plugin\n-> Settings\nvim\n/a/x\ntop\n/a/\n"
+        # Hiding the ranked items keeps the scanned ones among them
+        with mock.patch.object(menu, "show_recent", new=False):
+            assert menu.cache_load() == "plugin\n-> Settings\ntop\n/a/\n/a/x\n"
+
+
+def test_cache_stream_only_shards():
+    preloaded = {
+        d.main.file_cache_plugins: "-> Settings\nplugin\n",
+        d.main.file_cache_aliases: "Firefox\n",
+        d.main.file_cache_binaries: "vim\n",
+        d.main.file_cache_folders: "/a/\n",
+        d.main.file_cache_files: "/a/x\n",
+        d.main.file_cache: "vim\n/a/\n/a/x\nFirefox\n",
+    }
+    prefs = dict(d.default_prefs, indicator_submenu="->")
+    with mock.patch.object(menu, "prefs", new=prefs), mock.patch.object(
+        menu, "preloaded", new=preloaded, create=True
+    ), mock.patch.object(menu, "launch_args", new=[]), mock.patch.object(
+        menu, "show_only", new=None
+    ), mock.patch.object(
+        d.main, "d", new=menu
+    ), mock.patch.object(
+        menu, "which", return_value="/usr/bin/dmenu"
+    ):
+        d.main.init_menu(["--only-files", "--only-apps"])
+        assert menu.cache_load() == "Firefox\nvim\n/a/x\n"
+        # Each launch starts from the full menu again
+        d.main.init_menu(["--only-folders"])
+        assert menu.cache_load() == "/a/\n"
+        d.main.init_menu([])
+        assert menu.show_only is None
+
+
+def test_run_arguments():
+    with mock.patch.object(d.main, "initialise"), mock.patch.object(
+        d.main, "init_menu", return_value=1
+    ) as init_menu, mock.patch.object(
+        sys, "argv", new=["dmenu_extended_run", "-> Settings", "Clear recent entries"]
+    ):
+        # Called again from within a launch, e.g. by clear_recent
+        d.main.run()
+        assert init_menu.call_args[0][0] == []
+        d.main.launch()
+        assert init_menu.call_args[0][0] == ["-> Settings", "Clear recent entries"]
+
+
+def test_launch_spawns_only_menu_and_program(tmp_path):
+    # Processes are recorded with audit hooks, which need Python 3.8
+    if not hasattr(sys, "addaudithook"):
+        return
+    import subprocess
+
+    bin_path = tmp_path / "bin"
+    bin_path.mkdir()
+    fake_menu = bin_path / "dmenu"
+    fake_menu.write_text("#!/bin/sh\ncat >/dev/null\necho true\n")
+    fake_menu.chmod(0o755)
+    env = dict(
+        os.environ,
+        HOME=str(tmp_path / "home"),
+        XDG_CACHE_HOME=str(tmp_path / "home" / ".cache"),
+        PATH=os.pathsep.join([str(bin_path), "/usr/bin", "/bin"]),
+    )
+    os.makedirs(env["HOME"])
+    code = (
+        "import json\n"
+        "from dmenu_extended import main, profiler\n"
+        "main.initialise()\n"
+        "main.d.load_preferences()\n"
+        "main.d.build_cache()\n"
+        "with profiler.record_spawns() as spawns:\n"
+        "    main.run('dmenu_extended_run')\n"
+        "print(json.dumps(spawns))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True)
+    assert result.returncode == 0, result.stderr.decode()
+    spawns = json.loads(result.stdout.decode().splitlines()[-1])
+    # One process to show the menu and one for the program selected
+    assert len(spawns) == 2, spawns
+    assert spawns[0][1][0] == "dmenu"
+    assert spawns[1][1] == ["true"]
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+import json
+import os
+from dmenu_extended import profiler, scanner
+
+
+def test_profile_report(tmp_path):
+    base = str(tmp_path / "home")
+    for folder in ["a/b", "c"]:
+        os.makedirs(os.path.join(base, folder))
+    profile = profiler.Profile()
+    try:
+        profile.roots = [base, str(tmp_path / "other")]
+        with profile.phase("build") as build:
+            with profile.phase("scan") as phase:
+                filenames, foldernames, _ = scanner.scan(
+                    [base], scanner.ScanRules(), timings=profile.directories
+                )
+                phase["items"] = len(foldernames)
+            with profile.phase("allocate"):
+                allocated = [bytearray(1 << 20)]
+            build["items"] = len(allocated)
+        report = profile.save(str(tmp_path / "report.json"))
+    finally:
+        profile.stop()
+
+    with open(str(tmp_path / "report.json")) as f:
+        assert json.load(f) == report
+    assert [phase["name"] for phase in report["phases"]] == [
+        "scan",
+        "allocate",
+        "build",
+    ]
+    scan, allocate, build = report["phases"]
+    assert scan["items"] == 3
+    assert allocate["peak_memory_bytes"] >= 1 << 20
+    assert build["peak_memory_bytes"] >= 1 << 20
+    assert build["wall_seconds"] >= scan["wall_seconds"] + allocate["wall_seconds"]
+    assert report["watch_folders"][0]["directories"] == 4
+    assert report["watch_folders"][1]["directories"] == 0
+    assert len(report["slowest_directories"]) == 4
+
+    lines = profiler.summary(report).split("\n")
+    assert [line.split()[0] for line in lines[1:4]] == ["build", "scan", "allocate"]
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import os
+import scanner
+
+
+def walk_reference(roots, rules):
+    """The os.walk based scan that build_cache used originally"""
+    filenames = []
+    foldernames = []
+    for watchdir in roots:
+        for root, dirs, files in os.walk(
+            watchdir, topdown=True, followlinks=rules.follow_symlinks
+        ):
+            dirs[:] = [
+                d
+                for d in dirs
+                if os.path.join(root, d) not in rules.ignore_folders
+                and d not in rules.global_ignore_folders
+            ]
+            if rules.scan_hidden_folders is False:
+                dirs[:] = [d for d in dirs if d.startswith(".") is False]
+            if rules.scan_hidden_folders or root.find("/.") == -1:
+                for name in files:
+                    if rules.include_hidden_files or name.startswith(".") is False:
+                        if (
+                            rules.valid_extensions is True
+                            or os.path.splitext(name)[1].lower()
+                            in rules.valid_extensions
+                        ):
+                            filenames.append(os.path.join(root, name))
+                for name in dirs:
+                    foldernames.append(os.path.join(root, name) + "/")
+    return filenames, foldernames
+
+
+def make_tree(base):
+    for folder in [
+        "docs/reports",
+        "docs/.hidden",
+        "music/albums/one",
+        "node_modules/pkg",
+        "skip/me",
+        "outside",
+    ]:
+        os.makedirs(os.path.join(base, folder))
+    for path in [
+        "docs/a.pdf",
+        "docs/B.PDF",
+        "docs/notes.txt",
+        "docs/.secret.txt",
+        "docs/reports/r1.pdf",
+        "docs/.hidden/h.pdf",
+        "music/albums/one/track.mp3",
+        "node_modules/pkg/index.js",
+        "skip/me/x.pdf",
+        "outside/o.pdf",
+        "README",
+    ]:
+        with open(os.path.join(base, path), "w") as f:
+            f.write("x")
+    os.symlink(os.path.join(base, "outside"), os.path.join(base, "music/linked"))
+    os.symlink(os.path.join(base, "docs/a.pdf"), os.path.join(base, "link.pdf"))
+
+
+def all_rules(base):
+    for follow_symlinks in [False, True]:
+        for scan_hidden in [False, True]:
+            for valid_extensions in [True, [".pdf", ".mp3", ""]]:
+                yield scanner.ScanRules(
+                    valid_extensions=valid_extensions,
+                    ignore_folders=[os.path.join(base, "skip")],
+                    global_ignore_folders=["node_modules"],
+                    scan_hidden_folders=scan_hidden,
+                    include_hidden_files=scan_hidden,
+                    follow_symlinks=follow_symlinks,
+                )
+
+
+def test_scan_matches_os_walk(tmp_path):
+    base = str(tmp_path)
+    make_tree(base)
+    roots = [base, os.path.join(base, "docs"), os.path.join(base, "missing")]
+    for rules in all_rules(base):
+        expected = walk_reference(roots, rules)
+        for workers in [1, 4]:
+            filenames, foldernames, _ = scanner.scan(roots, rules, workers=workers)
+            assert (filenames, foldernames) == expected
+
+
+def test_incremental_scan_reuses_unchanged_folders(tmp_path):
+    base = str(tmp_path)
+    make_tree(base)
+    rules = scanner.ScanRules(valid_extensions=[".pdf", ".txt"])
+
+    _, _, snapshot = scanner.scan([base], rules)
+    # Pretend every folder was listed long ago so the listings are trusted
+    for path, stored in snapshot.directories.items():
+        stored[0] = os.stat(path).st_mtime_ns
+    stored = snapshot.directories[os.path.join(base, "music")]
+    stored[2] = ["not-really-there.pdf"]
+
+    filenames, _, _ = scanner.scan([base], rules, snapshot)
+    assert os.path.join(base, "music", "not-really-there.pdf") in filenames
+
+    # A folder that changed is listed again
+    with open(os.path.join(base, "docs", "new.pdf"), "w") as f:
+        f.write("x")
+    filenames, foldernames, _ = scanner.scan([base], rules, snapshot)
+    assert os.path.join(base, "docs", "new.pdf") in filenames
+
+
+def test_snapshot_is_discarded_when_rules_change(tmp_path):
+    base = str(tmp_path)
+    make_tree(base)
+    rules = scanner.ScanRules(valid_extensions=[".pdf"])
+    _, _, snapshot = scanner.scan([base], rules)
+
+    other_rules = scanner.ScanRules(valid_extensions=[".txt"])
+    restored = scanner.Snapshot.from_json(snapshot.to_json(), other_rules)
+    assert restored.directories == {}
+    restored = scanner.Snapshot.from_json(snapshot.to_json(), rules)
+    assert restored.directories == snapshot.directories
+
+
+def test_extension_of_matches_splitext():
+    for name in [
+        "a.pdf",
+        "B.PDF",
+        "archive.tar.gz",
+        "README",
+        ".bashrc",
+        "..x",
+        ".hidden.txt",
+        "trailing.",
+        "a..b",
+        "...",
+        ".",
+    ]:
+        assert scanner.extension_of(name) == os.path.splitext(name)[1]
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+import os
+import pytest
+import scanner
+import time
+from dmenu_extended import main, watcher
+
+
+class LimitedBackend(watcher.Poller):
+    """Accepts a fixed number of watches, like a low max_user_watches"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.paths = set()
+
+    def watched(self):
+        return set(self.paths)
+
+    def add(self, path):
+        if len(self.paths) >= self.limit:
+            raise watcher.WatchLimitReached(path)
+        self.paths.add(path)
+        return True
+
+    def remove(self, path):
+        self.paths.discard(path)
+
+
+def make_snapshot(base):
+    for folder in ["a/one", "a/two", "b/three"]:
+        os.makedirs(os.path.join(base, folder))
+    rules = scanner.ScanRules()
+    _, _, snapshot = scanner.scan([base], rules)
+    for path, stored in snapshot.directories.items():
+        stored[0] = os.stat(path).st_mtime_ns
+    return snapshot
+
+
+def test_watch_limit_falls_back_to_polling(tmp_path):
+    base = str(tmp_path)
+    main.d.snapshot = make_snapshot(base)
+    try:
+        instance = watcher.Watcher(LimitedBackend(limit=3))
+        assert instance.sync_watches() == set()
+        watched = instance.backend.watched()
+        assert len(watched) == 3
+        for path in main.d.snapshot.directories:
+            assert (path in watched) != instance.is_polled(path)
+        assert instance.poll() == set()
+
+        polled = sorted(instance.polled)[0]
+        time.sleep(0.01)
+        os.makedirs(os.path.join(polled, "new"))
+        assert instance.poll() == {polled}
+    finally:
+        main.d.snapshot = None
+
+
+@pytest.mark.skipif(not watcher.Inotify.available(), reason="inotify unavailable")
+def test_inotify_reports_changed_folder(tmp_path):
+    backend = watcher.Inotify()
+    try:
+        assert backend.add(str(tmp_path))
+        open(os.path.join(str(tmp_path), "new.txt"), "w").close()
+        events = backend.read(timeout=5)
+        assert (str(tmp_path), watcher.IN_CREATE) in events
+    finally:
+        backend.close()
+
+
+def test_update_scanned_matches_full_build(tmp_path):
+    import json
+    import subprocess
+    import sys
+
+    bin_path = tmp_path / "bin"
+    bin_path.mkdir()
+    (bin_path / "tool").write_text("#!/bin/sh\n")
+    (bin_path / "tool").chmod(0o755)
+    code = (
+        "import json, mock, os, sys\n"
+        "from dmenu_extended import main\n"
+        "main.initialise()\n"
+        "d = main.d\n"
+        "d.load_preferences()\n"
+        "d.prefs['include_binaries'] = True\n"
+        "docs = os.path.expanduser('~/docs')\n"
+        "d.prefs['exclude_items'] = ['tool', os.path.join(docs, 'skip.txt')]\n"
+        "paths = [main.file_cache, main.file_cache_files, main.file_cache_folders]\n"
+        "paths.append(main.file_cache_binaries)\n"
+        "d.build_cache(format=sys.argv[1])\n"
+        "# Published by another process after the watcher started\n"
+        "other = main.dmenu()\n"
+        "other.prefs = d.prefs\n"
+        "open(os.path.join(sys.argv[2], 'newtool'), 'w').close()\n"
+        "os.chmod(os.path.join(sys.argv[2], 'newtool'), 0o755)\n"
+        "other.build_cache(format=sys.argv[1])\n"
+        "for name in ['b.txt', 'skip.txt', 'a-much-longer-name.txt']:\n"
+        "    open(os.path.join(docs, name), 'w').close()\n"
+        "os.makedirs(os.path.join(docs, 'new'))\n"
+        "with mock.patch.object(d, 'scan_applications') as apps, mock.patch.object(\n"
+        "    d, 'scan_binaries'\n"
+        ") as scan_binaries:\n"
+        "    d.update_scanned({docs})\n"
+        "updated = [d.cache_open(path) for path in paths]\n"
+        "current = d.cache_path(main.file_cache_aliasesStore)\n"
+        "carried = os.path.samefile(other.cache_path(main.file_cache_aliasesStore),"
+        " current)\n"
+        "scans = apps.call_count + scan_binaries.call_count\n"
+        "d.build_cache(full=True, format=sys.argv[1])\n"
+        "full = [d.cache_open(path) for path in paths]\n"
+        "print(json.dumps([updated, full, carried, scans]))\n"
+    )
+    for cache_format in ["text", "binary"]:
+        home = tmp_path / cache_format
+        os.makedirs(str(home / "docs" / "old"))
+        (home / "docs" / "old" / "a.txt").write_text("")
+        env = dict(
+            os.environ,
+            HOME=str(home),
+            XDG_CACHE_HOME=str(home / ".cache"),
+            XDG_DATA_DIRS=str(tmp_path / "share"),
+            XDG_DATA_HOME=str(tmp_path / "share"),
+            PATH=str(bin_path),
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code, cache_format, str(bin_path)],
+            env=env,
+            capture_output=True,
+        )
+        assert result.returncode == 0, result.stderr.decode()
+        updated, full, carried, scans = json.loads(
+            result.stdout.decode().splitlines()[-1]
+        )
+        assert updated == full
+        assert "newtool" in updated[3].split("\n")
+        assert "tool" not in updated[0].split("\n")
+        assert str(home / "docs" / "skip.txt") not in updated[1]
+        assert str(home / "docs" / "b.txt") in updated[1].split("\n")
+        assert str(home / "docs" / "new") + "/" in updated[2].split("\n")
+        # Nothing else is scanned again or rewritten
+        assert scans == 0
+        assert carried